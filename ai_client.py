@@ -0,0 +1,201 @@
+# =============================================================
+# Shadow AI — Cliente HTTP para el proveedor de IA (/ai-suggest)
+# =============================================================
+# Sesión requests con pool de conexiones keep-alive (reutiliza TCP/TLS entre
+# sugerencias) y circuit breaker: tras N fallos consecutivos (5xx, 429,
+# timeout o error de conexión) el circuito se abre y las peticiones fallan al
+# instante; pasado el tiempo de reset se deja pasar una única petición de
+# prueba (half-open) que decide si se cierra o se vuelve a abrir.
+# Además: caché LRU+TTL de sugerencias y single-flight para peticiones idénticas.
+
+import hashlib
+import logging
+import threading
+import time as _time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger("shadowai.ai_client")
+
+CB_CLOSED    = "closed"
+CB_OPEN      = "open"
+CB_HALF_OPEN = "half_open"
+
+
+def create_session(pool_size=10):
+    """Sesión con pool keep-alive; sin reintentos automáticos (los gestiona el circuit breaker)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe con estado half-open de una sola petición de prueba."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CB_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"opened": 0, "rejected": 0, "successes": 0, "failures": 0}
+
+    def allow(self):
+        """True si la petición puede ir al upstream."""
+        with self._lock:
+            if self._state == CB_CLOSED:
+                return True
+            if self._state == CB_OPEN and _time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = CB_HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == CB_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def retry_after(self):
+        """Segundos hasta el próximo intento de prueba (para la cabecera Retry-After)."""
+        with self._lock:
+            if self._state != CB_OPEN:
+                return 1
+            return max(1, int(self.reset_timeout - (_time.monotonic() - self._opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self._failures = 0
+            self._state = CB_CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.stats["failures"] += 1
+            self._failures += 1
+            if self._state == CB_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != CB_OPEN:
+                    self.stats["opened"] += 1
+                    log.warning(f"⚠️ Circuit breaker IA abierto tras {self._failures} fallos consecutivos "
+                          f"(reintento en {self.reset_timeout:.0f}s)")
+                self._state = CB_OPEN
+                self._opened_at = _time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self):
+        """Libera la prueba half-open si la petición terminó sin veredicto (p. ej. un 4xx del cliente)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def describe(self):
+        with self._lock:
+            return dict(self.stats, state=self._state, consecutive_failures=self._failures)
+
+
+# =============================================================
+# Caché de sugerencias (LRU + TTL) y single-flight
+# =============================================================
+def suggestion_cache_key(mode, text, selection, policy):
+    """Hash normalizado (espacios colapsados) de los campos que determinan el prompt."""
+    def norm(value):
+        return " ".join(str(value or "").split())
+    raw = "\x1f".join([norm(mode), norm(text), norm(selection), norm(policy)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SuggestionCache:
+    """LRU con TTL, acotada por número de entradas y por memoria aproximada (bytes UTF-8)."""
+
+    def __init__(self, ttl=300.0, max_entries=2000, max_bytes=8 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()     # key → (expira_en, valor, bytes)
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            if item[0] < _time.monotonic():
+                self._remove(key)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[1]
+
+    def put(self, key, value):
+        size = len(key) + len(value.encode("utf-8"))
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (_time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._items)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        """Llamar con _lock adquirido."""
+        _, _, size = self._items.pop(key)
+        self._bytes -= size
+
+    def describe(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self._items), bytes=self._bytes,
+                        hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+
+class SingleFlight:
+    """Coalesce llamadas idénticas en vuelo: sólo la primera ejecuta fn, el resto espera su resultado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}        # key → {"done": Event, "result": ...}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        """Devuelve (resultado, compartido). Si fn lanza, la excepción se propaga a todos."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                leader = True
+                self.stats["leaders"] += 1
+            else:
+                leader = False
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+        return call["result"], False
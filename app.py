@@ -5,21 +5,157 @@
 import os
 import os.path
 import json
+import socket
 import time as _time
 import threading
-import traceback
 import requests
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from datetime import datetime, timezone
+from flask import Flask, Response, request, jsonify, send_from_directory, g
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 import gspread
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from wal import SegmentedLog
+from storage import StorageSink, SQLiteSink, RotatingFileSink, StackedSink
+from shared_queue import SharedEventQueue, FlusherElection
+from outbox import ResultsOutbox, OUTBOX_DUPLICATE
+from dedupe import EventDeduper
+from event_queue import BoundedEventQueue, QueueFull, QUEUE_REJECTED
+from flusher import AdaptiveFlusher
+from batch_codec import BodyTooLarge, decode_body, parse_batch, supported_encodings
+from blobs import BlobStore, BLOB_HEADERS, blob_refs
+from shards import ShardPlanner, SHARD_INDEX_HEADERS
+from ai_client import create_session, CircuitBreaker, SuggestionCache, SingleFlight, suggestion_cache_key
+from quota import SheetsQuotaGovernor, QuotaExhausted, api_error_status, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from metrics import MetricsRegistry, SIZE_BUCKETS
+from bulkhead import Bulkhead, BulkheadFull
+from static_assets import StaticAssets
+from traffic import TrafficRecorder
+from logs import setup_logging, logging_stats, fields, new_request_id, request_id, Sampler
 
 # =============================================================
 # CONFIGURACIÓN — VARIABLES DE ENTORNO
 # =============================================================
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")  # Stub local para tests/benchmarks
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "10"))
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "10"))           # Conexiones keep-alive reutilizables
+OPENAI_CB_FAILURES = int(os.getenv("OPENAI_CB_FAILURES", "5"))        # Fallos consecutivos que abren el circuito
+OPENAI_CB_RESET_SEC = float(os.getenv("OPENAI_CB_RESET_SEC", "30"))   # Tiempo en abierto antes de probar (half-open)
+# Bulkhead de OpenAI: llamadas simultáneas, peticiones en espera y segundos máximos de espera antes del 503
+BULKHEAD_OPENAI_MAX = int(os.getenv("BULKHEAD_OPENAI_MAX", str(OPENAI_POOL_SIZE)))
+BULKHEAD_OPENAI_QUEUE = int(os.getenv("BULKHEAD_OPENAI_QUEUE", "10"))
+BULKHEAD_OPENAI_WAIT_SEC = float(os.getenv("BULKHEAD_OPENAI_WAIT_SEC", "1"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "300"))                # Segundos de vida de una sugerencia cacheada (0 = sin caché)
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2000"))
+AI_CACHE_MAX_MB = float(os.getenv("AI_CACHE_MAX_MB", "8"))
+# Políticas (condiciones experimentales) que siempre piden una muestra nueva, separadas por comas
+AI_CACHE_DISABLED_POLICIES = {p.strip() for p in os.getenv("AI_CACHE_DISABLED_POLICIES", "").split(",") if p.strip()}
 GOOGLE_SHEETS_CREDENTIALS = os.getenv("GOOGLE_SHEETS_CREDENTIALS")  # JSON de credenciales
 GOOGLE_SHEET_NAME = os.getenv("GOOGLE_SHEET_NAME", "Shadow AI - Experimento")  # Nombre de tu Google Sheet
+GOOGLE_SHEET_KEY = os.getenv("GOOGLE_SHEET_KEY", "")  # ID del spreadsheet (de su URL); si falta, se resuelve por nombre una vez
+SHEETS_KEYS_PATH = os.getenv("SHEETS_KEYS_PATH", "data/sheets_keys.json")  # Keys resueltas por nombre ("" = no persistir)
+SHEETS_TOKEN_REFRESH_MARGIN = float(os.getenv("SHEETS_TOKEN_REFRESH_MARGIN", "300"))  # Renovar el token N s antes de caducar
+# Bulkhead de Sheets para las rutas que esperan a Sheets (/log-batch síncrono, /finalize sin outbox,
+# /health/deep, /flush-events); los hilos de fondo (flusher, outbox) no pasan por él
+BULKHEAD_SHEETS_MAX = int(os.getenv("BULKHEAD_SHEETS_MAX", "4"))
+BULKHEAD_SHEETS_QUEUE = int(os.getenv("BULKHEAD_SHEETS_QUEUE", "16"))
+BULKHEAD_SHEETS_WAIT_SEC = float(os.getenv("BULKHEAD_SHEETS_WAIT_SEC", "2"))
+EVENTS_WAL_DIR = os.getenv("EVENTS_WAL_DIR", "")  # Directorio del WAL de eventos ("" = desactivado, cola en memoria)
+EVENTS_WAL_SEGMENT_MB = float(os.getenv("EVENTS_WAL_SEGMENT_MB", "4"))  # Tamaño máximo de cada segmento
+
+# Cola en memoria (sin WAL): techo de memoria y spill a disco cuando se llena.
+# Cada worker usa su propio subdirectorio de EVENTS_SPILL_DIR (y adopta los de workers muertos)
+EVENTS_QUEUE_MAX_MB = float(os.getenv("EVENTS_QUEUE_MAX_MB", "32"))
+EVENTS_SPILL_DIR = os.getenv("EVENTS_SPILL_DIR", "data/events_spill")   # "" = sin spill, /log rechaza al llenarse
+EVENTS_SPILL_MAX_MB = float(os.getenv("EVENTS_SPILL_MAX_MB", "512"))
+
+# Flusher adaptativo (cola en memoria y WAL): espera máxima de un evento antes de escribirse,
+# intervalo mínimo entre escrituras y fracción de la cuota de escritura de Sheets para eventos
+FLUSH_MAX_LAG_SEC = float(os.getenv("FLUSH_MAX_LAG_SEC", "10"))
+FLUSH_MIN_INTERVAL_SEC = float(os.getenv("FLUSH_MIN_INTERVAL_SEC", "0.5"))
+FLUSH_QUOTA_SHARE = float(os.getenv("FLUSH_QUOTA_SHARE", "0.5"))
+
+# /log-batch: tamaño máximo del lote ya descomprimido (protege contra zip bombs)
+LOG_BATCH_MAX_BYTES = int(float(os.getenv("LOG_BATCH_MAX_MB", "2")) * 1024 * 1024)
+
+# Blobs: campos de payload de BLOB_MIN_BYTES o más se guardan aparte (por hash, con deltas)
+# y payload_json sólo lleva la referencia ("" = desactivado, todo va en la celda como antes)
+BLOB_DIR = os.getenv("BLOB_DIR", "data/blobs")
+BLOB_MIN_BYTES = int(os.getenv("BLOB_MIN_BYTES", "1024"))
+BLOB_REPLICATE = os.getenv("BLOB_REPLICATE", "1") == "1"    # Copiar también a la tabla "blobs" del almacenamiento
+
+# Shards de la hoja "events" en Google Sheets (ver shards.py): "rows" → events_0001, events_0002, …
+# cada EVENTS_SHARD_MAX_ROWS filas; "daily" → events_2026_10_17, …; "" (por defecto) = una sola hoja "events".
+# Requiere INGEST_MODE=shared: el estado del shard activo vive en el proceso que escribe los eventos
+EVENTS_SHARD_MODE = os.getenv("EVENTS_SHARD_MODE", "").strip().lower()
+EVENTS_SHARD_MAX_ROWS = int(os.getenv("EVENTS_SHARD_MAX_ROWS", "200000"))
+EVENTS_SHARD_PER_SPREADSHEET = int(os.getenv("EVENTS_SHARD_PER_SPREADSHEET", "0"))  # 0 = todos en el spreadsheet principal
+EVENTS_SHARD_INDEX_SEC = float(os.getenv("EVENTS_SHARD_INDEX_SEC", "300"))          # Cada cuánto se actualiza el índice
+# Emails con los que compartir los spreadsheets nuevos (la cuenta de servicio es su propietaria)
+EVENTS_SHARD_SHARE_WITH = [e.strip() for e in os.getenv("EVENTS_SHARD_SHARE_WITH", "").split(",") if e.strip()]
+
+# Ingesta multi-proceso (gunicorn con varios workers): "local" = cola propia de cada proceso,
+# "shared" = cola SQLite compartida y un único flusher elegido por file lock
+INGEST_MODE = os.getenv("INGEST_MODE", "local").strip().lower()
+SHARED_QUEUE_PATH = os.getenv("SHARED_QUEUE_PATH", "data/ingest_queue.db")
+FLUSHER_LOCK_PATH = os.getenv("FLUSHER_LOCK_PATH", "data/flusher.lock")
+
+# Outbox de /finalize: la fila de resultados se guarda en local y se entrega en segundo plano
+# ("" = desactivado, /finalize escribe de forma síncrona como antes)
+FINALIZE_OUTBOX_PATH = os.getenv("FINALIZE_OUTBOX_PATH", "data/outbox.db")
+
+# Sinks de almacenamiento: lista separada por comas de "sheets", "sqlite", "file".
+# El primero es el principal (síncrono); el resto son réplicas asíncronas.
+# Ej.: STORAGE_SINKS="sqlite,sheets" → escribe en SQLite a velocidad de disco y sincroniza Sheets en segundo plano
+STORAGE_SINKS = os.getenv("STORAGE_SINKS", "sheets")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "data/shadowai.db")
+STORAGE_FILE_DIR = os.getenv("STORAGE_FILE_DIR", "data/exports")
+STORAGE_FILE_FORMAT = os.getenv("STORAGE_FILE_FORMAT", "jsonl")   # "jsonl" o "csv"
+STORAGE_FILE_MAX_MB = float(os.getenv("STORAGE_FILE_MAX_MB", "50"))
+
+# Cuota de la API de Google Sheets (por defecto, la cuota por usuario: 60 lecturas y 60 escrituras/min)
+SHEETS_READ_PER_MIN  = float(os.getenv("SHEETS_READ_PER_MIN", "60"))
+SHEETS_WRITE_PER_MIN = float(os.getenv("SHEETS_WRITE_PER_MIN", "60"))
+SHEETS_QUOTA_RESERVE = float(os.getenv("SHEETS_QUOTA_RESERVE", "0.1"))   # Fracción reservada para /finalize
+SHEETS_QUOTA_MAX_WAIT = float(os.getenv("SHEETS_QUOTA_MAX_WAIT", "20"))  # Espera máxima por cuota (s)
+
+# Logging (ver logs.py): nivel, formato "text" o "json", tamaño de la cola del hilo escritor
+# (si se llena se descartan líneas), 1 de cada N líneas por evento de /log, y como mucho
+# LOG_ERROR_BURST avisos/errores por sitio de llamada cada LOG_ERROR_WINDOW_SEC
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_EVENT_SAMPLE_EVERY = int(os.getenv("LOG_EVENT_SAMPLE_EVERY", "100"))
+LOG_ERROR_BURST = int(os.getenv("LOG_ERROR_BURST", "5"))
+LOG_ERROR_WINDOW_SEC = float(os.getenv("LOG_ERROR_WINDOW_SEC", "60"))
+
+# Estáticos (ver static_assets.py): bundles con huella declarados en index.html y caché en memoria
+# de public/ con gzip/brotli precalculados (STATIC_CACHE_MAX_MB=0 → todo desde disco como antes)
+STATIC_BUNDLES = os.getenv("STATIC_BUNDLES", "1") == "1"
+STATIC_CACHE_MAX_MB = float(os.getenv("STATIC_CACHE_MAX_MB", "64"))
+
+# Grabación de tráfico para replay.py (ver traffic.py): "" = desactivada. Se graba la sesión
+# completa de una fracción de participantes, con los campos personales redactados: contacto,
+# los datos demográficos que juntos identifican a alguien (fecha de nacimiento, sexo,
+# universidad, titulación, año de graduación, nota) y el texto libre (tarea y sugerencias)
+TRAFFIC_RECORD_DIR = os.getenv("TRAFFIC_RECORD_DIR", "")
+TRAFFIC_SAMPLE_RATE = float(os.getenv("TRAFFIC_SAMPLE_RATE", "0.1"))
+TRAFFIC_PATHS = [p.strip() for p in os.getenv(
+    "TRAFFIC_PATHS", "/log,/log-batch,/finalize,/flush-events,/ai-suggest,/ai-suggest/stream").split(",") if p.strip()]
+TRAFFIC_REDACT_FIELDS = [f.strip() for f in os.getenv(
+    "TRAFFIC_REDACT_FIELDS",
+    "email,correo,phone,telefono,name,nombre,"
+    "dob,sex,studies,grad_year,uni,uni_other,field,gpa,"
+    "task_text,text,selection,suggestion").split(",") if f.strip()]
+TRAFFIC_MAX_MB = float(os.getenv("TRAFFIC_MAX_MB", "50"))          # Por fichero antes de rotar
+TRAFFIC_MAX_FILES = int(os.getenv("TRAFFIC_MAX_FILES", "20"))      # Se borran los más antiguos
+
+# =============================================================
+# LOGGING
+# =============================================================
+log = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_ERROR_BURST, LOG_ERROR_WINDOW_SEC)
+_event_log_sample = Sampler(LOG_EVENT_SAMPLE_EVERY)
 
 # =============================================================
 # VALIDACIÓN DE CONFIGURACIÓN AL INICIO
@@ -30,9 +166,9 @@ def validate_environment():
 
     # Validar OpenAI API Key (solo advertencia, no crítico)
     if not OPENAI_API_KEY:
-        print("⚠️ WARNING: OPENAI_API_KEY no configurado - la funcionalidad de sugerencias de IA no estará disponible")
+        log.warning("⚠️ WARNING: OPENAI_API_KEY no configurado - la funcionalidad de sugerencias de IA no estará disponible")
     elif len(OPENAI_API_KEY.strip()) < 20:
-        print("⚠️ WARNING: OPENAI_API_KEY parece inválido (muy corto)")
+        log.warning("⚠️ WARNING: OPENAI_API_KEY parece inválido (muy corto)")
 
     # Validar Google Sheets Credentials (crítico para guardar datos)
     if not GOOGLE_SHEETS_CREDENTIALS:
@@ -51,44 +187,127 @@ def validate_environment():
 
     # Reportar errores
     if errors:
-        print("\n" + "="*60)
-        print("❌ ERRORES DE CONFIGURACIÓN CRÍTICOS:")
-        for error in errors:
-            print(f"   • {error}")
-        print("="*60 + "\n")
-        print("⚠️  El experimento puede fallar al guardar datos.")
-        print("⚠️  Por favor, configura las variables de entorno correctamente.")
-        print()
+        log.error("❌ ERRORES DE CONFIGURACIÓN CRÍTICOS:\n%s\n"
+                  "⚠️  El experimento puede fallar al guardar datos. "
+                  "Por favor, configura las variables de entorno correctamente.",
+                  "\n".join(f"   • {error}" for error in errors))
     else:
-        print("✅ Configuración validada correctamente")
+        log.info("✅ Configuración validada correctamente")
 
     return len(errors) == 0
 
 # Validar al cargar el módulo
 validate_environment()
 
+# =============================================================
+# MÉTRICAS (/metrics, formato Prometheus)
+# =============================================================
+# Contadores e histogramas con un shard por hilo (ver metrics.py): instrumentar
+# el hot path no añade locks compartidos ni contención con las colas de eventos.
+# Los gauges (colas, bulkheads, circuito) se calculan sólo al hacer scrape.
+_metrics = MetricsRegistry(prefix="shadowai_")
+_m_http_latency = _metrics.histogram(
+    "http_request_duration_seconds", "Latencia por ruta hasta enviar las cabeceras", ("route", "method", "status"))
+_m_sheets_calls = _metrics.counter(
+    "sheets_api_calls_total", "Llamadas a la API de Sheets por tipo y resultado (ok, código HTTP, error, quota_exhausted)",
+    ("kind", "outcome"))
+_m_sheets_latency = _metrics.histogram(
+    "sheets_api_duration_seconds", "Duración de las llamadas a Sheets (sin la espera de cuota)", ("kind",))
+_m_sheets_auth = _metrics.counter(
+    "sheets_auth_total", "Autenticaciones con Google: login inicial y renovaciones de token", ("kind", "outcome"))
+_m_flush_latency = _metrics.histogram(
+    "flush_events_duration_seconds", "Duración de cada flush_events (skipped = otro flush en curso o no líder)", ("outcome",))
+_m_flush_rows = _metrics.histogram(
+    "flush_events_rows", "Eventos escritos por cada flush_events", buckets=SIZE_BUCKETS)
+_m_write_rows = _metrics.histogram(
+    "write_batch_rows", "Filas por tabla en cada escritura agrupada", ("table",), SIZE_BUCKETS)
+_m_write_latency = _metrics.histogram(
+    "write_batch_duration_seconds", "Duración de cada escritura agrupada al almacenamiento", ("outcome",))
+_m_openai_calls = _metrics.counter(
+    "openai_requests_total", "Llamadas al upstream de IA por resultado (código HTTP, timeout, connection_error, "
+    "network_error, circuit_open, stream_broken)", ("endpoint", "status"))
+_m_openai_latency = _metrics.histogram(
+    "openai_request_duration_seconds", "Latencia del upstream de IA hasta la respuesta (cabeceras en stream)", ("endpoint",))
+_m_openai_ttft = _metrics.histogram(
+    "openai_ttft_seconds", "Tiempo hasta el primer token en /ai-suggest/stream")
+
+def _observe_openai(endpoint, status, started=None):
+    """Cuenta una llamada al upstream de IA (started: perf_counter al enviarla)."""
+    _m_openai_calls.inc(endpoint, str(status))
+    if started is not None:
+        _m_openai_latency.observe(_time.perf_counter() - started, endpoint)
+
 # =============================================================
 # INICIALIZAR GOOGLE SHEETS
 # =============================================================
+# Todas las llamadas a gspread pasan por este gobernador (ver quota.py)
+_sheets_governor = SheetsQuotaGovernor(
+    read_per_min=SHEETS_READ_PER_MIN,
+    write_per_min=SHEETS_WRITE_PER_MIN,
+    reserve_fraction=SHEETS_QUOTA_RESERVE,
+    max_wait=SHEETS_QUOTA_MAX_WAIT,
+)
+
+def _sheets_read(fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+    return _sheets_call("read", fn, *args, priority=priority, **kwargs)
+
+def _sheets_write(fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+    return _sheets_call("write", fn, *args, priority=priority, **kwargs)
+
+def _sheets_call(kind, fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+    """Llamada a gspread a través del gobernador, contando resultado y duración."""
+    def timed(*a, **kw):
+        started = _time.perf_counter()
+        try:
+            return fn(*a, **kw)
+        finally:
+            _m_sheets_latency.observe(_time.perf_counter() - started, kind)
+
+    outcome = "error"
+    try:
+        result = _sheets_governor.call(kind, timed, *args, priority=priority, **kwargs)
+        outcome = "ok"
+        return result
+    except QuotaExhausted:
+        outcome = "quota_exhausted"
+        raise
+    except Exception as e:
+        outcome = str(api_error_status(e) or "error")
+        raise
+    finally:
+        _m_sheets_calls.inc(kind, outcome)
+
+# Compartimento de las rutas que esperan a Sheets: si Sheets va lento, como mucho
+# BULKHEAD_SHEETS_MAX + BULKHEAD_SHEETS_QUEUE workers quedan esperando y el resto
+# recibe 503 al momento, así /log y los estáticos siguen teniendo workers libres
+_sheets_bulkhead = Bulkhead("sheets", BULKHEAD_SHEETS_MAX, BULKHEAD_SHEETS_QUEUE, BULKHEAD_SHEETS_WAIT_SEC)
+
+def _bulkhead_rejected(e, **extra):
+    """Respuesta 503 rápida cuando un bulkhead está saturado."""
+    log.warning(f"⚠️ {request.path} rechazado: {e}")
+    body = dict({"ok": False, "error": "Servicio saturado, intenta de nuevo en unos segundos",
+                 "bulkhead": e.name}, **extra)
+    return jsonify(body), 503, {"Retry-After": str(e.retry_after)}
+
 def get_google_sheets_client():
     """Conectar con Google Sheets usando credenciales de servicio"""
     try:
         if not GOOGLE_SHEETS_CREDENTIALS:
-            print("⚠️ ERROR: GOOGLE_SHEETS_CREDENTIALS no configurado")
+            log.error("⚠️ ERROR: GOOGLE_SHEETS_CREDENTIALS no configurado")
             return None
 
         # Parsear credenciales desde variable de entorno
         try:
             creds_dict = json.loads(GOOGLE_SHEETS_CREDENTIALS)
         except json.JSONDecodeError as e:
-            print(f"⚠️ ERROR: GOOGLE_SHEETS_CREDENTIALS contiene JSON inválido: {e}")
+            log.error(f"⚠️ ERROR: GOOGLE_SHEETS_CREDENTIALS contiene JSON inválido: {e}")
             return None
 
         # Validar que tenga las claves necesarias
         required_keys = ['type', 'project_id', 'private_key', 'client_email']
         missing_keys = [key for key in required_keys if key not in creds_dict]
         if missing_keys:
-            print(f"⚠️ ERROR: Credenciales falta claves requeridas: {', '.join(missing_keys)}")
+            log.error(f"⚠️ ERROR: Credenciales falta claves requeridas: {', '.join(missing_keys)}")
             return None
 
         # Conectar con Google Sheets usando service_account_from_dict (compatible gspread 5.x y 6.x)
@@ -99,46 +318,47 @@ def get_google_sheets_client():
         try:
             client = gspread.service_account_from_dict(creds_dict, scopes=scopes)
             # Verificar que el cliente funciona intentando listar spreadsheets
-            print(f"✅ Google Sheets autenticado como: {creds_dict.get('client_email', '?')}")
+            log.info(f"✅ Google Sheets autenticado como: {creds_dict.get('client_email', '?')}")
             return client
         except Exception as e:
-            print(f"⚠️ ERROR: Error autenticando con Google Sheets: {type(e).__name__}: {e}")
+            log.error(f"⚠️ ERROR: Error autenticando con Google Sheets: {type(e).__name__}: {e}")
             return None
 
     except Exception as e:
-        print(f"⚠️ ERROR inesperado conectando con Google Sheets: {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR inesperado conectando con Google Sheets: {type(e).__name__}: {e}")
         return None
 
 def get_or_create_worksheet(client, sheet_name, worksheet_name, headers):
     """Obtener o crear una hoja de trabajo. Si ya existe, asegura que tenga suficientes columnas."""
     if not client:
-        print(f"⚠️ ERROR: Cliente de Google Sheets es None")
+        log.error(f"⚠️ ERROR: Cliente de Google Sheets es None")
         return None
 
     try:
-        spreadsheet = client.open(sheet_name)
+        spreadsheet = open_spreadsheet(client, sheet_name)
     except gspread.exceptions.SpreadsheetNotFound:
-        print(f"⚠️ ERROR: Spreadsheet '{sheet_name}' no encontrado")
+        log.error(f"⚠️ ERROR: Spreadsheet '{sheet_name}' no encontrado")
         return None
     except Exception as e:
-        print(f"⚠️ ERROR abriendo spreadsheet: {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR abriendo spreadsheet: {type(e).__name__}: {e}")
         return None
 
     # Obtener o crear la worksheet
     try:
-        worksheet = spreadsheet.worksheet(worksheet_name)
-        print(f"✅ Worksheet '{worksheet_name}' encontrada")
+        worksheet = _sheets_read(spreadsheet.worksheet, worksheet_name)
+        log.info(f"✅ Worksheet '{worksheet_name}' encontrada")
     except gspread.exceptions.WorksheetNotFound:
         try:
-            worksheet = spreadsheet.add_worksheet(title=worksheet_name, rows=2000, cols=len(headers))
-            worksheet.append_row(headers, value_input_option='RAW')
-            print(f"✅ Creada nueva worksheet '{worksheet_name}' con {len(headers)} columnas")
+            worksheet = _sheets_write(spreadsheet.add_worksheet, title=worksheet_name, rows=2000, cols=len(headers))
+            _sheets_write(worksheet.append_row, headers, value_input_option='RAW')
+            log.info(f"✅ Creada nueva worksheet '{worksheet_name}' con {len(headers)} columnas")
             return worksheet
         except Exception as e:
-            print(f"⚠️ ERROR creando worksheet '{worksheet_name}': {type(e).__name__}: {e}")
+            log.error(f"⚠️ ERROR creando worksheet '{worksheet_name}': {type(e).__name__}: {e}")
             return None
     except Exception as e:
-        print(f"⚠️ ERROR accediendo a worksheet '{worksheet_name}': {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR accediendo a worksheet '{worksheet_name}': {type(e).__name__}: {e}")
+        forget_spreadsheet(sheet_name)   # Se reabre en el próximo intento (p. ej. si lo movieron)
         return None
 
     # ── CRÍTICO: Asegurar que la worksheet tiene suficientes columnas ──
@@ -147,19 +367,19 @@ def get_or_create_worksheet(client, sheet_name, worksheet_name, headers):
     try:
         current_cols = worksheet.col_count
         if current_cols < len(headers):
-            print(f"⚠️ Worksheet '{worksheet_name}' tiene {current_cols} columnas, necesita {len(headers)}. Redimensionando...")
-            worksheet.resize(rows=max(worksheet.row_count, 2000), cols=len(headers))
-            print(f"✅ Worksheet '{worksheet_name}' redimensionada a {len(headers)} columnas")
+            log.warning(f"⚠️ Worksheet '{worksheet_name}' tiene {current_cols} columnas, necesita {len(headers)}. Redimensionando...")
+            _sheets_write(worksheet.resize, rows=max(worksheet.row_count, 2000), cols=len(headers))
+            log.info(f"✅ Worksheet '{worksheet_name}' redimensionada a {len(headers)} columnas")
             # Actualizar cabeceras sólo si la primera fila no las tiene
             try:
-                first_row = worksheet.row_values(1)
+                first_row = _sheets_read(worksheet.row_values, 1)
                 if not first_row or first_row[:len(headers)] != headers:
-                    worksheet.update('A1', [headers], value_input_option='RAW')
-                    print(f"✅ Cabeceras actualizadas en '{worksheet_name}'")
+                    _sheets_write(worksheet.update, 'A1', [headers], value_input_option='RAW')
+                    log.info(f"✅ Cabeceras actualizadas en '{worksheet_name}'")
             except Exception as e:
-                print(f"⚠️ No se pudieron actualizar cabeceras (no crítico): {e}")
+                log.warning(f"⚠️ No se pudieron actualizar cabeceras (no crítico): {e}")
     except Exception as e:
-        print(f"⚠️ No se pudo verificar/redimensionar columnas de '{worksheet_name}': {type(e).__name__}: {e}")
+        log.warning(f"⚠️ No se pudo verificar/redimensionar columnas de '{worksheet_name}': {type(e).__name__}: {e}")
         # Continuamos igualmente — append_rows intentará escribir
 
     return worksheet
@@ -168,188 +388,1072 @@ def get_or_create_worksheet(client, sheet_name, worksheet_name, headers):
 # CACHÉ DE GOOGLE SHEETS (evita reconectar en cada request)
 # =============================================================
 _sheets_cache = {
-    "client": None,
-    "worksheets": {},         # worksheet_name → worksheet object
-    "last_auth": 0,           # timestamp de última autenticación exitosa
+    "client": None,           # Se crea una sola vez; el token se renueva en segundo plano
+    "spreadsheets": {},       # nombre → Spreadsheet abierto (por key)
+    "keys": {},               # nombre → ID del spreadsheet (persistido en SHEETS_KEYS_PATH)
+    "worksheets": {},         # worksheet_name → worksheet object ("events" → shard activo si hay sharding)
+    "last_auth": 0,           # timestamp de la última autenticación o renovación del token
     "last_auth_failure": 0    # timestamp del último fallo de autenticación
 }
 
-AUTH_TTL = 300              # Reautenticar cada 5 minutos
 AUTH_FAILURE_COOLDOWN = 60  # Esperar 60s antes de reintentar tras fallo de auth
+TOKEN_REFRESH_RETRY = 30    # Reintento tras un fallo al renovar el token
 
 _cache_lock = threading.Lock()  # Protege lectura/escritura de _sheets_cache
 _auth_lock  = threading.Lock()  # Serializa llamadas a get_google_sheets_client() (evita thundering herd)
+_refresher_started = False
 
 def get_cached_client():
     """Obtiene cliente de Google Sheets con caché, thread-safe.
-    Usa double-checked locking para evitar thundering herd bajo carga concurrente."""
+    El cliente se crea una vez y no se reemplaza: _credential_refresher renueva el token sobre
+    las mismas credenciales, así que spreadsheets y worksheets cacheadas siguen siendo válidas."""
     now = _time.time()
 
     # Fast path: verificar bajo _cache_lock
     with _cache_lock:
+        if _sheets_cache["client"]:
+            return _sheets_cache["client"]
         failure = _sheets_cache["last_auth_failure"]
         if failure > 0 and (now - failure) < AUTH_FAILURE_COOLDOWN:
-            return _sheets_cache["client"]
-        if _sheets_cache["client"] and (now - _sheets_cache["last_auth"]) < AUTH_TTL:
-            return _sheets_cache["client"]
+            return None
 
-    # Slow path: necesitamos reautenticar; _auth_lock serializa para que solo un thread lo haga
+    # Slow path: primera autenticación; _auth_lock serializa para que solo un thread lo haga
+    global _refresher_started
     with _auth_lock:
         now = _time.time()
         with _cache_lock:
+            if _sheets_cache["client"]:
+                return _sheets_cache["client"]
             failure = _sheets_cache["last_auth_failure"]
             if failure > 0 and (now - failure) < AUTH_FAILURE_COOLDOWN:
-                return _sheets_cache["client"]
-            if _sheets_cache["client"] and (now - _sheets_cache["last_auth"]) < AUTH_TTL:
-                return _sheets_cache["client"]
+                return None
 
         client = get_google_sheets_client()
+        _m_sheets_auth.inc("login", "ok" if client else "error")
         with _cache_lock:
             if client:
                 _sheets_cache["client"] = client
                 _sheets_cache["last_auth"] = now
                 _sheets_cache["last_auth_failure"] = 0
-                _sheets_cache["worksheets"] = {}  # Limpiar worksheets al reautenticar
             else:
                 _sheets_cache["last_auth_failure"] = now
-                print(f"⚠️ get_cached_client: auth fallida, cooldown de {AUTH_FAILURE_COOLDOWN}s")
+                log.warning(f"⚠️ get_cached_client: auth fallida, cooldown de {AUTH_FAILURE_COOLDOWN}s")
+        if client and not _refresher_started:
+            _refresher_started = True
+            threading.Thread(target=_credential_refresher, name="sheets-token-refresher", daemon=True).start()
         return client
 
-def get_cached_worksheet(client, sheet_name, worksheet_name, headers):
-    """Obtiene worksheet con caché, thread-safe."""
+def _token_expires_in(creds):
+    """Segundos hasta que caduca el token (0 si no hay token todavía)."""
+    expiry = getattr(creds, "expiry", None)
+    if not getattr(creds, "token", None) or expiry is None:
+        return 0.0
+    if expiry.tzinfo is not None:
+        expiry = expiry.replace(tzinfo=None)    # google-auth usa UTC
+    return (expiry - datetime.utcnow()).total_seconds()
+
+def _refresh_credentials(client):
+    """Renueva el token si caduca en menos de SHEETS_TOKEN_REFRESH_MARGIN.
+    Devuelve los segundos hasta la próxima comprobación."""
+    creds = getattr(getattr(client, "http_client", None), "auth", None)
+    if creds is None:
+        return SHEETS_TOKEN_REFRESH_MARGIN
+    remaining = _token_expires_in(creds)
+    if remaining > SHEETS_TOKEN_REFRESH_MARGIN:
+        return remaining - SHEETS_TOKEN_REFRESH_MARGIN
+    try:
+        creds.refresh(GoogleAuthRequest())
+        _m_sheets_auth.inc("refresh", "ok")
+    except Exception as e:
+        _m_sheets_auth.inc("refresh", "error")
+        log.warning(f"⚠️ No se pudo renovar el token de Google Sheets: {type(e).__name__}: {e} "
+              f"— reintento en {TOKEN_REFRESH_RETRY}s")
+        return TOKEN_REFRESH_RETRY
     with _cache_lock:
-        ws = _sheets_cache["worksheets"].get(worksheet_name)
-    if ws:
+        _sheets_cache["last_auth"] = _time.time()
+    remaining = _token_expires_in(creds)
+    log.info(f"♻️ Token de Google Sheets renovado (caduca en {remaining / 60:.0f} min)")
+    return max(TOKEN_REFRESH_RETRY, remaining - SHEETS_TOKEN_REFRESH_MARGIN)
+
+def _credential_refresher():
+    """Hilo de fondo: mantiene el token vigente y abre el spreadsheet principal antes del primer request."""
+    client = get_cached_client()
+    while True:
+        wait = _refresh_credentials(client)
+        try:
+            open_spreadsheet(client, GOOGLE_SHEET_NAME, priority=PRIORITY_LOW)
+        except Exception as e:
+            log.warning(f"⚠️ No se pudo abrir '{GOOGLE_SHEET_NAME}' en segundo plano: {type(e).__name__}: {e}")
+        _time.sleep(max(1.0, wait))
+
+def _load_spreadsheet_keys():
+    """Keys ya resueltas (SHEETS_KEYS_PATH) más GOOGLE_SHEET_KEY si está configurada."""
+    keys = {}
+    if SHEETS_KEYS_PATH and os.path.exists(SHEETS_KEYS_PATH):
+        try:
+            with open(SHEETS_KEYS_PATH, "r", encoding="utf-8") as f:
+                keys = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning(f"⚠️ No se pudo leer '{SHEETS_KEYS_PATH}': {type(e).__name__}: {e}")
+    if GOOGLE_SHEET_KEY:
+        keys[GOOGLE_SHEET_NAME] = GOOGLE_SHEET_KEY
+    return keys
+
+def _save_spreadsheet_keys(keys):
+    if not SHEETS_KEYS_PATH:
+        return
+    try:
+        directory = os.path.dirname(SHEETS_KEYS_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{SHEETS_KEYS_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(keys, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, SHEETS_KEYS_PATH)
+    except OSError as e:
+        log.warning(f"⚠️ No se pudo guardar '{SHEETS_KEYS_PATH}': {type(e).__name__}: {e}")
+
+_sheets_cache["keys"] = _load_spreadsheet_keys()
+
+def _cache_spreadsheet(name, spreadsheet):
+    with _cache_lock:
+        _sheets_cache["spreadsheets"][name] = spreadsheet
+        changed = _sheets_cache["keys"].get(name) != spreadsheet.id
+        _sheets_cache["keys"][name] = spreadsheet.id
+        keys = dict(_sheets_cache["keys"])
+    if changed:
+        _save_spreadsheet_keys(keys)
+    return spreadsheet
+
+def forget_spreadsheet(name):
+    """Descarta el handle cacheado (p. ej. tras un 404); la key se conserva para reabrirlo."""
+    with _cache_lock:
+        _sheets_cache["spreadsheets"].pop(name, None)
+
+def open_spreadsheet(client, name, priority=PRIORITY_NORMAL):
+    """Spreadsheet cacheado por nombre. Se abre con open_by_key si la key es conocida; si no,
+    se busca por título en Drive una sola vez y la key queda guardada para siguientes arranques.
+    Lanza gspread.exceptions.SpreadsheetNotFound si no existe."""
+    with _cache_lock:
+        spreadsheet = _sheets_cache["spreadsheets"].get(name)
+        key = _sheets_cache["keys"].get(name)
+    if spreadsheet is not None:
+        return spreadsheet
+    if key:
+        try:
+            return _cache_spreadsheet(name, _sheets_read(client.open_by_key, key, priority=priority))
+        except gspread.exceptions.SpreadsheetNotFound:
+            log.warning(f"⚠️ La key guardada de '{name}' ya no es válida, buscando por nombre")
+    return _cache_spreadsheet(name, _sheets_read(client.open, name, priority=priority))
+
+def get_cached_worksheet(client, sheet_name, worksheet_name, headers, cache_key=None):
+    """Obtiene worksheet con caché, thread-safe.
+    cache_key permite cachear bajo un nombre lógico ("events") la hoja física activa (events_0003)."""
+    cache_key = cache_key or worksheet_name
+    with _cache_lock:
+        ws = _sheets_cache["worksheets"].get(cache_key)
+    if ws and ws.title == worksheet_name:
         return ws
     ws = get_or_create_worksheet(client, sheet_name, worksheet_name, headers)
     if ws:
         with _cache_lock:
-            _sheets_cache["worksheets"][worksheet_name] = ws
+            _sheets_cache["worksheets"][cache_key] = ws
     return ws
 
 # =============================================================
-# COLA DE EVENTOS PENDIENTES (batch insert)
+# SINKS DE ALMACENAMIENTO (Sheets, SQLite, archivos)
 # =============================================================
-_events_lock = threading.Lock()
-_events_queue = []
-_flush_lock   = threading.Lock()   # Evita flushes concurrentes (escrituras duplicadas)
+# Shards de la hoja "events" (ver shards.py). Global, como _sheets_cache, para que /health vea el activo
+_events_shards = None
+if EVENTS_SHARD_MODE and INGEST_MODE != "shared":
+    # Con varios workers escribiendo, cada uno contaría sus filas, pisaría la fila del índice
+    # con las suyas y rotaría por su cuenta: sólo es seguro con un único escritor de eventos
+    log.warning(f"⚠️ EVENTS_SHARD_MODE='{EVENTS_SHARD_MODE}' ignorado: requiere INGEST_MODE=shared "
+                f"(un solo flusher escribe los eventos) — se usa una sola hoja 'events'")
+elif EVENTS_SHARD_MODE:
+    try:
+        _events_shards = ShardPlanner(GOOGLE_SHEET_NAME, prefix="events", mode=EVENTS_SHARD_MODE,
+                                      max_rows=EVENTS_SHARD_MAX_ROWS,
+                                      per_spreadsheet=EVENTS_SHARD_PER_SPREADSHEET,
+                                      index_interval=EVENTS_SHARD_INDEX_SEC)
+    except ValueError as e:
+        log.warning(f"⚠️ EVENTS_SHARD_MODE inválido: {e} — se usa una sola hoja 'events'")
+_shards_lock = threading.Lock()     # Serializa rotación, escritura de eventos e índice
+
+def _shard_index_worksheet(client):
+    return get_cached_worksheet(client, GOOGLE_SHEET_NAME, _events_shards.index_name, SHARD_INDEX_HEADERS)
+
+def _restore_shards(client):
+    """Lee el índice para continuar el shard activo. Devuelve None o el mensaje de error."""
+    index_ws = _shard_index_worksheet(client)
+    if not index_ws:
+        return "Índice de shards no disponible"
+    try:
+        values = _sheets_read(index_ws.get_all_values, priority=PRIORITY_LOW)
+    except Exception as e:
+        log.warning(f"⚠️ Shards: no se pudo leer '{_events_shards.index_name}': {type(e).__name__}: {e}")
+        return f"Índice de shards no disponible: {e}"
+    _events_shards.restore(values)
+    active = _events_shards.active
+    log.info(f"✅ Shards de eventos ({_events_shards.mode}): "
+          f"{'activo ' + active.name + f' con {active.rows} filas' if active else 'ninguno abierto'}")
+    return None
+
+def _write_shard_index(client, shard):
+    """Inserta o actualiza la fila del shard en el índice. No crítico: si falla se reintenta más tarde."""
+    ok = False
+    index_ws = _shard_index_worksheet(client)
+    if index_ws:
+        try:
+            row = shard.to_index_row()
+            if shard.index_row is None:
+                names = _sheets_read(index_ws.col_values, 1, priority=PRIORITY_LOW)
+                if shard.name in names:
+                    shard.index_row = names.index(shard.name) + 1
+                else:
+                    _sheets_write(index_ws.append_rows, [row], value_input_option='RAW', priority=PRIORITY_LOW)
+                    shard.index_row = len(names) + 1
+                    shard.dirty = False
+            if shard.dirty:
+                _sheets_write(index_ws.update, values=[row], range_name=f"A{shard.index_row}",
+                              value_input_option='RAW', priority=PRIORITY_LOW)
+                shard.dirty = False
+            ok = True
+        except Exception as e:
+            log.warning(f"⚠️ Shards: no se pudo actualizar el índice de '{shard.name}': {type(e).__name__}: {e}")
+    _events_shards.index_written(shard, ok)
+    return ok
 
-EVENTS_HEADERS = ["timestamp", "subject_id", "policy", "event", "trial_index",
-                   "time_on_screen_sec", "element_clicked", "payload_json"]
+def _ensure_spreadsheet(client, name):
+    """Abre o crea (y comparte) el spreadsheet de un shard. Devuelve True si está disponible."""
+    try:
+        open_spreadsheet(client, name, priority=PRIORITY_LOW)
+        return True
+    except gspread.exceptions.SpreadsheetNotFound:
+        pass
+    except Exception as e:
+        log.warning(f"⚠️ Shards: error abriendo spreadsheet '{name}': {type(e).__name__}: {e}")
+        return False
+    try:
+        spreadsheet = _cache_spreadsheet(name, _sheets_write(client.create, name, priority=PRIORITY_LOW))
+        for email in EVENTS_SHARD_SHARE_WITH:
+            _sheets_write(spreadsheet.share, email, perm_type="user", role="writer", notify=False,
+                          priority=PRIORITY_LOW)
+        log.info(f"✅ Creado spreadsheet '{name}' para shards de eventos (compartido con {len(EVENTS_SHARD_SHARE_WITH)})")
+        return True
+    except Exception as e:
+        log.warning(f"⚠️ Shards: error creando spreadsheet '{name}': {type(e).__name__}: {e}")
+        return False
 
-def flush_events():
-    """Escribe todos los eventos pendientes a Google Sheets.
-    Usa _flush_lock para evitar ejecuciones simultáneas que puedan duplicar datos.
-    Los eventos que fallen se re-insertan AL INICIO de la cola para preservar el orden."""
+def _sheets_cell(value):
+    """CellData de appendCells con la misma semántica que value_input_option='RAW'."""
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
 
-    # Intentar adquirir el lock sin bloquear; si ya hay un flush en curso, salir
-    acquired = _flush_lock.acquire(blocking=False)
-    if not acquired:
-        print("⚠️ flush_events: flush en curso, omitiendo este ciclo")
-        return False
+class SheetsSink(StorageSink):
+    """Escribe en Google Sheets usando el cliente y las worksheets cacheadas."""
 
-    batch = []
-    try:
-        with _events_lock:
-            if not _events_queue:
-                return True
-            batch = list(_events_queue)
-            _events_queue.clear()
+    name = "sheets"
+    can_check_existing = True
 
+    def append_rows(self, table, headers, rows):
         client = get_cached_client()
         if not client:
-            print(f"⚠️ flush_events: Google Sheets no disponible, {len(batch)} eventos re-encolados")
-            with _events_lock:
-                _events_queue[:0] = batch   # Prepend: preserva orden cronológico
-            return False
+            log.warning(f"⚠️ SheetsSink: Google Sheets no disponible, {len(rows)} filas sin escribir en '{table}'")
+            return "Google Sheets no disponible"
+
+        if table == "events" and _events_shards is not None:
+            with _shards_lock:
+                return self._append_sharded(client, headers, rows)
 
-        worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, "events", EVENTS_HEADERS)
+        worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, table, headers)
         if not worksheet:
-            print(f"⚠️ flush_events: worksheet no disponible, {len(batch)} eventos re-encolados")
-            with _events_lock:
-                _events_queue[:0] = batch
+            log.warning(f"⚠️ SheetsSink: worksheet '{table}' no disponible, {len(rows)} filas sin escribir")
             with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return False
+                _sheets_cache["worksheets"].pop(table, None)
+            return "Worksheet no disponible"
+        return self._append(worksheet, table, rows)
 
+    def _append(self, worksheet, table, rows):
+        # Los resultados de /finalize tienen prioridad sobre el flush de eventos
+        priority = PRIORITY_HIGH if table == "results" else PRIORITY_LOW
         try:
-            worksheet.append_rows(batch, value_input_option='RAW')
-            print(f"✅ flush_events: {len(batch)} eventos guardados en Google Sheets")
-            return True
+            _sheets_write(worksheet.append_rows, rows, value_input_option='RAW', priority=priority)
+            return None
+        except QuotaExhausted as e:
+            log.warning(f"⚠️ SheetsSink: {e}, {len(rows)} filas sin escribir en '{table}'")
+            return f"Cuota de Google Sheets agotada: {e}"
         except gspread.exceptions.APIError as e:
-            print(f"⚠️ flush_events: APIError insertando {len(batch)} eventos: {e}")
-            with _events_lock:
-                _events_queue[:0] = batch
-            with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return False
+            log.warning(f"⚠️ SheetsSink: APIError insertando {len(rows)} filas en '{table}': {e}")
+            error = f"APIError: {e}"
         except Exception as e:
-            print(f"⚠️ flush_events: error insertando {len(batch)} eventos: {type(e).__name__}: {e}")
-            with _events_lock:
-                _events_queue[:0] = batch
-            with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return False
+            log.warning(f"⚠️ SheetsSink: error insertando {len(rows)} filas en '{table}': {type(e).__name__}: {e}")
+            error = str(e)
+        with _cache_lock:
+            _sheets_cache["worksheets"].pop(table, None)
+        return error
+
+    def _shard_worksheet(self, client, headers, rows):
+        """Shard activo de "events" (rotando antes si toca) y su worksheet: (shard, worksheet, error).
+        Llamar con _shards_lock."""
+        if not _events_shards.restored:
+            error = _restore_shards(client)
+            if error:
+                return None, None, error
+        shard, closed = _events_shards.rollover()
+        if closed is not None:
+            log.info(f"♻️ Shard de eventos '{closed.name}' cerrado con {closed.rows} filas → '{shard.name}'")
+        for pending in list(_events_shards.unindexed):
+            _write_shard_index(client, pending)
+
+        with _cache_lock:
+            worksheet = _sheets_cache["worksheets"].get("events")
+        if not worksheet or worksheet.title != shard.name:
+            worksheet = None
+            if shard.spreadsheet == GOOGLE_SHEET_NAME or _ensure_spreadsheet(client, shard.spreadsheet):
+                worksheet = get_cached_worksheet(client, shard.spreadsheet, shard.name, headers, cache_key="events")
+        if not worksheet:
+            log.warning(f"⚠️ SheetsSink: shard '{shard.name}' no disponible, {len(rows)} filas sin escribir")
+            return shard, None, "Worksheet no disponible"
+        return shard, worksheet, None
+
+    def _shard_written(self, client, shard, rows):
+        shard.record(rows)
+        if _events_shards.index_due():
+            _write_shard_index(client, shard)
+
+    def _append_sharded(self, client, headers, rows):
+        """Escribe en el shard activo de "events" (llamar con _shards_lock).
+        El lote entero va a un solo shard: un fallo no deja la mitad escrita en otro."""
+        shard, worksheet, error = self._shard_worksheet(client, headers, rows)
+        if error:
+            return error
+        error = self._append(worksheet, "events", rows)
+        if error is None:
+            self._shard_written(client, shard, rows)
+        return error
+
+    def append_many(self, batches):
+        """Todas las tablas del ciclo en un solo batchUpdate por spreadsheet (un appendCells por hoja).
+        batchUpdate es atómico: o se escriben todas las hojas del spreadsheet o ninguna."""
+        if len(batches) <= 1:
+            return super().append_many(batches)
+        client = get_cached_client()
+        if not client:
+            log.warning(f"⚠️ SheetsSink: Google Sheets no disponible, {len(batches)} tablas sin escribir")
+            return ["Google Sheets no disponible"] * len(batches)
+
+        sharded = _events_shards is not None and any(table == "events" for table, _, _ in batches)
+        if sharded:
+            _shards_lock.acquire()
+        try:
+            errors = [None] * len(batches)
+            groups = {}         # spreadsheet → [(posición en batches, worksheet)]
+            shard = None
+            for i, (table, headers, rows) in enumerate(batches):
+                spreadsheet_name = GOOGLE_SHEET_NAME
+                earlier = next((batches[j][0] for j in range(i) if errors[j] is not None), None)
+                if earlier is not None:
+                    errors[i] = f"No escrita: falló '{earlier}' antes"
+                    continue
+                if table == "events" and sharded:
+                    shard, worksheet, errors[i] = self._shard_worksheet(client, headers, rows)
+                    if shard is not None:
+                        spreadsheet_name = shard.spreadsheet
+                else:
+                    worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, table, headers)
+                    if not worksheet:
+                        log.warning(f"⚠️ SheetsSink: worksheet '{table}' no disponible, {len(rows)} filas sin escribir")
+                        errors[i] = "Worksheet no disponible"
+                if errors[i] is None:
+                    groups.setdefault(spreadsheet_name, []).append((i, worksheet))
+
+            failed = None
+            for spreadsheet_name, entries in groups.items():
+                if failed is not None:
+                    # Hojas de otro spreadsheet (shards): no se adelantan a lo que falló antes
+                    for i, _ in entries:
+                        errors[i] = f"No escrita: falló {failed} antes"
+                    continue
+                error = self._batch_append(client, spreadsheet_name,
+                                           [(batches[i][0], worksheet, batches[i][2]) for i, worksheet in entries])
+                if error is not None:
+                    failed = spreadsheet_name
+                for i, _ in entries:
+                    errors[i] = error
+                    if error is None and shard is not None and batches[i][0] == "events":
+                        self._shard_written(client, shard, batches[i][2])
+            return errors
+        finally:
+            if sharded:
+                _shards_lock.release()
+
+    def _batch_append(self, client, spreadsheet_name, entries):
+        """Un batchUpdate con una petición appendCells por (tabla, worksheet, filas). Devuelve None o el error."""
+        tables = [table for table, _, _ in entries]
+        body = {"requests": [
+            {"appendCells": {"sheetId": worksheet.id,
+                             "rows": [{"values": [_sheets_cell(v) for v in row]} for row in rows],
+                             "fields": "userEnteredValue"}}
+            for _, worksheet, rows in entries]}
+        rows_total = sum(len(rows) for _, _, rows in entries)
+        # Si el ciclo lleva resultados de /finalize, hereda su prioridad
+        priority = PRIORITY_HIGH if "results" in tables else PRIORITY_LOW
+        try:
+            spreadsheet = open_spreadsheet(client, spreadsheet_name, priority=priority)
+            _sheets_write(spreadsheet.batch_update, body, priority=priority)
+            return None
+        except QuotaExhausted as e:
+            log.warning(f"⚠️ SheetsSink: {e}, {rows_total} filas sin escribir en {tables}")
+            return f"Cuota de Google Sheets agotada: {e}"
+        except gspread.exceptions.APIError as e:
+            log.warning(f"⚠️ SheetsSink: APIError en batchUpdate de {rows_total} filas en {tables}: {e}")
+            error = f"APIError: {e}"
+        except Exception as e:
+            log.warning(f"⚠️ SheetsSink: error en batchUpdate de {rows_total} filas en {tables}: {type(e).__name__}: {e}")
+            error = str(e)
+        with _cache_lock:
+            for table in tables:
+                _sheets_cache["worksheets"].pop(table, None)
+        return error
+
+    def existing_values(self, table, headers, column):
+        if column not in headers:
+            return None
+        client = get_cached_client()
+        worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, table, headers) if client else None
+        if not worksheet:
+            return None
+        try:
+            values = _sheets_read(worksheet.col_values, headers.index(column) + 1, priority=PRIORITY_HIGH)
+        except Exception as e:
+            log.warning(f"⚠️ SheetsSink: no se pudo leer la columna '{column}' de '{table}': {type(e).__name__}: {e}")
+            return None
+        return set(values[1:])   # Sin la cabecera
+
+    def describe(self):
+        return {"sink": self.name, "spreadsheet": GOOGLE_SHEET_NAME,
+                "events_shards": _events_shards.describe() if _events_shards is not None else None}
+
+def _build_sink(kind):
+    """Crea un sink a partir de su nombre en STORAGE_SINKS."""
+    if kind == "sheets":
+        return SheetsSink()
+    if kind == "sqlite":
+        return SQLiteSink(STORAGE_SQLITE_PATH)
+    if kind == "file":
+        return RotatingFileSink(STORAGE_FILE_DIR, fmt=STORAGE_FILE_FORMAT,
+                                max_bytes=int(STORAGE_FILE_MAX_MB * 1024 * 1024))
+    raise ValueError(f"sink desconocido: {kind}")
+
+def build_storage():
+    """Construye el sink configurado; si la configuración es inválida, cae a Google Sheets."""
+    sinks = []
+    for kind in [k.strip().lower() for k in STORAGE_SINKS.split(",") if k.strip()]:
+        try:
+            sinks.append(_build_sink(kind))
+        except Exception as e:
+            log.error(f"⚠️ ERROR creando sink '{kind}': {type(e).__name__}: {e} — se omite")
+    if not sinks:
+        log.warning("⚠️ STORAGE_SINKS sin sinks válidos, usando 'sheets'")
+        sinks = [SheetsSink()]
+    log.info(f"✅ Almacenamiento: principal={sinks[0].name}, réplicas={[sk.name for sk in sinks[1:]]}")
+    if len(sinks) == 1:
+        return sinks[0]
+    return StackedSink(sinks[0], sinks[1:])
+
+_storage = build_storage()
+
+# Contadores incrementales de filas escritas (los usa /health en lugar de leer las hojas)
+_rows_written = {}          # table → {"rows": n, "last_write": timestamp}
+_rows_written_lock = threading.Lock()
+
+def _count_rows_written(table, n):
+    with _rows_written_lock:
+        entry = _rows_written.setdefault(table, {"rows": 0, "last_write": None})
+        entry["rows"] += n
+        entry["last_write"] = datetime.utcnow().isoformat()
+
+def _rows_written_snapshot():
+    with _rows_written_lock:
+        return {table: dict(entry) for table, entry in _rows_written.items()}
+
+# =============================================================
+# PLANIFICADOR DE ESCRITURAS (un ciclo → una sola llamada)
+# =============================================================
+# Cada ciclo reúne todo lo pendiente para el almacenamiento — blobs sin
+# replicar, el lote de eventos y, en el último lote del drenado, los
+# resultados de /finalize — y lo envía con una sola append_many (en Sheets,
+# un único batchUpdate con un appendCells por hoja). Cada fuente confirma o
+# reintenta sólo su parte; blobs y eventos van antes que los resultados.
+_write_planner_stats = {"cycles": 0, "multi_table_cycles": 0, "calls_saved": 0, "failed_cycles": 0}
+_write_planner_lock = threading.Lock()
+
+def _write_cycle(event_rows, origin, result_rows=None):
+    """Escribe en una sola append_many los blobs pendientes, `event_rows` y las filas de resultados.
+    result_rows=None: si el lote vacía la cola de eventos, se añaden las pendientes de la outbox;
+    [] = sin resultados. Devuelve {tabla: error o None} de las tablas que se escribieron."""
+    blob_claim, held = _claim_blob_rows(event_rows)
+    if held is not None:
+        log.warning(f"⚠️ {origin}: {len(event_rows)} eventos retenidos: {held}")
+        event_rows = []     # Sin sus blobs no se escriben: el llamante los reintenta
+        if result_rows is None:
+            result_rows = []    # Y los resultados de la outbox siguen esperando a sus eventos
+    outbox_claim = None
+    try:
+        batches = []
+        if blob_claim is not None:
+            batches.append(("blobs", BLOB_HEADERS, blob_claim[1]))     # Antes que los eventos que los referencian
+        if event_rows:
+            batches.append(("events", EVENTS_HEADERS, event_rows))
+        if result_rows is None and (not event_rows or _pending_events() <= len(event_rows)):
+            outbox_claim = _claim_outbox_rows()
+            result_rows = outbox_claim[1] if outbox_claim is not None else []
+        if result_rows:
+            batches.append(("results", RESULTS_HEADERS, result_rows))
+        if not batches:
+            return {"events": held} if held is not None else {}
+
+        started = _time.monotonic()
+        errors = dict(zip([table for table, _, _ in batches], _storage.append_many(batches)))
+        elapsed = _time.monotonic() - started
+        if event_rows:
+            _event_flusher.record_append(elapsed)
+        _m_write_latency.observe(elapsed, "ok" if all(error is None for error in errors.values()) else "error")
+        for table, _, rows in batches:
+            _m_write_rows.observe(len(rows), table)
+
+        for table, _, rows in batches:
+            if errors[table] is None:
+                _count_rows_written(table, len(rows))
+        if blob_claim is not None:
+            _blob_rows_done(blob_claim[0], errors["blobs"])
+        if outbox_claim is not None:
+            _outbox_rows_done(outbox_claim[0], errors["results"])
+        if event_rows and errors["events"] is None:
+            log.debug("✅ %s: %d eventos guardados", origin, len(event_rows),
+                      extra=fields(results=len(result_rows)) if result_rows else None)
+        if held is not None:
+            errors["events"] = held
+
+        with _write_planner_lock:
+            _write_planner_stats["cycles"] += 1
+            if len(batches) > 1:
+                _write_planner_stats["multi_table_cycles"] += 1
+                _write_planner_stats["calls_saved"] += len(batches) - 1
+            if any(error is not None for error in errors.values()):
+                _write_planner_stats["failed_cycles"] += 1
+        return errors
+    finally:
+        if blob_claim is not None:
+            _blob_replicate_lock.release()
+        if outbox_claim is not None:
+            _outbox_lock.release()
+
+# =============================================================
+# BLOBS DE PAYLOADS GRANDES
+# =============================================================
+_blob_store = None
+if BLOB_DIR:
+    try:
+        _blob_store = BlobStore(BLOB_DIR, min_bytes=BLOB_MIN_BYTES, replicate=BLOB_REPLICATE)
+        log.info(f"✅ Blobs de payload en '{BLOB_DIR}' (campos >= {BLOB_MIN_BYTES} bytes)")
+    except Exception as e:
+        log.error(f"⚠️ ERROR abriendo blobs en '{BLOB_DIR}': {type(e).__name__}: {e} — payloads completos en la celda")
+        _blob_store = None
+
+_blob_replicate_lock = threading.Lock()
+
+def _offload_payload(subject_id, payload):
+    """Sustituye los campos grandes del payload por referencias a blobs (si están activados)."""
+    if _blob_store is None or not payload:
+        return payload
+    try:
+        return _blob_store.offload(subject_id, payload)
+    except Exception as e:
+        log.warning(f"⚠️ blobs: no se pudo guardar el payload, va completo en la celda: {type(e).__name__}: {e}")
+        return payload
+
+def _claim_blob_rows(event_rows):
+    """Blobs para la tabla "blobs" de este ciclo (troceados por el límite de celda): ((hashes, filas)
+    con _blob_replicate_lock adquirido, o None si no hay nada que replicar; error o None).
+    Los blobs que referencian `event_rows` van siempre en el ciclo (los haya guardado este worker
+    u otro); si no pueden ir, el error indica que los eventos deben esperar."""
+    if _blob_store is None or not _blob_store.replicate:
+        return None, None
+    refs = {ref for row in event_rows for ref in blob_refs(row[7] if len(row) > 7 else "")}
+    # Con cada blob, las bases de su cadena de deltas: un delta replicado sin su base no se puede reconstruir
+    required, missing = _blob_store.unreplicated_closure(refs) if refs else (set(), set())
+    if missing:
+        return None, f"faltan en disco {len(missing)} blobs (o bases de sus deltas) de estos eventos"
+    if required:
+        acquired = _blob_replicate_lock.acquire(timeout=SHEETS_QUOTA_MAX_WAIT)
+    else:
+        acquired = _blob_replicate_lock.acquire(blocking=False)
+    if not acquired:
+        return None, (f"{len(required)} blobs de estos eventos se están replicando en otro hilo" if required else None)
+    try:
+        digests, rows = _blob_store.pending_rows(required=required)
+    except Exception as e:
+        _blob_replicate_lock.release()
+        log.warning(f"⚠️ blobs: error preparando la replicación: {type(e).__name__}: {e}")
+        return None, (f"blobs sin preparar: {type(e).__name__}: {e}" if required else None)
+    if required - set(digests):
+        _blob_replicate_lock.release()
+        return None, f"faltan en disco {len(required - set(digests))} blobs de estos eventos"
+    if not rows:
+        _blob_replicate_lock.release()
+        return None, None
+    return (digests, rows), None
+
+def _blob_rows_done(digests, error):
+    if error is not None:
+        log.warning(f"⚠️ blobs: {len(digests)} blobs sin replicar (se reintenta en el siguiente ciclo): {error}")
+        return
+    _blob_store.mark_replicated(digests)
+
+# =============================================================
+# COLA DE EVENTOS PENDIENTES (batch insert)
+# =============================================================
+_events_queue = BoundedEventQueue(
+    max_bytes=int(EVENTS_QUEUE_MAX_MB * 1024 * 1024),
+    spill_dir=EVENTS_SPILL_DIR,
+    spill_max_bytes=int(EVENTS_SPILL_MAX_MB * 1024 * 1024),
+)
+_flush_lock   = threading.Lock()   # Evita flushes concurrentes (escrituras duplicadas)
+
+EVENTS_HEADERS = ["timestamp", "subject_id", "policy", "event", "trial_index",
+                   "time_on_screen_sec", "element_clicked", "payload_json"]
+
+# Group commit de /log-batch: las peticiones que llegan dentro de la ventana
+# (o hasta juntar GROUP_COMMIT_MAX_ROWS filas) se escriben en un solo append_rows
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "50"))   # 0 = desactivado
+GROUP_COMMIT_MAX_ROWS  = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "500"))
+
+class _GroupCommitter:
+    """Agrupa escrituras concurrentes en un único append_rows (group commit con líder).
+    La primera petición de un grupo actúa de líder: espera la ventana, escribe las
+    filas de todo el grupo y entrega a cada petición su propio resultado."""
+
+    def __init__(self, write_fn, window_s, max_rows):
+        self._write = write_fn
+        self._window_s = window_s
+        self._max_rows = max_rows
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()   # Un solo append_rows en vuelo → orden preservado
+        self._pending = []        # [(rows, slot)]
+        self._pending_rows = 0
+        self._leader_active = False
+        self.stats = {"groups": 0, "requests": 0, "rows": 0, "max_group_requests": 0}
+
+    def submit(self, rows):
+        """Encola filas y bloquea hasta que el grupo se escribe. Devuelve None o el error."""
+        slot = {"done": threading.Event(), "leader": False, "error": None}
+        with self._cond:
+            self._pending.append((rows, slot))
+            self._pending_rows += len(rows)
+            if self._pending_rows >= self._max_rows:
+                self._cond.notify_all()
+            if not self._leader_active:
+                self._leader_active = True
+                slot["leader"] = True
+
+        if not slot["leader"]:
+            slot["done"].wait()
+            if not slot["leader"]:
+                return slot["error"]
+            # Promovido a líder de las peticiones que no cupieron en el grupo anterior
+        else:
+            deadline = _time.monotonic() + self._window_s
+            with self._cond:
+                while self._pending_rows < self._max_rows:
+                    remaining = deadline - _time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+        self._commit_group()
+        return slot["error"]
+
+    def _commit_group(self):
+        with self._commit_lock:
+            # Mientras se esperaba al commit anterior el grupo ha podido crecer: sellar ahora
+            with self._cond:
+                group, count = [], 0
+                while self._pending and (not group or count + len(self._pending[0][0]) <= self._max_rows):
+                    entry = self._pending.pop(0)
+                    group.append(entry)
+                    count += len(entry[0])
+                self._pending_rows -= count
+                successor = self._pending[0][1] if self._pending else None
+                if successor is None:
+                    self._leader_active = False
+
+            rows = [row for entry_rows, _ in group for row in entry_rows]
+            try:
+                error = self._write(rows)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+            self.stats["groups"] += 1
+            self.stats["requests"] += len(group)
+            self.stats["rows"] += len(rows)
+            self.stats["max_group_requests"] = max(self.stats["max_group_requests"], len(group))
+
+        for _, entry_slot in group:
+            entry_slot["error"] = error
+            if not entry_slot["leader"]:
+                entry_slot["done"].set()
+        if successor is not None:
+            successor["leader"] = True
+            successor["done"].set()
+
+_log_batch_committer = _GroupCommitter(
+    lambda rows: _write_cycle(rows, "/log-batch[group]").get("events"),
+    GROUP_COMMIT_WINDOW_MS / 1000.0,
+    GROUP_COMMIT_MAX_ROWS,
+)
+
+# Deduplicación por event_id: los reintentos de /log-batch y el sendBeacon de
+# beforeunload pueden reenviar eventos que ya se guardaron
+EVENT_DEDUPE_MAX_SUBJECTS = int(os.getenv("EVENT_DEDUPE_MAX_SUBJECTS", "2000"))
+EVENT_DEDUPE_IDS_PER_SUBJECT = int(os.getenv("EVENT_DEDUPE_IDS_PER_SUBJECT", "1024"))   # 0 = desactivada
+
+_event_deduper = (EventDeduper(EVENT_DEDUPE_MAX_SUBJECTS, EVENT_DEDUPE_IDS_PER_SUBJECT)
+                  if EVENT_DEDUPE_IDS_PER_SUBJECT > 0 else None)
+
+def _dedupe_events(events, batch=None):
+    """Descarta eventos con event_id ya visto. Devuelve (eventos nuevos, duplicados).
+    Con `batch` (lote compacto v2), `events` son sus items."""
+    if batch is None:
+        events = [evt for evt in events if isinstance(evt, dict)]
+    if _event_deduper is None:
+        return events, 0
+    if batch is None:
+        return _event_deduper.filter(events)
+    keep = _event_deduper.filter_ids(batch.subject_id, [batch.event_id(item) for item in events])
+    fresh = [item for item, new in zip(events, keep) if new]
+    return fresh, len(events) - len(fresh)
+
+def _forget_events(events, batch=None):
+    """Los eventos no se guardaron: permitir que el reintento del cliente vuelva a entrar."""
+    if _event_deduper is None:
+        return
+    if batch is None:
+        _event_deduper.forget(events)
+    else:
+        _event_deduper.forget_ids(batch.subject_id, [batch.event_id(item) for item in events])
+
+def flush_events(max_rows=None):
+    """Escribe los eventos pendientes a Google Sheets (como mucho max_rows; None = todos).
+    Usa _flush_lock para evitar ejecuciones simultáneas que puedan duplicar datos.
+    Los eventos sólo salen de la cola cuando Sheets confirma el lote (peek → commit),
+    así que un fallo los deja en su sitio y se preserva el orden.
+    Con WAL activo, hace replay del log desde el último offset confirmado.
+    En modo "shared", sólo el flusher elegido vacía la cola compartida.
+    El último lote lleva también los resultados pendientes de la outbox (_write_cycle)."""
+
+    # Intentar adquirir el lock sin bloquear; si ya hay un flush en curso, salir
+    acquired = _flush_lock.acquire(blocking=False)
+    if not acquired:
+        log.debug("⚠️ flush_events: flush en curso, omitiendo este ciclo")
+        _m_flush_latency.observe(0.0, "skipped")
+        return False
+
+    started = _time.perf_counter()
+    written = 0
+    outcome = "error"
+    try:
+        if _shared_queue is not None and not _flusher_election.is_leader:
+            outcome = "skipped"
+            return False    # Sólo el proceso elegido escribe en Sheets; el resto delega en él
+
+        while max_rows is None or written < max_rows:
+            limit = _flush_batch_size(WAL_DRAIN_BATCH)
+            if max_rows is not None:
+                limit = min(limit, max_rows - written)
+            rows, commit = _peek_events(limit)
+            if not rows:
+                break
+            if _write_cycle(rows, "flush_events").get("events") is not None:
+                return False
+            commit()
+            written += len(rows)
+        outcome = "ok"
+        return True
 
     except Exception as e:
-        print(f"⚠️ flush_events: error inesperado: {type(e).__name__}: {e}")
-        if batch:
-            with _events_lock:
-                _events_queue[:0] = batch
+        log.warning(f"⚠️ flush_events: error inesperado: {type(e).__name__}: {e}")
         return False
     finally:
         _flush_lock.release()
+        _m_flush_latency.observe(_time.perf_counter() - started, outcome)
+        if written:
+            _m_flush_rows.observe(written)
 
-# Timer para flush periódico
-_flush_timer = None
-_flush_timer_lock = threading.Lock()  # Evita crear múltiples timers
-
-def schedule_flush():
-    """Programa un flush de eventos cada 10 segundos (solo un timer activo a la vez)"""
-    global _flush_timer
-    with _flush_timer_lock:
-        if _flush_timer and _flush_timer.is_alive():
-            return  # Ya hay un timer activo
-        _flush_timer = threading.Timer(10.0, _do_periodic_flush)
-        _flush_timer.daemon = True
-        _flush_timer.start()
-
-def _do_periodic_flush():
-    """Ejecuta flush periódico y reprograma"""
-    flush_events()
-    schedule_flush()
+# =============================================================
+# WAL DE EVENTOS (opcional, activado con EVENTS_WAL_DIR)
+# =============================================================
+# /log y /log-batch escriben en el WAL y hacen fsync antes de responder;
+# el flusher adaptativo hace replay a Sheets y confirma el offset.
+# Tras un reinicio, el replay continúa desde el último offset confirmado.
+WAL_DRAIN_BATCH    = 500    # Máximo de filas de eventos por ciclo de escritura
+WAL_MAX_BACKOFF    = 120.0  # Espera máxima entre reintentos si Sheets falla
+
+_events_wal = None
+if EVENTS_WAL_DIR and INGEST_MODE == "shared":
+    log.warning("⚠️ EVENTS_WAL_DIR ignorado: INGEST_MODE=shared ya usa una cola persistente compartida")
+elif EVENTS_WAL_DIR:
+    try:
+        _events_wal = SegmentedLog(EVENTS_WAL_DIR, segment_max_bytes=int(EVENTS_WAL_SEGMENT_MB * 1024 * 1024))
+        log.info(f"✅ WAL de eventos en '{EVENTS_WAL_DIR}': {_events_wal.pending()} eventos pendientes de replay")
+    except Exception as e:
+        log.error(f"⚠️ ERROR abriendo WAL en '{EVENTS_WAL_DIR}': {type(e).__name__}: {e} — usando cola en memoria")
+        _events_wal = None
+
+def _flush_batch_size(base):
+    """Con poco presupuesto de escritura en Sheets, lotes más grandes en lugar de más llamadas."""
+    fraction = _sheets_governor.budget()["write_fraction"]
+    if fraction < 0.25:
+        return base * 4
+    if fraction < 0.5:
+        return base * 2
+    return base
+
+def _peek_events(limit):
+    """Lote más antiguo sin escribir de la cola activa (compartida, WAL o memoria): (filas, commit).
+    commit() lo retira cuando el almacenamiento confirma la escritura. Llamar con _flush_lock adquirido."""
+    if _shared_queue is not None:
+        if not _flusher_election.is_leader:
+            return [], None
+        rows, last_id = _shared_queue.peek_batch(limit)
+        return rows, lambda: _shared_queue.delete_upto(last_id)
+    if _events_wal is not None:
+        while True:
+            start = _events_wal.committed
+            rows, end = _events_wal.read_batch(start, limit)
+            if end > start and not rows:
+                _events_wal.commit(end)   # Segmento corrupto saltado
+                continue
+            return rows, lambda: _events_wal.commit(end)
+    rows, token = _events_queue.peek_batch(limit)
+    return rows, lambda: _events_queue.commit(token)
 
-# Arrancar el flush periódico
-schedule_flush()
+# =============================================================
+# INGESTA MULTI-PROCESO (INGEST_MODE=shared)
+# =============================================================
+# Cada worker de gunicorn inserta en la cola SQLite compartida; un hilo de
+# elección por proceso intenta tomar el file lock y, si lo consigue, ese
+# proceso es el único que drena la cola hacia Sheets (y el único que se
+# autentica y cachea worksheets). Si muere, otro worker toma el lock.
+SHARED_DRAIN_INTERVAL  = 5.0    # Segundos entre drenados del flusher
+SHARED_ELECTION_INTERVAL = 5.0  # Segundos entre intentos de tomar el lock (no líderes)
+
+_shared_queue = None
+_flusher_election = None
+if INGEST_MODE == "shared":
+    try:
+        _shared_queue = SharedEventQueue(SHARED_QUEUE_PATH)
+        _flusher_election = FlusherElection(FLUSHER_LOCK_PATH)
+        log.info(f"✅ Ingesta compartida en '{SHARED_QUEUE_PATH}' (pid {os.getpid()})")
+    except Exception as e:
+        log.error(f"⚠️ ERROR abriendo cola compartida '{SHARED_QUEUE_PATH}': {type(e).__name__}: {e} — usando cola local")
+        _shared_queue = None
+        _flusher_election = None
+elif INGEST_MODE != "local":
+    log.warning(f"⚠️ INGEST_MODE desconocido '{INGEST_MODE}', usando 'local'")
+
+def _shared_flusher_loop():
+    """Hilo por proceso: intenta ser el flusher; si lo es, drena la cola periódicamente."""
+    delay = SHARED_DRAIN_INTERVAL
+    while True:
+        if not _flusher_election.is_leader:
+            if _flusher_election.try_acquire():
+                log.info(f"✅ Proceso {os.getpid()} elegido como flusher de la cola compartida")
+                if _events_shards is not None:
+                    with _shards_lock:
+                        _events_shards.restored = False     # Continuar desde el índice del flusher anterior
+            else:
+                _time.sleep(SHARED_ELECTION_INTERVAL)
+                continue
+        _time.sleep(delay)
+        try:
+            ok = flush_events()
+        except Exception as e:
+            log.warning(f"⚠️ flusher compartido: error inesperado: {type(e).__name__}: {e}")
+            ok = False
+        delay = SHARED_DRAIN_INTERVAL if ok else min(max(delay, 1.0) * 2, WAL_MAX_BACKOFF)
+
+def _durable_ingest():
+    """True si los eventos se persisten localmente y un hilo en segundo plano los lleva a Sheets."""
+    return _shared_queue is not None or _events_wal is not None
+
+def _enqueue_event_rows(rows):
+    """Encola filas para el flush. Con WAL o cola compartida, vuelve sólo cuando son duraderas.
+    Devuelve los eventos pendientes."""
+    if _shared_queue is not None:
+        _shared_queue.put(rows)
+        return _shared_queue.size()
+    if _events_wal is not None:
+        _events_wal.append(rows)
+        pending = _events_wal.pending()
+    else:
+        if _events_queue.put(rows) == QUEUE_REJECTED:
+            raise QueueFull(f"cola de eventos llena ({len(_events_queue)} pendientes)")
+        pending = len(_events_queue)
+    _event_flusher.notify(len(rows), pending)
+    return pending
+
+def _pending_events():
+    """Número de eventos aceptados y aún no escritos en Sheets."""
+    if _shared_queue is not None:
+        return _shared_queue.size()
+    if _events_wal is not None:
+        return _events_wal.pending()
+    return len(_events_queue)
+
+def _oldest_event_age():
+    """Segundos desde el timestamp del evento pendiente más antiguo (0 con la cola vacía).
+    Lee la cabeza de la cola sin _flush_lock ni mover el cursor del flusher."""
+    if _shared_queue is not None:
+        rows, _ = _shared_queue.peek_batch(1)
+    elif _events_wal is not None:
+        rows, _ = _events_wal.read_batch(_events_wal.committed, 1, remember=False)
+    else:
+        row = _events_queue.oldest()
+        rows = [row] if row is not None else []
+    if not rows:
+        return 0.0
+    try:
+        ts = datetime.fromisoformat(str(rows[0][0]).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(0.0, (datetime.utcnow() - ts).total_seconds())
+
+_metrics.gauge("events_queue_depth", "Eventos aceptados y aún no escritos", _pending_events)
+_metrics.gauge("events_oldest_age_seconds", "Antigüedad del evento pendiente más antiguo (según su timestamp)",
+               _oldest_event_age)
+
+# Un único hilo flusher (cola en memoria y WAL): las peticiones sólo le notifican,
+# y él decide lote y espera según la tasa de llegada, la latencia y la cuota
+_event_flusher = AdaptiveFlusher(
+    flush_events, _pending_events, _sheets_governor.budget,
+    min_interval=FLUSH_MIN_INTERVAL_SEC,
+    max_lag=FLUSH_MAX_LAG_SEC,
+    max_batch=WAL_DRAIN_BATCH,
+    quota_share=FLUSH_QUOTA_SHARE,
+    max_backoff=WAL_MAX_BACKOFF,
+)
+
+# Arrancar el flusher (o el flusher compartido, que lo sustituye con varios workers)
+if _shared_queue is not None:
+    threading.Thread(target=_shared_flusher_loop, name="shared-flusher", daemon=True).start()
+else:
+    _event_flusher.start()
+    if _pending_events():
+        _event_flusher.flush_now()   # Replay inmediato de lo que quedó antes del reinicio (WAL o spill)
 
 # =============================================================
 # INICIALIZAR FLASK
 # =============================================================
-app = Flask(__name__, static_folder='public', static_url_path='')
+app = Flask(__name__, static_folder=None)   # public/ lo sirve serve_static (caché en memoria)
 CORS(app)
 
+_traffic_recorder = None
+if TRAFFIC_RECORD_DIR:
+    _traffic_recorder = TrafficRecorder(app.wsgi_app, TRAFFIC_RECORD_DIR, TRAFFIC_SAMPLE_RATE, TRAFFIC_PATHS,
+                                        TRAFFIC_REDACT_FIELDS, int(TRAFFIC_MAX_MB * 1024 * 1024), TRAFFIC_MAX_FILES)
+    app.wsgi_app = _traffic_recorder
+    log.info(f"📥 Grabando tráfico en {TRAFFIC_RECORD_DIR} ({TRAFFIC_SAMPLE_RATE:.0%} de participantes)")
+
+@app.before_request
+def _metrics_request_started():
+    g.metrics_started = _time.perf_counter()
+    g.request_id = new_request_id(request.headers.get("X-Request-ID"))
+    g.request_id_token = request_id.set(g.request_id)
+
+@app.after_request
+def _metrics_request_finished(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        _m_http_latency.observe(_time.perf_counter() - started, route, request.method, str(response.status_code))
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.teardown_request
+def _reset_request_id(exc):
+    # Los hilos del servidor se reutilizan: que el siguiente request no herede el ID
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        request_id.reset(token)
+
 # =============================================================
 # RUTAS API (deben ir ANTES de las rutas estáticas)
 # =============================================================
 
 # ENDPOINT 0: /health  → diagnóstico de conexión a Google Sheets
-@app.route("/health", methods=["GET"])
-def health_check():
-    """Endpoint de diagnóstico: verifica conexión a Google Sheets y estado del sistema"""
-    with _events_lock:
-        queue_size = len(_events_queue)
+# /health/live  → O(1), sin llamadas externas (para el load balancer)
+# /health/deep  → verifica Sheets (sólo metadatos), cacheado HEALTH_CACHE_TTL segundos
+# /health       → alias de /health/deep (compatibilidad)
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "30"))
+
+_health_cache = {"status": None, "checked_at": 0.0}
+# Modo de servicio: asgi.py registra aquí la descripción de sus executors
+_serving_info = {"mode": "wsgi", "describe": None}
+_health_lock  = threading.Lock()   # Sólo un deep check en curso a la vez
+
+def _deep_health_status():
+    """Estado completo: configuración, colas, sinks y metadatos de Sheets (sin leer celdas)."""
     with _cache_lock:
         cache_client  = _sheets_cache["client"] is not None
         cache_wsheets = list(_sheets_cache["worksheets"].keys())
+        cache_sheets  = list(_sheets_cache["spreadsheets"].keys())
+        last_auth     = _sheets_cache["last_auth"]
+        creds = getattr(getattr(_sheets_cache["client"], "http_client", None), "auth", None)
 
     status = {
         "server": "ok",
         "gspread_version": getattr(gspread, '__version__', 'unknown'),
         "google_sheets_configured": bool(GOOGLE_SHEETS_CREDENTIALS),
         "openai_configured": bool(OPENAI_API_KEY),
-        "events_in_queue": queue_size,
+        "openai_circuit": _openai_breaker.describe(),
+        "ai_suggestion_cache": dict(_suggestion_cache.describe(), **_suggestion_flight.stats),
+        "ai_stream": _ai_stream_snapshot(),
+        "events_in_queue": _pending_events(),
+        "events_memory_queue": _events_queue.describe() if not _durable_ingest() else None,
+        "events_wal": _events_wal.stats() if _events_wal is not None else None,
+        "event_flusher": _event_flusher.describe() if _shared_queue is None else None,
+        "ingest_mode": "shared" if _shared_queue is not None else "local",
+        "flusher_leader": _flusher_election.is_leader if _flusher_election is not None else None,
+        "pid": os.getpid(),
+        "log_batch_group_commit": dict(_log_batch_committer.stats),
+        "log_batch_ingest": _log_batch_snapshot(),
+        "event_dedupe": _event_deduper.describe() if _event_deduper is not None else None,
         "cache_client": cache_client,
         "cache_worksheets": cache_wsheets,
+        "cache_spreadsheets": cache_sheets,
+        "sheets_token": {"expires_in_sec": round(_token_expires_in(creds)) if creds is not None else None,
+                         "last_refresh_age_sec": round(_time.time() - last_auth) if last_auth else None},
+        "storage": _storage.describe(),
+        "write_planner": dict(_write_planner_stats),
+        "rows_written": _rows_written_snapshot(),
+        "payload_blobs": _blob_store.describe() if _blob_store is not None else None,
+        "results_outbox": _results_outbox.stats() if _results_outbox is not None else None,
+        "sheets_quota": _sheets_governor.budget(),
+        "bulkheads": {b.name: b.describe() for b in (_sheets_bulkhead, _openai_bulkhead)},
+        "logging": logging_stats(),
+        "static": _static_assets.describe() if _static_assets is not None else None,
+        "traffic": _traffic_recorder.describe() if _traffic_recorder is not None else None,
+        "serving": _serving_info["describe"]() if _serving_info["describe"] else {"mode": _serving_info["mode"]},
     }
 
     # Intentar conectar a Google Sheets
@@ -358,23 +1462,23 @@ def health_check():
         if client:
             status["sheets_auth"] = "ok"
             try:
-                spreadsheet = client.open(GOOGLE_SHEET_NAME)
+                spreadsheet = open_spreadsheet(client, GOOGLE_SHEET_NAME, priority=PRIORITY_LOW)
                 status["spreadsheet"] = "ok"
                 status["spreadsheet_name"] = GOOGLE_SHEET_NAME
-                worksheets = [ws.title for ws in spreadsheet.worksheets()]
-                status["worksheets_found"] = worksheets
+                status["spreadsheet_key"] = spreadsheet.id
+                # worksheets() trae los metadatos de todas las hojas en una sola llamada
+                worksheets = {ws.title: ws for ws in _sheets_read(spreadsheet.worksheets, priority=PRIORITY_LOW)}
+                status["worksheets_found"] = list(worksheets)
+
+                # Con sharding, la hoja de eventos que importa es el shard activo
+                events_name = "events"
+                if _events_shards is not None and _events_shards.active is not None:
+                    events_name = _events_shards.active.name
+                if events_name in worksheets:
+                    status["events_rows"] = worksheets[events_name].row_count
 
-                # Verificar hoja de eventos
-                if "events" in worksheets:
-                    events_ws = spreadsheet.worksheet("events")
-                    status["events_rows"] = events_ws.row_count
-                    status["events_last_row"] = len(events_ws.get_all_values())
-
-                # Verificar hoja de resultados
                 if "results" in worksheets:
-                    results_ws = spreadsheet.worksheet("results")
-                    status["results_rows"] = results_ws.row_count
-                    status["results_last_row"] = len(results_ws.get_all_values())
+                    status["results_rows"] = worksheets["results"].row_count
                 else:
                     status["results_sheet"] = "NO EXISTE - se creará en el primer /finalize"
 
@@ -385,7 +1489,60 @@ def health_check():
     except Exception as e:
         status["sheets_auth"] = f"error: {type(e).__name__}: {e}"
 
-    return jsonify(status), 200
+    return status
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """Liveness: el proceso responde. No toca Sheets ni toma locks de la cola."""
+    return jsonify({"server": "ok"}), 200
+
+@app.route("/health", methods=["GET"])
+@app.route("/health/deep", methods=["GET"])
+def health_check():
+    """Endpoint de diagnóstico: verifica conexión a Google Sheets y estado del sistema"""
+    now = _time.time()
+    cached = _health_cache["status"]
+    if cached is not None and now - _health_cache["checked_at"] < HEALTH_CACHE_TTL:
+        return jsonify(dict(cached, cached=True, age_sec=round(now - _health_cache["checked_at"], 1))), 200
+
+    # Si otro request ya está calculando, devolver el último estado (aunque esté caducado)
+    if not _health_lock.acquire(blocking=cached is None):
+        return jsonify(dict(cached, cached=True, age_sec=round(now - _health_cache["checked_at"], 1))), 200
+    try:
+        with _sheets_bulkhead.slot():
+            status = _deep_health_status()
+        _health_cache["status"] = status
+        _health_cache["checked_at"] = _time.time()
+    except BulkheadFull as e:
+        if cached is None:
+            return _bulkhead_rejected(e)
+        return jsonify(dict(cached, cached=True, age_sec=round(now - _health_cache["checked_at"], 1))), 200
+    finally:
+        _health_lock.release()
+    return jsonify(dict(status, cached=False, age_sec=0.0)), 200
+
+# ENDPOINT 0b: /metrics  → métricas en formato de texto de Prometheus
+_metrics.gauge("results_outbox_pending", "Filas de resultados en la outbox pendientes de entregar",
+               lambda: _results_outbox.stats()["pending"] if _results_outbox is not None else None)
+_metrics.gauge("openai_circuit_open", "1 si el circuito del upstream de IA está abierto o en half-open",
+               lambda: 0 if _openai_breaker.describe()["state"] == "closed" else 1)
+_metrics.gauge("bulkhead_active", "Llamadas dentro de cada bulkhead", lambda: _bulkhead_stat("active"), ("bulkhead",))
+_metrics.gauge("bulkhead_waiting", "Peticiones esperando hueco en cada bulkhead", lambda: _bulkhead_stat("waiting"),
+               ("bulkhead",))
+_metrics.counter_from("log_records_dropped_total", "Líneas de log descartadas por cola del escritor llena",
+                      lambda: logging_stats()["dropped"])
+_metrics.counter_from("log_records_suppressed_total", "Avisos/errores suprimidos por el límite por sitio de llamada",
+                      lambda: logging_stats()["suppressed"])
+_metrics.counter_from("bulkhead_rejected_total", "Rechazos (503) de cada bulkhead",
+                      lambda: _bulkhead_stat("rejected_queue_full", "rejected_queue_timeout"), ("bulkhead",))
+
+def _bulkhead_stat(*fields):
+    return {(b.name,): sum(info[f] for f in fields)
+            for b, info in ((b, b.describe()) for b in (_sheets_bulkhead, _openai_bulkhead))}
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
 
 # ENDPOINT 1: /log  → encola evento para batch insert en Google Sheets
 @app.route("/log", methods=["POST"])
@@ -402,94 +1559,180 @@ def log_event():
         if data is None:
             return jsonify({"ok": True, "queued": False, "error": "JSON vacío"}), 200
 
-        row = _build_event_row(data)
-        with _events_lock:
-            _events_queue.append(row)
-            queue_size = len(_events_queue)
+        fresh, duplicates = _dedupe_events([data])
+        if duplicates:
+            return jsonify({"ok": True, "queued": False, "duplicate": True}), 200
 
-        event_type = data.get("event", "unknown")
-        subject_id = data.get("subject_id", "unknown")
-        print(f"📊 /log encolado: event={event_type}, subject={subject_id[:8]}..., cola={queue_size}")
+        row = _build_event_row(data)
+        try:
+            queue_size = _enqueue_event_rows([row])
+        except QueueFull as e:
+            # Backpressure explícito: la cola (memoria + spill) está llena, el cliente reintenta luego
+            _forget_events(fresh)
+            log.warning(f"⚠️ /log rechazado por backpressure: {e}")
+            return jsonify({"ok": False, "queued": False, "backpressure": True,
+                            "error": str(e)}), 503, {"Retry-After": "10"}
+        except Exception:
+            _forget_events(fresh)
+            raise
 
-        # Flush inmediato si la cola tiene 15+ eventos
-        if queue_size >= 15:
-            threading.Thread(target=flush_events, daemon=True).start()
+        if _event_log_sample():
+            log.info("📊 /log encolado", extra=fields(
+                event=data.get("event", "unknown"), subject=str(data.get("subject_id", "unknown"))[:8],
+                queue=queue_size, sample=f"1/{_event_log_sample.every}"))
 
-        return jsonify({"ok": True, "queued": True}), 200
+        backpressure = not _durable_ingest() and _events_queue.backpressure()
+        return jsonify({"ok": True, "queued": True, "backpressure": backpressure}), 200
 
     except Exception as e:
-        print(f"⚠️ ERROR inesperado en /log: {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR inesperado en /log: {type(e).__name__}: {e}")
         return jsonify({"ok": True, "queued": False, "error": str(e)}), 200
 
 # ENDPOINT 1b: /log-batch  → recibe múltiples eventos y los escribe directamente a Sheets
+# Acepta Content-Encoding gzip/deflate (y zstd si está instalado) y el formato compacto v2
+_log_batch_stats = {"requests": 0, "compressed": 0, "events": 0,
+                    "wire_bytes": 0, "json_bytes": 0, "parse_ms_total": 0.0}
+_log_batch_stats_lock = threading.Lock()
+
+def _record_log_batch(compressed, events, wire_bytes, json_bytes, parse_ms):
+    with _log_batch_stats_lock:
+        _log_batch_stats["requests"] += 1
+        _log_batch_stats["compressed"] += 1 if compressed else 0
+        _log_batch_stats["events"] += events
+        _log_batch_stats["wire_bytes"] += wire_bytes
+        _log_batch_stats["json_bytes"] += json_bytes
+        _log_batch_stats["parse_ms_total"] += parse_ms
+
+def _log_batch_snapshot():
+    with _log_batch_stats_lock:
+        stats = dict(_log_batch_stats)
+    events, requests_ = stats["events"], stats["requests"]
+    stats["wire_bytes_per_event"] = round(stats["wire_bytes"] / events, 1) if events else None
+    stats["json_bytes_per_event"] = round(stats["json_bytes"] / events, 1) if events else None
+    stats["parse_ms_avg"] = round(stats["parse_ms_total"] / requests_, 3) if requests_ else None
+    stats["parse_ms_total"] = round(stats["parse_ms_total"], 1)
+    stats["encodings"] = supported_encodings()
+    return stats
+
 @app.route("/log-batch", methods=["POST"])
 def log_batch():
     try:
-        if not request.is_json and not request.data:
+        if request.content_length is not None and request.content_length > LOG_BATCH_MAX_BYTES:
+            return jsonify({"ok": False, "error": "Lote demasiado grande"}), 413
+        raw = request.get_data(cache=False)
+        if not raw:
             return jsonify({"ok": True, "written": 0}), 200
 
+        started = _time.perf_counter()
+        encoding = request.headers.get("Content-Encoding", "")
         try:
-            data = request.get_json(force=True)
-        except Exception:
+            body = decode_body(raw, encoding, LOG_BATCH_MAX_BYTES)
+            data = json.loads(body)
+        except BodyTooLarge as e:
+            return jsonify({"ok": False, "error": str(e)}), 413
+        except ValueError as e:
+            # json.JSONDecodeError y UnicodeDecodeError también son ValueError
+            log.warning(f"⚠️ /log-batch: cuerpo inválido ({encoding or 'identity'}): {e}")
             return jsonify({"ok": False, "error": "JSON inválido"}), 400
 
-        events = data if isinstance(data, list) else data.get("events", [])
+        events, batch = parse_batch(data)
+        _record_log_batch(encoding not in ("", "identity"), len(events), len(raw), len(body),
+                          (_time.perf_counter() - started) * 1000)
         if not events:
             return jsonify({"ok": True, "written": 0}), 200
 
-        rows = [_build_event_row(evt) for evt in events if isinstance(evt, dict)]
+        # Descartar eventos ya recibidos (reintento o sendBeacon tras un fetch que sí llegó)
+        events, duplicates = _dedupe_events(events, batch)
+        if duplicates:
+            log.debug("📊 /log-batch: %d eventos duplicados descartados", duplicates)
+        rows = [_build_event_row(evt, batch) for evt in events]
         if not rows:
-            return jsonify({"ok": True, "written": 0}), 200
-
-        # Escribir directamente a Google Sheets (síncrono, igual que /finalize)
-        # Esto garantiza que los eventos no se pierdan si el proceso se reinicia.
-        client = get_cached_client()
-        if not client:
-            print(f"⚠️ /log-batch: Google Sheets no disponible, {len(rows)} eventos no guardados")
-            return jsonify({"ok": False, "error": "Google Sheets no disponible"}), 503
-
-        worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, "events", EVENTS_HEADERS)
-        if not worksheet:
-            print(f"⚠️ /log-batch: worksheet 'events' no disponible")
-            with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return jsonify({"ok": False, "error": "Worksheet no disponible"}), 503
+            return jsonify({"ok": True, "written": 0, "duplicates": duplicates}), 200
 
         try:
-            worksheet.append_rows(rows, value_input_option='RAW')
-            print(f"✅ /log-batch: {len(rows)} eventos escritos a Sheets")
-            return jsonify({"ok": True, "written": len(rows)}), 200
-        except gspread.exceptions.APIError as e:
-            print(f"⚠️ /log-batch: APIError escribiendo {len(rows)} eventos: {e}")
-            with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return jsonify({"ok": False, "error": f"APIError: {e}"}), 503
-        except Exception as e:
-            print(f"⚠️ /log-batch: Error escribiendo {len(rows)} eventos: {type(e).__name__}: {e}")
-            with _cache_lock:
-                _sheets_cache["worksheets"].pop("events", None)
-            return jsonify({"ok": False, "error": str(e)}), 503
+            # Con WAL o cola compartida: persistencia local y respuesta inmediata;
+            # el flusher (o el flusher elegido en modo shared) hace el replay a Sheets
+            if _durable_ingest():
+                _enqueue_event_rows(rows)
+                return jsonify({"ok": True, "written": len(rows), "duplicates": duplicates, "durable": True}), 200
+
+            # Sin WAL: escribir directamente a Google Sheets (síncrono, igual que /finalize)
+            # Esto garantiza que los eventos no se pierdan si el proceso se reinicia.
+            # Sin esperar hueco: si Sheets está saturado, encolar en memoria es más barato que bloquear el worker
+            permit = _sheets_bulkhead.try_acquire()
+            if permit is None:
+                # Sheets saturado: el lote pasa a la cola en memoria (como /log); lo escribe el flusher
+                try:
+                    queue_size = _enqueue_event_rows(rows)
+                except QueueFull as qe:
+                    _forget_events(events, batch)
+                    busy = BulkheadFull(_sheets_bulkhead.name, "busy", max(1, int(BULKHEAD_SHEETS_WAIT_SEC)))
+                    return _bulkhead_rejected(busy, backpressure=True, detail=str(qe))
+                log.info("📊 /log-batch: Sheets saturado, %d eventos a la cola (cola=%d)", len(rows), queue_size)
+                return jsonify({"ok": True, "written": 0, "queued": len(rows), "duplicates": duplicates}), 200
+            try:
+                if GROUP_COMMIT_WINDOW_MS > 0:
+                    error = _log_batch_committer.submit(rows)
+                else:
+                    error = _write_cycle(rows, "/log-batch").get("events")
+            finally:
+                permit.release()
+        except Exception:
+            _forget_events(events, batch)
+            raise
+        if error is not None:
+            _forget_events(events, batch)
+            return jsonify({"ok": False, "error": error}), 503
+        return jsonify({"ok": True, "written": len(rows), "duplicates": duplicates}), 200
 
     except Exception as e:
-        print(f"⚠️ ERROR en /log-batch: {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR en /log-batch: {type(e).__name__}: {e}")
         return jsonify({"ok": False, "error": str(e)}), 503
 
-# ENDPOINT 1c: /flush-events  → fuerza escritura de todos los eventos pendientes
+# ENDPOINT 1c: /flush-events  → fuerza la escritura de un lote de eventos pendientes
 @app.route("/flush-events", methods=["POST"])
 def flush_events_endpoint():
     try:
-        success = flush_events()
-        return jsonify({"ok": True, "flushed": success}), 200
+        # Sin esperar hueco ni cuota: con Sheets saturado se le pide al flusher que vacíe la cola
+        # (y /finalize lleva consigo los eventos pendientes), el cliente no tiene que esperar
+        budget = _sheets_governor.budget()
+        permit = None
+        if budget["cooldown_sec"] == 0 and budget["write_fraction"] >= 0.25:
+            permit = _sheets_bulkhead.try_acquire()
+        if permit is None:
+            if _shared_queue is None:
+                _event_flusher.flush_now()
+            return jsonify({"ok": True, "flushed": False, "pending": _pending_events()}), 200
+        try:
+            # Un ciclo como mucho con el hueco tomado; el resto lo drena el flusher a su ritmo
+            success = flush_events(max_rows=WAL_DRAIN_BATCH)
+        finally:
+            permit.release()
+        return jsonify({"ok": True, "flushed": success, "pending": _pending_events()}), 200
     except Exception as e:
-        print(f"⚠️ ERROR en /flush-events: {type(e).__name__}: {e}")
+        log.error(f"⚠️ ERROR en /flush-events: {type(e).__name__}: {e}")
         return jsonify({"ok": False, "error": str(e)}), 200
 
-def _build_event_row(data):
-    """Construye una fila de evento a partir del JSON recibido"""
-    timestamp = data.get("ts") or datetime.utcnow().isoformat()
-    payload   = data.get("payload", {})
-    if not isinstance(payload, dict):
-        payload = {}
+def _build_event_row(data, batch=None):
+    """Construye una fila de evento a partir del JSON recibido
+    (o de un item compacto [seq, dt_ms, evento, payload] de un lote v2 y su cabecera `batch`)"""
+    if batch is not None:
+        timestamp  = batch.timestamp(data) or datetime.utcnow().isoformat()
+        subject_id = batch.subject_id
+        policy     = batch.policy
+        event      = batch.event(data)
+        payload    = batch.payload(data)
+    else:
+        timestamp  = data.get("ts") or datetime.utcnow().isoformat()
+        subject_id = data.get("subject_id", "")
+        policy     = data.get("policy", "")
+        event      = data.get("event", "")
+        payload    = data.get("payload", {})
+        if not isinstance(payload, dict):
+            payload = {}
+
+    # Campos grandes (edits, textos) → referencia a blob; el resto sigue en la celda
+    payload = _offload_payload(subject_id, payload)
 
     # trial_index como entero cuando es posible
     raw_trial = payload.get("trial_index", "")
@@ -506,7 +1749,7 @@ def _build_event_row(data):
         time_on_screen_sec = raw_time
 
     element_clicked = ""
-    if data.get("event") == "click" and "element" in payload:
+    if event == "click" and "element" in payload:
         elem = payload.get("element", {})
         if isinstance(elem, dict):
             tag       = elem.get('tag') or ''
@@ -524,9 +1767,9 @@ def _build_event_row(data):
 
     return [
         timestamp,
-        data.get("subject_id", ""),
-        data.get("policy", ""),
-        data.get("event", ""),
+        subject_id,
+        policy,
+        event,
         trial_index,
         time_on_screen_sec,
         element_clicked,
@@ -536,91 +1779,74 @@ def _build_event_row(data):
 # =============================================================
 # ENDPOINT 2: /finalize  → guarda resumen final en Google Sheets
 # =============================================================
+# Headers para la hoja de resultados
+# IMPORTANTE: deben coincidir EXACTAMENTE con los name= del frontend
+RESULTS_HEADERS = [
+    "timestamp", "subject_id", "policy",
+    # Demográficos
+    "dob", "sex", "studies", "grad_year", "uni", "field", "gpa",
+    # Tarea
+    "task_text", "words", "edit_count",
+    # Métricas conductuales de IA y copy/paste (registradas automáticamente)
+    "ai_chars_inserted", "paste_count", "paste_total_chars",
+    # Declaración de uso de IA (autoreportado)
+    "ai_generated_pct", "ai_paraphrased_pct",
+    # Control
+    "policy_restrictiveness", "used_ai_button", "used_external_ai",
+    # Tu entorno y la IA (Pantalla 7 — coincide con name= del form)
+    "subj_norm_desc_1", "subj_norm_inj_1",
+    "pbc_evasion_1", "pbc_capacity_1", "opp_perceived_1",
+    "norm_clarity_1", "pressure_1", "ai_frequency",
+    # Valores y motivaciones (Pantalla 7b — coincide con name= del form)
+    "motiv_orient_1",
+    "moral_intern_1", "moral_guilt_1", "moral_principles_1",
+    "rationaliz_util_1", "rationaliz_norm_1",
+    # Contacto (opcional)
+    "email"
+]
+
 @app.route("/finalize", methods=["POST"])
 def finalize():
     try:
         # Validar que la petición contiene JSON
         if not request.is_json and not request.data:
-            print("⚠️ ERROR en /finalize: Request no contiene JSON")
+            log.error("⚠️ ERROR en /finalize: Request no contiene JSON")
             return jsonify({"ok": False, "error": "Request debe contener JSON"}), 400
 
         # Parsear JSON con manejo de errores
         try:
             data = request.get_json(force=True)
         except Exception as e:
-            print(f"⚠️ ERROR en /finalize: JSON inválido: {type(e).__name__}: {e}")
+            log.error(f"⚠️ ERROR en /finalize: JSON inválido: {type(e).__name__}: {e}")
             return jsonify({"ok": False, "error": "JSON inválido"}), 400
 
         # Validar que data no sea None
         if data is None:
-            print("⚠️ ERROR en /finalize: JSON parseado es None")
+            log.error("⚠️ ERROR en /finalize: JSON parseado es None")
             return jsonify({"ok": False, "error": "JSON vacío"}), 400
 
         # Validar campos requeridos
         subject_id = data.get("subject_id")
         if not subject_id:
-            print("⚠️ ERROR en /finalize: subject_id es requerido")
+            log.error("⚠️ ERROR en /finalize: subject_id es requerido")
             return jsonify({"ok": False, "error": "subject_id es requerido"}), 400
 
         demographics = data.get("demographics", {})
         if not isinstance(demographics, dict):
-            print("⚠️ ERROR en /finalize: demographics debe ser un objeto")
+            log.error("⚠️ ERROR en /finalize: demographics debe ser un objeto")
             demographics = {}
 
         results = data.get("results", {})
         if not isinstance(results, dict):
-            print("⚠️ ERROR en /finalize: results debe ser un objeto")
+            log.error("⚠️ ERROR en /finalize: results debe ser un objeto")
             results = {}
 
-        # Debug: Log task_text length y preview
+        # Una línea con longitudes; el texto (lo escribe el participante) sólo en DEBUG
         task_text = results.get("task_text", "")
-        has_newlines = '\n' in task_text
-        print(f"📝 Finalizando participante {subject_id}:")
-        print(f"   - task_text length: {len(task_text)} caracteres")
-        print(f"   - words: {results.get('words', 0)} palabras")
-        print(f"   - task_text preview (primeros 100 chars): {task_text[:100] if task_text else '(vacío)'}")
-        print(f"   - task_text tiene saltos de línea: {'Sí' if has_newlines else 'No'}")
-
-        # Flush de eventos pendientes ANTES de guardar resultados
-        print(f"🔄 Flushing eventos pendientes antes de finalizar...")
-        flush_events()
-
-        # Conectar con Google Sheets (usando caché)
-        client = get_cached_client()
-        if not client:
-            print("⚠️ ERROR CRÍTICO: Google Sheets no disponible en /finalize")
-            return jsonify({"ok": False, "error": "Google Sheets no configurado - datos no guardados"}), 503
-
-        # Headers para la hoja de resultados
-        # IMPORTANTE: deben coincidir EXACTAMENTE con los name= del frontend
-        headers = [
-            "timestamp", "subject_id", "policy",
-            # Demográficos
-            "dob", "sex", "studies", "grad_year", "uni", "field", "gpa",
-            # Tarea
-            "task_text", "words", "edit_count",
-            # Métricas conductuales de IA y copy/paste (registradas automáticamente)
-            "ai_chars_inserted", "paste_count", "paste_total_chars",
-            # Declaración de uso de IA (autoreportado)
-            "ai_generated_pct", "ai_paraphrased_pct",
-            # Control
-            "policy_restrictiveness", "used_ai_button", "used_external_ai",
-            # Tu entorno y la IA (Pantalla 7 — coincide con name= del form)
-            "subj_norm_desc_1", "subj_norm_inj_1",
-            "pbc_evasion_1", "pbc_capacity_1", "opp_perceived_1",
-            "norm_clarity_1", "pressure_1", "ai_frequency",
-            # Valores y motivaciones (Pantalla 7b — coincide con name= del form)
-            "motiv_orient_1",
-            "moral_intern_1", "moral_guilt_1", "moral_principles_1",
-            "rationaliz_util_1", "rationaliz_norm_1",
-            # Contacto (opcional)
-            "email"
-        ]
-        worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, "results", headers)
-
-        if not worksheet:
-            print("⚠️ ERROR CRÍTICO: No se pudo obtener worksheet 'results' en /finalize")
-            return jsonify({"ok": False, "error": "No se pudo acceder a la hoja de resultados"}), 503
+        log.info("📝 Finalizando participante", extra=fields(
+            subject=subject_id, task_chars=len(task_text), words=results.get("words", 0),
+            newlines=task_text.count("\n")))
+        log.debug("📝 task_text (primeros 100 chars): %r", task_text[:100])
 
         # Extraer datos de forma segura
         ai_usage     = results.get("ai_usage", {})     if isinstance(results.get("ai_usage"),     dict) else {}
@@ -678,191 +1904,652 @@ def finalize():
         ]
 
         # Verificar coherencia entre headers y fila antes de escribir
-        if len(row) != len(headers):
-            print(f"⚠️ INCONSISTENCIA en /finalize: {len(row)} valores vs {len(headers)} headers")
+        if len(row) != len(RESULTS_HEADERS):
+            log.warning(f"⚠️ INCONSISTENCIA en /finalize: {len(row)} valores vs {len(RESULTS_HEADERS)} headers")
             return jsonify({"ok": False, "error": "Error interno: longitud de fila incorrecta"}), 500
 
-        # Insertar con reintentos (hasta 3 intentos con backoff exponencial)
+        # Outbox: guardar en local (idempotente por subject_id) y responder sin esperar a Sheets
+        if _results_outbox is not None:
+            outcome = _results_outbox.put(subject_id, row)
+            _outbox_wakeup.set()
+            log.info(f"📥 /finalize: resultados de {subject_id} en outbox ({outcome})")
+            return jsonify({"ok": True, "finalized": True, "queued": True,
+                            "duplicate": outcome == OUTBOX_DUPLICATE}), 200
+
+        # Sin outbox: la fila viaja con los eventos pendientes (y con los /finalize concurrentes)
+        # en la misma llamada; reintentos hasta 3 veces con backoff exponencial
         last_error = None
         for attempt in range(3):
             try:
-                worksheet.append_row(row, value_input_option='RAW')
-                print(f"✅ Datos finales guardados para {subject_id} (intento {attempt+1})")
+                with _sheets_bulkhead.slot():
+                    last_error = _results_committer.submit([row])
+            except BulkheadFull as e:
+                return _bulkhead_rejected(e)
+            if last_error is None:
+                log.info(f"✅ Datos finales guardados para {subject_id} (intento {attempt+1})")
                 return jsonify({"ok": True, "finalized": True}), 200
-            except gspread.exceptions.APIError as e:
-                last_error = str(e)
-                print(f"⚠️ /finalize APIError intento {attempt+1}/3: {e}")
-                with _cache_lock:
-                    _sheets_cache["worksheets"].pop("results", None)
-                if attempt < 2:
-                    _time.sleep(2 ** attempt)  # 1s, 2s antes del 3er intento
-                    worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, "results", headers)
-                    if not worksheet:
-                        last_error = "worksheet 'results' no disponible tras reintento"
-                        break
-            except Exception as e:
-                last_error = f"{type(e).__name__}: {e}"
-                print(f"⚠️ /finalize error intento {attempt+1}/3: {last_error}")
-                if attempt < 2:
-                    _time.sleep(2 ** attempt)
-                    worksheet = get_cached_worksheet(client, GOOGLE_SHEET_NAME, "results", headers)
-                    if not worksheet:
-                        last_error = "worksheet 'results' no disponible tras reintento"
-                        break
+            log.warning(f"⚠️ /finalize error intento {attempt+1}/3: {last_error}")
+            if attempt < 2:
+                _time.sleep(_sheets_governor.retry_delay(attempt))  # Backoff con jitter (respeta el cooldown por 429)
 
-        print(f"❌ /finalize: todos los reintentos fallaron para {subject_id}: {last_error}")
+        log.error(f"❌ /finalize: todos los reintentos fallaron para {subject_id}: {last_error}")
         return jsonify({"ok": False, "error": f"Error guardando datos tras 3 intentos: {last_error}"}), 503
 
     except Exception as e:
-        print(f"⚠️ ERROR CRÍTICO inesperado en /finalize: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        log.exception(f"⚠️ ERROR CRÍTICO inesperado en /finalize: {type(e).__name__}: {e}")
         return jsonify({"ok": False, "error": f"Error del servidor: {str(e)}"}), 500
 
 # =============================================================
-# ENDPOINT 3: /ai-suggest  → sugerencia de IA con OpenAI
+# OUTBOX DE RESULTADOS (entrega en segundo plano de /finalize)
 # =============================================================
-@app.route("/ai-suggest", methods=["POST"])
-def ai_suggest():
+# El hilo de entrega primero vacía la cola de eventos (para que los eventos de
+# un participante lleguen antes que su fila de resultados); las filas de la
+# outbox viajan con el último lote de eventos en la misma llamada, y
+# deliver_results entrega las que queden. Si una fila ya se
+# intentó antes (p. ej. el proceso murió tras escribir en Sheets pero antes de
+# marcarla), se comprueba el subject_id en el destino para no duplicarla.
+OUTBOX_BATCH       = 50      # Máximo de filas de resultados por append
+OUTBOX_INTERVAL    = 5.0     # Segundos entre entregas si nadie despierta al hilo
+OUTBOX_MAX_BACKOFF = 120.0
+
+_results_outbox = None
+if FINALIZE_OUTBOX_PATH:
+    try:
+        _results_outbox = ResultsOutbox(FINALIZE_OUTBOX_PATH)
+        log.info(f"✅ Outbox de resultados en '{FINALIZE_OUTBOX_PATH}': {_results_outbox.stats()['pending']} pendientes")
+    except Exception as e:
+        log.error(f"⚠️ ERROR abriendo outbox '{FINALIZE_OUTBOX_PATH}': {type(e).__name__}: {e} — /finalize será síncrono")
+        _results_outbox = None
+
+_outbox_wakeup = threading.Event()
+_outbox_lock = threading.Lock()    # Una sola entrega a la vez en este proceso
+
+# subject_id que ya están en "results": una lectura de la columna (tras el último intento de
+# entrega fallido, que pudo llegar a escribirse) más lo que se ha entregado desde entonces
+OUTBOX_RECHECK_DELAY = 5.0   # Segundos tras un fallo antes de releer (la escritura pudo confirmarse tarde)
+# Lease de las filas reclamadas: más que el ciclo de escritura más largo (espera de cuota incluida);
+# si el proceso muere, otro worker las reclama al caducar
+OUTBOX_LEASE_SEC = max(60.0, 3 * SHEETS_QUOTA_MAX_WAIT)
+_OUTBOX_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_results_seen = {"keys": None, "read_at": 0.0, "last_failure": 0.0}    # Horas de time.time()
+
+def _results_already_written(keys, since=0.0):
+    """Subconjunto de `keys` que ya está en "results", o None si ahora no se puede saber.
+    since: último intento de esas filas (quizá de otro worker); la lectura tiene que ser posterior."""
+    now = _time.time()
+    failure = max(_results_seen["last_failure"], since)
+    if _results_seen["keys"] is not None and _results_seen["read_at"] > failure + OUTBOX_RECHECK_DELAY:
+        return {key for key in keys if key in _results_seen["keys"]}
+    if now < failure + OUTBOX_RECHECK_DELAY:
+        return None
+    existing = _storage.existing_values("results", RESULTS_HEADERS, "subject_id")
+    if existing is None:
+        return None
+    _results_seen["keys"], _results_seen["read_at"] = set(existing), now
+    return {key for key in keys if key in existing}
+
+def _claim_outbox_rows():
+    """Filas pendientes de la outbox para el ciclo de escritura actual: (claves, filas) con
+    _outbox_lock adquirido, o None si no hay nada (o otro hilo las está entregando).
+    Las filas se reservan en la outbox (lease), así que otro worker nunca envía las mismas."""
+    if _results_outbox is None:
+        return None
+    if _flusher_election is not None and not _flusher_election.is_leader:
+        return None     # Modo compartido: entrega sólo el flusher elegido
+    if not _outbox_lock.acquire(blocking=False):
+        return None
+    held = []
     try:
-        # Validar que OpenAI API Key está configurado
-        if not OPENAI_API_KEY:
-            print("⚠️ ERROR en /ai-suggest: OPENAI_API_KEY no configurado")
-            return jsonify({"ok": False, "error": "Servicio de IA no disponible"}), 503
+        while True:
+            items = _results_outbox.claim(OUTBOX_BATCH, _OUTBOX_OWNER, OUTBOX_LEASE_SEC)
+            retried = [key for key, _, attempts in items if attempts > 0]
+
+            # Reintentos: comprobar en el destino qué subject_id ya están escritos. Si no se
+            # puede saber (lectura fallida, sin cuota) esperan al siguiente ciclo: reenviarlos
+            # duplicaría las filas cuya escritura anterior sí llegó a Sheets
+            already = set()
+            if retried and _storage.can_check_existing:
+                already = _results_already_written(retried, _results_outbox.last_attempt(retried))
+                if already is None:
+                    already = set()
+                    held.extend(retried)
+                elif already:
+                    log.info(f"♻️ outbox: {len(already)} resultados ya estaban en 'results', no se duplican")
+                    _results_outbox.mark_delivered(list(already))
+
+            to_send = [(key, row) for key, row, _ in items if key not in already and key not in held]
+            if to_send:
+                keys = [key for key, _ in to_send]
+                _results_outbox.mark_attempt(keys)
+                return keys, [row for _, row in to_send]
+            if not already:
+                _outbox_lock.release()
+                return None
+    except Exception:
+        _outbox_lock.release()
+        raise
+    finally:
+        if held:
+            _results_outbox.release(held)
+
+def _outbox_rows_done(keys, error):
+    if error is not None:
+        _results_seen["last_failure"] = _time.time()
+        _results_outbox.record_error(keys, error)
+        log.warning(f"⚠️ outbox: {len(keys)} resultados sin entregar: {error}")
+        return
+    _results_outbox.mark_delivered(keys)
+    if _results_seen["keys"] is not None:
+        _results_seen["keys"].update(keys)
+    log.info(f"✅ outbox: {len(keys)} resultados guardados ({', '.join(keys[:5])}{'...' if len(keys) > 5 else ''})")
+
+def deliver_results():
+    """Entrega las filas pendientes de la outbox que no viajaron con el último lote de eventos.
+    Devuelve True si no queda nada pendiente."""
+    if _results_outbox is None:
+        return True
+    while True:
+        errors = _write_cycle([], "outbox")
+        if "results" not in errors:
+            return not _results_outbox.pending(1)
+        if errors["results"] is not None:
+            return False
 
-        # Validar que la petición contiene JSON
-        if not request.is_json and not request.data:
-            print("⚠️ ERROR en /ai-suggest: Request no contiene JSON")
-            return jsonify({"ok": False, "error": "Request debe contener JSON"}), 400
+def _write_results_now(rows):
+    """/finalize sin outbox: los eventos pendientes y las filas de resultados del grupo en las mismas
+    llamadas (los resultados con el último lote de eventos). Devuelve None o el error de "results"."""
+    if _flusher_election is not None and not _flusher_election.is_leader:
+        # Modo compartido: este worker no escribe eventos (lo hace el flusher elegido)
+        return _write_cycle([], "/finalize", result_rows=rows).get("results")
+    if not _flush_lock.acquire(timeout=SHEETS_QUOTA_MAX_WAIT):
+        return _write_cycle([], "/finalize", result_rows=rows).get("results")
+    try:
+        # Con tráfico continuo la cola nunca llega a vaciarse: drenar como mucho hasta el plazo
+        deadline = _time.monotonic() + SHEETS_QUOTA_MAX_WAIT
+        while True:
+            event_rows, commit = _peek_events(_flush_batch_size(WAL_DRAIN_BATCH))
+            last = (not event_rows or _pending_events() <= len(event_rows)
+                    or _time.monotonic() >= deadline)
+            errors = _write_cycle(event_rows, "/finalize", result_rows=rows if last else [])
+            if event_rows and errors.get("events") is None:
+                commit()
+            if last:
+                return errors.get("results")
+            if errors.get("events") is not None:
+                # Los eventos no entran: que al menos los resultados no esperen
+                return _write_cycle([], "/finalize", result_rows=rows).get("results")
+    finally:
+        _flush_lock.release()
 
-        # Parsear JSON con manejo de errores
+# Los /finalize síncronos concurrentes (fin de sesión de varios participantes) comparten ciclo;
+# cada petición recibe el resultado de la escritura de su grupo
+_results_committer = _GroupCommitter(_write_results_now, GROUP_COMMIT_WINDOW_MS / 1000.0, OUTBOX_BATCH)
+
+def _outbox_loop():
+    """Hilo de entrega: eventos primero, luego resultados; backoff con jitter si falla."""
+    delay = OUTBOX_INTERVAL
+    attempt = 0
+    while True:
+        _outbox_wakeup.wait(timeout=delay)
+        _outbox_wakeup.clear()
         try:
-            data = request.get_json(force=True)
+            flush_events()
+            ok = deliver_results()
         except Exception as e:
-            print(f"⚠️ ERROR en /ai-suggest: JSON inválido: {type(e).__name__}: {e}")
-            return jsonify({"ok": False, "error": "JSON inválido"}), 400
+            log.warning(f"⚠️ outbox: error inesperado: {type(e).__name__}: {e}")
+            ok = False
+        if ok:
+            delay, attempt = OUTBOX_INTERVAL, 0
+        else:
+            delay = min(OUTBOX_MAX_BACKOFF, max(OUTBOX_INTERVAL, _sheets_governor.retry_delay(attempt)))
+            attempt += 1
 
-        # Validar que data no sea None
-        if data is None:
-            print("⚠️ ERROR en /ai-suggest: JSON parseado es None")
-            return jsonify({"ok": False, "error": "JSON vacío"}), 400
+if _results_outbox is not None:
+    threading.Thread(target=_outbox_loop, name="results-outbox", daemon=True).start()
+
+# =============================================================
+# ENDPOINT 3: /ai-suggest  → sugerencia de IA con OpenAI
+# =============================================================
+# Sesión HTTP compartida (pool keep-alive) y circuit breaker del upstream de IA
+_openai_session = create_session(OPENAI_POOL_SIZE)
+_openai_breaker = CircuitBreaker(OPENAI_CB_FAILURES, OPENAI_CB_RESET_SEC)
+# Compartimento propio: una OpenAI lenta no puede quedarse con todos los workers
+_openai_bulkhead = Bulkhead("openai", BULKHEAD_OPENAI_MAX, BULKHEAD_OPENAI_QUEUE, BULKHEAD_OPENAI_WAIT_SEC)
+
+# Los participantes pulsan el botón varias veces sobre el mismo texto: las sugerencias
+# se cachean por (modo, text[:400], selección, política) y las idénticas en vuelo se agrupan
+_suggestion_cache = SuggestionCache(AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES, int(AI_CACHE_MAX_MB * 1024 * 1024))
+_suggestion_flight = SingleFlight()
+
+def _build_ai_prompt(text, selection):
+    """Devuelve (system_prompt, prompt) para /ai-suggest. El texto se recorta a 400 caracteres."""
+    # Construir prompt: devuelve fragmentos de texto listo para copiar/pegar,
+    # no ideas ni sugerencias abstractas sobre qué escribir.
+    system_prompt = (
+        "Eres un asistente de redacción académica en español. "
+        "Tu tarea es escribir fragmentos de texto concretos y listos para copiar y pegar, "
+        "acordes con lo que el usuario ya ha escrito. "
+        "NUNCA expliques qué podría escribir el usuario ni des consejos. "
+        "SÓLO escribe el fragmento de texto directamente, como si fuera parte del texto del usuario. "
+        "El fragmento debe ser natural, fluido y coherente con el texto existente."
+    )
+    if selection:
+        # Reescribir la selección manteniendo el sentido pero mejorando la redacción
+        prompt = (
+            f"El usuario escribe sobre cómo sus estudios le ayudarán en el futuro. "
+            f"Texto completo hasta ahora:\n\"{text[:400]}\"\n\n"
+            f"Ha seleccionado esta parte para mejorarla: \"{selection}\"\n\n"
+            f"Reescribe esa parte seleccionada con mejor redacción. "
+            f"Devuelve SÓLO el fragmento reescrito (máximo 40 palabras), sin comillas ni explicaciones."
+        )
+    else:
+        # Continuar el texto con un fragmento concreto
+        prompt = (
+            f"El usuario escribe sobre cómo sus estudios le ayudarán en el futuro. "
+            f"Lo que lleva escrito hasta ahora:\n\"{text[:400]}\"\n\n"
+            f"Escribe una oración o frase corta (máximo 30 palabras) que continúe o complemente "
+            f"de forma natural lo que ya ha escrito. "
+            f"Devuelve SÓLO el fragmento, sin comillas ni explicaciones."
+        )
+    return system_prompt, prompt
+
+def _record_ai_status(status_code):
+    """5xx y 429 cuentan como fallo del upstream; el resto cierra el circuito."""
+    if status_code >= 500 or status_code == 429:
+        _openai_breaker.record_failure()
+    elif status_code < 400:
+        _openai_breaker.record_success()
+    else:
+        _openai_breaker.release_probe()
+
+def _ai_status_error(openai_response):
+    """Traduce un status HTTP del upstream de IA a (body, status, headers); None si es 200."""
+    if openai_response.status_code == 401:
+        log.error("⚠️ ERROR en /ai-suggest: API Key inválido (401)")
+        return {"ok": False, "error": "Servicio de IA mal configurado"}, 503, {}
+    elif openai_response.status_code == 429:
+        log.error("⚠️ ERROR en /ai-suggest: Rate limit excedido (429)")
+        return {"ok": False, "error": "Límite de uso de IA excedido, intenta de nuevo más tarde"}, 429, {}
+    elif openai_response.status_code == 500:
+        log.error("⚠️ ERROR en /ai-suggest: Error del servidor de OpenAI (500)")
+        return {"ok": False, "error": "El servicio de IA está teniendo problemas"}, 503, {}
+    elif openai_response.status_code != 200:
+        log.error(f"⚠️ ERROR en /ai-suggest: Status code {openai_response.status_code}")
+        try:
+            error_detail = openai_response.json()
+            log.warning(f"   Detalle: {error_detail}")
+        except (ValueError, Exception):
+            pass
+        return {"ok": False, "error": f"Error del servicio de IA (código {openai_response.status_code})"}, 503, {}
+    return None
+
+def _bulkhead_busy_body(e):
+    log.error(f"⚠️ ERROR en /ai-suggest: {e}")
+    return ({"ok": False, "error": "El servicio de IA está saturado, intenta de nuevo en unos segundos"}, 503,
+            {"Retry-After": str(e.retry_after)})
+
+def _request_suggestion(system_prompt, prompt):
+    """Llama al upstream de IA dentro de su bulkhead. Devuelve (body, status, headers)."""
+    # El hueco se toma antes de consultar el breaker: un rechazo por saturación no consume la prueba half-open
+    try:
+        with _openai_bulkhead.slot():
+            return _call_suggestion_upstream(system_prompt, prompt)
+    except BulkheadFull as e:
+        return _bulkhead_busy_body(e)
+
+def _call_suggestion_upstream(system_prompt, prompt):
+    """Llama al upstream de IA (pool + circuit breaker). Devuelve (body, status, headers)."""
+    # Circuito abierto: fallar rápido en lugar de esperar el timeout
+    if not _openai_breaker.allow():
+        _observe_openai("suggest", "circuit_open")
+        return ({"ok": False, "error": "El servicio de IA no está disponible temporalmente"}, 503,
+                {"Retry-After": str(_openai_breaker.retry_after())})
+
+    # Llamar a OpenAI API con manejo robusto de errores
+    started = _time.perf_counter()
+    try:
+        openai_response = _openai_session.post(
+            f"{OPENAI_BASE_URL}/chat/completions",
+            headers=_openai_headers(),
+            json=_openai_payload(system_prompt, prompt),
+            timeout=OPENAI_TIMEOUT
+        )
+    except requests.exceptions.Timeout:
+        _openai_breaker.record_failure()
+        _observe_openai("suggest", "timeout", started)
+        log.error("⚠️ ERROR en /ai-suggest: Timeout llamando a OpenAI API")
+        return {"ok": False, "error": "Timeout - la IA tardó demasiado en responder"}, 504, {}
+    except requests.exceptions.ConnectionError as e:
+        _openai_breaker.record_failure()
+        _observe_openai("suggest", "connection_error", started)
+        log.error(f"⚠️ ERROR en /ai-suggest: Error de conexión: {e}")
+        return {"ok": False, "error": "Error de conexión con el servicio de IA"}, 503, {}
+    except requests.exceptions.RequestException as e:
+        _openai_breaker.record_failure()
+        _observe_openai("suggest", "network_error", started)
+        log.error(f"⚠️ ERROR en /ai-suggest: Error de red: {type(e).__name__}: {e}")
+        return {"ok": False, "error": "Error de red"}, 503, {}
+
+    _observe_openai("suggest", openai_response.status_code, started)
+    _record_ai_status(openai_response.status_code)
+
+    # Validar código de estado HTTP
+    error = _ai_status_error(openai_response)
+    if error is not None:
+        return error
+    return _parse_suggestion_response(openai_response)
+
+def _openai_headers():
+    return {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+
+def _openai_payload(system_prompt, prompt, stream=False):
+    """Cuerpo de /chat/completions (lo comparten la ruta WSGI y la ASGI)."""
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 80,
+        "temperature": 0.7
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def _parse_suggestion_response(openai_response):
+    """Extrae la sugerencia de una respuesta 200 del upstream (requests o httpx). Devuelve (body, status, headers)."""
+    # Parsear respuesta JSON
+    try:
+        result = openai_response.json()
+    except ValueError as e:
+        log.error(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI no es JSON válido: {e}")
+        return {"ok": False, "error": "Respuesta inválida del servicio de IA"}, 500, {}
+
+    # Validar estructura de respuesta
+    if not isinstance(result, dict):
+        log.error(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI no es un diccionario: {type(result)}")
+        return {"ok": False, "error": "Respuesta inválida del servicio de IA"}, 500, {}
+
+    if "choices" not in result or not isinstance(result["choices"], list) or len(result["choices"]) == 0:
+        log.error(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI sin 'choices': {result}")
+        return {"ok": False, "error": "Respuesta incompleta del servicio de IA"}, 500, {}
+
+    if "message" not in result["choices"][0] or "content" not in result["choices"][0]["message"]:
+        log.error(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI sin 'content': {result['choices'][0]}")
+        return {"ok": False, "error": "Respuesta incompleta del servicio de IA"}, 500, {}
+
+    suggestion = result["choices"][0]["message"]["content"].strip()
+
+    if not suggestion:
+        log.warning("⚠️ WARNING en /ai-suggest: OpenAI devolvió sugerencia vacía")
+        return {"ok": False, "error": "El servicio de IA no pudo generar una sugerencia"}, 500, {}
+
+    return {"ok": True, "suggestion": suggestion}, 200, {}
+
+def _parse_ai_request(endpoint):
+    """Validación común de /ai-suggest y /ai-suggest/stream. Devuelve (data, None) o (None, (body, status))."""
+    # Validar que OpenAI API Key está configurado
+    if not OPENAI_API_KEY:
+        log.error(f"⚠️ ERROR en {endpoint}: OPENAI_API_KEY no configurado")
+        return None, ({"ok": False, "error": "Servicio de IA no disponible"}, 503)
+
+    # Validar que la petición contiene JSON
+    if not request.is_json and not request.data:
+        log.error(f"⚠️ ERROR en {endpoint}: Request no contiene JSON")
+        return None, ({"ok": False, "error": "Request debe contener JSON"}, 400)
+
+    # Parsear JSON con manejo de errores
+    try:
+        data = request.get_json(force=True)
+    except Exception as e:
+        log.error(f"⚠️ ERROR en {endpoint}: JSON inválido: {type(e).__name__}: {e}")
+        return None, ({"ok": False, "error": "JSON inválido"}, 400)
+
+    # Validar que data no sea None
+    if data is None:
+        log.error(f"⚠️ ERROR en {endpoint}: JSON parseado es None")
+        return None, ({"ok": False, "error": "JSON vacío"}, 400)
+    return data, None
+
+def _ai_cache_key(text, selection, policy):
+    """Clave de caché de la sugerencia, o None si la política exige muestras nuevas."""
+    if not _suggestion_cache.enabled or policy in AI_CACHE_DISABLED_POLICIES:
+        return None
+    mode = "rewrite" if selection else "continue"
+    return suggestion_cache_key(mode, text[:400], selection, policy)
+
+@app.route("/ai-suggest", methods=["POST"])
+def ai_suggest():
+    try:
+        data, error = _parse_ai_request("/ai-suggest")
+        if error is not None:
+            return jsonify(error[0]), error[1]
 
         text = data.get("text", "")
         selection = data.get("selection", "")
         policy = data.get("policy", "")
 
-        # Construir prompt: devuelve fragmentos de texto listo para copiar/pegar,
-        # no ideas ni sugerencias abstractas sobre qué escribir.
-        system_prompt = (
-            "Eres un asistente de redacción académica en español. "
-            "Tu tarea es escribir fragmentos de texto concretos y listos para copiar y pegar, "
-            "acordes con lo que el usuario ya ha escrito. "
-            "NUNCA expliques qué podría escribir el usuario ni des consejos. "
-            "SÓLO escribe el fragmento de texto directamente, como si fuera parte del texto del usuario. "
-            "El fragmento debe ser natural, fluido y coherente con el texto existente."
-        )
-        if selection:
-            # Reescribir la selección manteniendo el sentido pero mejorando la redacción
-            prompt = (
-                f"El usuario escribe sobre cómo sus estudios le ayudarán en el futuro. "
-                f"Texto completo hasta ahora:\n\"{text[:400]}\"\n\n"
-                f"Ha seleccionado esta parte para mejorarla: \"{selection}\"\n\n"
-                f"Reescribe esa parte seleccionada con mejor redacción. "
-                f"Devuelve SÓLO el fragmento reescrito (máximo 40 palabras), sin comillas ni explicaciones."
-            )
-        else:
-            # Continuar el texto con un fragmento concreto
-            prompt = (
-                f"El usuario escribe sobre cómo sus estudios le ayudarán en el futuro. "
-                f"Lo que lleva escrito hasta ahora:\n\"{text[:400]}\"\n\n"
-                f"Escribe una oración o frase corta (máximo 30 palabras) que continúe o complemente "
-                f"de forma natural lo que ya ha escrito. "
-                f"Devuelve SÓLO el fragmento, sin comillas ni explicaciones."
-            )
-
-        # Llamar a OpenAI API con manejo robusto de errores
-        try:
-            openai_response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "max_tokens": 80,
-                    "temperature": 0.7
-                },
-                timeout=10
-            )
-        except requests.exceptions.Timeout:
-            print("⚠️ ERROR en /ai-suggest: Timeout llamando a OpenAI API")
-            return jsonify({"ok": False, "error": "Timeout - la IA tardó demasiado en responder"}), 504
-        except requests.exceptions.ConnectionError as e:
-            print(f"⚠️ ERROR en /ai-suggest: Error de conexión: {e}")
-            return jsonify({"ok": False, "error": "Error de conexión con el servicio de IA"}), 503
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ ERROR en /ai-suggest: Error de red: {type(e).__name__}: {e}")
-            return jsonify({"ok": False, "error": "Error de red"}), 503
-
-        # Validar código de estado HTTP
-        if openai_response.status_code == 401:
-            print("⚠️ ERROR en /ai-suggest: API Key inválido (401)")
-            return jsonify({"ok": False, "error": "Servicio de IA mal configurado"}), 503
-        elif openai_response.status_code == 429:
-            print("⚠️ ERROR en /ai-suggest: Rate limit excedido (429)")
-            return jsonify({"ok": False, "error": "Límite de uso de IA excedido, intenta de nuevo más tarde"}), 429
-        elif openai_response.status_code == 500:
-            print("⚠️ ERROR en /ai-suggest: Error del servidor de OpenAI (500)")
-            return jsonify({"ok": False, "error": "El servicio de IA está teniendo problemas"}), 503
-        elif openai_response.status_code != 200:
-            print(f"⚠️ ERROR en /ai-suggest: Status code {openai_response.status_code}")
-            try:
-                error_detail = openai_response.json()
-                print(f"   Detalle: {error_detail}")
-            except (ValueError, Exception):
-                pass
-            return jsonify({"ok": False, "error": f"Error del servicio de IA (código {openai_response.status_code})"}), 503
+        system_prompt, prompt = _build_ai_prompt(text, selection)
 
-        # Parsear respuesta JSON
-        try:
-            result = openai_response.json()
-        except json.JSONDecodeError as e:
-            print(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI no es JSON válido: {e}")
-            return jsonify({"ok": False, "error": "Respuesta inválida del servicio de IA"}), 500
+        # Caché + single-flight (salvo en las políticas que exigen muestras nuevas)
+        key = _ai_cache_key(text, selection, policy)
+        if key is None:
+            body, status, headers = _request_suggestion(system_prompt, prompt)
+            return jsonify(body), status, headers
+
+        cached = _suggestion_cache.get(key)
+        if cached is not None:
+            return jsonify({"ok": True, "suggestion": cached, "cached": True}), 200
 
-        # Validar estructura de respuesta
-        if not isinstance(result, dict):
-            print(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI no es un diccionario: {type(result)}")
-            return jsonify({"ok": False, "error": "Respuesta inválida del servicio de IA"}), 500
+        # Peticiones idénticas en vuelo comparten una sola llamada al upstream
+        (body, status, headers), shared = _suggestion_flight.do(
+            key, lambda: _request_suggestion(system_prompt, prompt))
+        if status == 200 and body.get("ok"):
+            if not shared:
+                _suggestion_cache.put(key, body["suggestion"])
+            body = dict(body, cached=False, coalesced=shared)
+        return jsonify(body), status, headers
 
-        if "choices" not in result or not isinstance(result["choices"], list) or len(result["choices"]) == 0:
-            print(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI sin 'choices': {result}")
-            return jsonify({"ok": False, "error": "Respuesta incompleta del servicio de IA"}), 500
+    except Exception as e:
+        log.exception(f"⚠️ ERROR inesperado en /ai-suggest: {type(e).__name__}: {e}")
+        return jsonify({"ok": False, "error": "Error del servidor"}), 500
 
-        if "message" not in result["choices"][0] or "content" not in result["choices"][0]["message"]:
-            print(f"⚠️ ERROR en /ai-suggest: Respuesta de OpenAI sin 'content': {result['choices'][0]}")
-            return jsonify({"ok": False, "error": "Respuesta incompleta del servicio de IA"}), 500
+# ENDPOINT 3b: /ai-suggest/stream  → misma sugerencia, enviada token a token por SSE
+# Eventos: data: {"token": "..."} por cada fragmento, data: {"done": true, "suggestion": ...}
+# al final, o data: {"error": "..."} si el upstream falla a mitad. Los errores previos
+# al primer byte (validación, circuito abierto, status HTTP) se devuelven como JSON normal.
+_ai_stream_stats = {"streams": 0, "ttft_ms_total": 0.0, "ttft_ms_max": 0.0, "stream_errors": 0}
+_ai_stream_lock = threading.Lock()
+
+def _sse_event(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _record_ttft(ttft_ms):
+    with _ai_stream_lock:
+        _ai_stream_stats["streams"] += 1
+        _ai_stream_stats["ttft_ms_total"] += ttft_ms
+        _ai_stream_stats["ttft_ms_max"] = max(_ai_stream_stats["ttft_ms_max"], ttft_ms)
+
+def _ai_stream_snapshot():
+    with _ai_stream_lock:
+        stats = dict(_ai_stream_stats)
+    stats["ttft_ms_avg"] = round(stats["ttft_ms_total"] / stats["streams"], 1) if stats["streams"] else None
+    stats["ttft_ms_total"] = round(stats["ttft_ms_total"], 1)
+    stats["ttft_ms_max"] = round(stats["ttft_ms_max"], 1)
+    return stats
+
+def _sse_response(generator):
+    return Response(generator, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/ai-suggest/stream", methods=["POST"])
+def ai_suggest_stream():
+    try:
+        data, error = _parse_ai_request("/ai-suggest/stream")
+        if error is not None:
+            return jsonify(error[0]), error[1]
 
-        suggestion = result["choices"][0]["message"]["content"].strip()
+        text = data.get("text", "")
+        selection = data.get("selection", "")
+        policy = data.get("policy", "")
+        system_prompt, prompt = _build_ai_prompt(text, selection)
 
-        if not suggestion:
-            print("⚠️ WARNING en /ai-suggest: OpenAI devolvió sugerencia vacía")
-            return jsonify({"ok": False, "error": "El servicio de IA no pudo generar una sugerencia"}), 500
+        key = _ai_cache_key(text, selection, policy)
+        cached = _suggestion_cache.get(key) if key is not None else None
+        if cached is not None:
+            return _sse_response(iter([_sse_event({"token": cached}),
+                                       _sse_event({"done": True, "suggestion": cached, "cached": True})]))
 
-        return jsonify({"ok": True, "suggestion": suggestion}), 200
+        # El hueco del bulkhead dura toda la respuesta en streaming: se libera al cerrarla
+        try:
+            permit = _openai_bulkhead.acquire()
+        except BulkheadFull as e:
+            body, status, headers = _bulkhead_busy_body(e)
+            return jsonify(body), status, headers
+        try:
+            response = _stream_suggestion(system_prompt, prompt, key)
+        except BaseException:
+            permit.release()
+            raise
+        if isinstance(response, Response):
+            response.call_on_close(permit.release)
+        else:
+            permit.release()
+        return response
 
     except Exception as e:
-        print(f"⚠️ ERROR inesperado en /ai-suggest: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        log.exception(f"⚠️ ERROR inesperado en /ai-suggest/stream: {type(e).__name__}: {e}")
         return jsonify({"ok": False, "error": "Error del servidor"}), 500
 
+def _stream_suggestion(system_prompt, prompt, key):
+    """Abre el stream del upstream de IA. Devuelve la respuesta SSE o (body, status[, headers]) de error."""
+    if not _openai_breaker.allow():
+        _observe_openai("stream", "circuit_open")
+        response = jsonify({"ok": False, "error": "El servicio de IA no está disponible temporalmente"})
+        response.headers["Retry-After"] = str(_openai_breaker.retry_after())
+        return response, 503
+
+    started = _time.monotonic()
+    sent = _time.perf_counter()
+    try:
+        upstream = _openai_session.post(
+            f"{OPENAI_BASE_URL}/chat/completions",
+            headers=_openai_headers(),
+            json=_openai_payload(system_prompt, prompt, stream=True),
+            timeout=OPENAI_TIMEOUT,
+            stream=True
+        )
+    except requests.exceptions.Timeout:
+        _openai_breaker.record_failure()
+        _observe_openai("stream", "timeout", sent)
+        log.error("⚠️ ERROR en /ai-suggest/stream: Timeout llamando a OpenAI API")
+        return jsonify({"ok": False, "error": "Timeout - la IA tardó demasiado en responder"}), 504
+    except requests.exceptions.RequestException as e:
+        _openai_breaker.record_failure()
+        _observe_openai("stream", "network_error", sent)
+        log.error(f"⚠️ ERROR en /ai-suggest/stream: Error de red: {type(e).__name__}: {e}")
+        return jsonify({"ok": False, "error": "Error de conexión con el servicio de IA"}), 503
+
+    _observe_openai("stream", upstream.status_code, sent)
+    _record_ai_status(upstream.status_code)
+    error = _ai_status_error(upstream)
+    if error is not None:
+        upstream.close()
+        return jsonify(error[0]), error[1]
+
+    def generate():
+        parts = []
+        ttft_ms = None
+        try:
+            upstream.encoding = "utf-8"
+            for line in upstream.iter_lines(decode_unicode=True):
+                done, token = _stream_token(line)
+                if done:
+                    break
+                if not token:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = _stream_first_token(started)
+                parts.append(token)
+                yield _sse_event({"token": token})
+            yield _stream_finished(parts, key, started, ttft_ms)
+        except requests.exceptions.RequestException as e:
+            yield _stream_broken(e)
+        finally:
+            upstream.close()
+
+    return _sse_response(generate())
+
+# Piezas del stream que comparten la ruta WSGI y la ASGI (asgi.py)
+def _stream_token(line):
+    """(terminado, token) de una línea SSE del upstream; token None si la línea no trae texto."""
+    if not line or not line.startswith("data:"):
+        return False, None
+    chunk = line[5:].strip()
+    if chunk == "[DONE]":
+        return True, None
+    try:
+        return False, json.loads(chunk)["choices"][0].get("delta", {}).get("content")
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return False, None
+
+def _stream_first_token(started):
+    ttft_ms = (_time.monotonic() - started) * 1000
+    _record_ttft(ttft_ms)
+    _m_openai_ttft.observe(ttft_ms / 1000)
+    log.debug("⏱️ /ai-suggest/stream: primer token en %.0f ms", ttft_ms)
+    return ttft_ms
+
+def _stream_finished(parts, key, started, ttft_ms):
+    """Último evento SSE: la sugerencia completa (y se cachea) o un error si llegó vacía."""
+    suggestion = "".join(parts).strip()
+    if not suggestion:
+        log.warning("⚠️ WARNING en /ai-suggest/stream: OpenAI devolvió sugerencia vacía")
+        return _sse_event({"error": "El servicio de IA no pudo generar una sugerencia"})
+    if key is not None:
+        _suggestion_cache.put(key, suggestion)
+    total_ms = (_time.monotonic() - started) * 1000
+    log.info("✅ /ai-suggest/stream: %d fragmentos en %.0f ms (TTFT %.0f ms)", len(parts), total_ms, ttft_ms)
+    return _sse_event({"done": True, "suggestion": suggestion,
+                       "ttft_ms": round(ttft_ms), "total_ms": round(total_ms)})
+
+def _stream_broken(e):
+    _openai_breaker.record_failure()
+    _observe_openai("stream", "stream_broken")
+    with _ai_stream_lock:
+        _ai_stream_stats["stream_errors"] += 1
+    log.error(f"⚠️ ERROR en /ai-suggest/stream: stream cortado: {type(e).__name__}: {e}")
+    return _sse_event({"error": "Se interrumpió la respuesta del servicio de IA"})
+
 # =============================================================
 # SERVIR ARCHIVOS ESTÁTICOS
 # =============================================================
+# index.html se reescribe al arrancar con los bundles con huella; los ficheros se
+# guardan en memoria ya comprimidos tras la primera petición (ver static_assets.py)
+_static_assets = None
+if STATIC_CACHE_MAX_MB > 0:
+    try:
+        _static_assets = StaticAssets(os.path.join(app.root_path, "public"),
+                                      max_bytes=int(STATIC_CACHE_MAX_MB * 1024 * 1024))
+        _manifest = _static_assets.build(bundles=STATIC_BUNDLES)
+        log.info(f"✅ Estáticos en memoria: bundles {_manifest or '(desactivados)'}, "
+                 f"brotli={'sí' if _static_assets.describe()['brotli'] else 'no'}")
+    except Exception as e:
+        log.error(f"⚠️ ERROR preparando estáticos: {type(e).__name__}: {e} — se sirven desde disco")
+        _static_assets = None
+
+def _asset_response(asset):
+    """Respuesta desde memoria: 304 si el ETag coincide, si no la variante que acepte el cliente."""
+    encoding, body, etag = asset.variant(lambda enc: request.accept_encodings[enc] > 0)
+    headers = {"Cache-Control": asset.cache_control, "Vary": "Accept-Encoding", "ETag": f'"{etag}"'}
+    if any(request.if_none_match.contains(tag) for tag in asset.etags()):
+        _static_assets.stats["not_modified"] += 1
+        return Response(status=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
 @app.route("/", defaults={"path": "index.html"})
 @app.route("/<path:path>")
 def serve_static(path):
@@ -874,19 +2561,23 @@ def serve_static(path):
 
         # Verificar que el path no intenta escapar del directorio público
         if normalized_path.startswith('..') or normalized_path.startswith('/'):
-            print(f"⚠️ SEGURIDAD: Intento de acceso fuera de public/: {path}")
+            log.error(f"⚠️ SEGURIDAD: Intento de acceso fuera de public/: {path}")
             return "Acceso denegado", 403
 
+        asset = _static_assets.get(normalized_path) if _static_assets is not None else None
+        if asset is not None:
+            return _asset_response(asset)
+
         # Usar send_from_directory que ya tiene protecciones contra path traversal
         return send_from_directory('public', normalized_path)
-    except FileNotFoundError:
-        print(f"⚠️ Archivo no encontrado: {path}")
+    except (FileNotFoundError, NotFound):
+        log.warning(f"⚠️ Archivo no encontrado: {path}")
         return f"Archivo no encontrado: {path}", 404
     except PermissionError:
-        print(f"⚠️ Permiso denegado al acceder a: {path}")
+        log.warning(f"⚠️ Permiso denegado al acceder a: {path}")
         return "Acceso denegado", 403
     except Exception as e:
-        print(f"⚠️ Error inesperado sirviendo {path}: {type(e).__name__}: {e}")
+        log.warning(f"⚠️ Error inesperado sirviendo {path}: {type(e).__name__}: {e}")
         return "Error del servidor", 500
 
 # =============================================================
@@ -0,0 +1,562 @@
+# =============================================================
+# Shadow AI — Modo de servicio ASGI (asyncio)
+# =============================================================
+# Alternativa al servidor WSGI para sostener miles de conexiones abiertas en
+# un solo proceso:
+#
+#     uvicorn asgi:create_app --factory --host 0.0.0.0 --port 5000
+#     python asgi.py
+#
+# La app Flask de app.py sigue siendo el punto de entrada WSGI
+# (gunicorn app:app) y el estado es el mismo en ambos modos: colas, WAL,
+# outbox, flusher, caché de sugerencias, circuit breaker y bulkheads.
+#
+# Mismas rutas; cómo se atiende cada una:
+#   - /ai-suggest y /ai-suggest/stream: nativas async con httpx. La espera a
+#     OpenAI no ocupa ningún hilo (el bulkhead de OpenAI sigue limitando cuántas
+#     llamadas hay en vuelo).
+#   - Rutas que esperan a Sheets (/log-batch, /finalize, /flush-events,
+#     /health, /health/deep): la vista Flask corre en el executor "sheets".
+#   - El resto (/log, /health/live, estáticos, preflight CORS): la vista Flask
+#     en el executor "local", separado para que un Sheets lento no frene /log.
+#
+# El cuerpo se lee en el event loop antes de pasar al executor, así que un
+# cliente lento no retiene ningún hilo. Si un executor ya tiene
+# ASGI_MAX_PENDING peticiones esperando, se responde 503 al instante.
+#
+# Dependencias opcionales: uvicorn (u otro servidor ASGI) y httpx. Sin httpx,
+# /ai-suggest pasa por la vista Flask en su propio executor "openai".
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import time as _time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import httpx
+except ImportError:     # httpx opcional: sin él /ai-suggest usa la vista Flask en un executor
+    httpx = None
+
+import app as core
+from bulkhead import BulkheadFull
+from logs import new_request_id, request_id
+from traffic import RECORDED
+
+log = logging.getLogger("shadowai.asgi")
+
+# =============================================================
+# CONFIGURACIÓN — VARIABLES DE ENTORNO
+# =============================================================
+# Hilos por executor: por defecto, los huecos + la cola del bulkhead de cada dependencia
+ASGI_SHEETS_WORKERS = int(os.getenv("ASGI_SHEETS_WORKERS", str(core.BULKHEAD_SHEETS_MAX + core.BULKHEAD_SHEETS_QUEUE)))
+ASGI_OPENAI_WORKERS = int(os.getenv("ASGI_OPENAI_WORKERS", str(core.BULKHEAD_OPENAI_MAX + core.BULKHEAD_OPENAI_QUEUE)))
+ASGI_LOCAL_WORKERS = int(os.getenv("ASGI_LOCAL_WORKERS", "8"))
+ASGI_MAX_PENDING = int(os.getenv("ASGI_MAX_PENDING", "2000"))   # Peticiones esperando por executor antes del 503
+ASGI_MAX_BODY = int(float(os.getenv("ASGI_MAX_BODY_MB", str(core.LOG_BATCH_MAX_BYTES / 1024 / 1024))) * 1024 * 1024)
+
+# Espera en la cola de cada executor antes de empezar (el tiempo de la vista lo mide app.py)
+_m_lane_wait = core._metrics.histogram("asgi_lane_wait_seconds", "Espera en la cola del executor ASGI", ("lane",))
+
+_SHEETS_ROUTES = {"/log-batch", "/finalize", "/flush-events", "/health", "/health/deep"}
+_AI_ROUTES     = {"/ai-suggest", "/ai-suggest/stream"}
+
+
+class _Lane:
+    """Executor acotado de un tipo de trabajo y contador de peticiones esperando por él."""
+
+    def __init__(self, name, workers, max_pending):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"asgi-{name}")
+        self.pending = 0        # Sólo se toca desde el event loop
+        self.stats = {"calls": 0, "rejected": 0, "peak_pending": 0}
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise BulkheadFull(f"asgi-{self.name}", "queue_full", 1)
+        self.pending += 1
+        self.stats["calls"] += 1
+        self.stats["peak_pending"] = max(self.stats["peak_pending"], self.pending)
+        submitted = _time.perf_counter()
+
+        def timed():
+            _m_lane_wait.observe(_time.perf_counter() - submitted, self.name)
+            return fn(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+
+    def describe(self):
+        return dict(self.stats, workers=self.workers, pending=self.pending, max_pending=self.max_pending)
+
+
+# =============================================================
+# PUENTE WSGI (vistas Flask en un executor)
+# =============================================================
+def _wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-length":
+            continue        # El cuerpo ya está leído entero
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+            continue
+        key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ):
+    """Ejecuta la vista Flask. Devuelve (status, headers, cuerpo entero o iterador si es un stream SSE)."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+        return lambda data: None
+
+    result = core.app(environ, start_response)
+    status, headers = started
+    if any(k.lower() == "content-type" and v.startswith("text/event-stream") for k, v in headers):
+        return status, headers, result
+    try:
+        return status, headers, b"".join(result)
+    finally:
+        close = getattr(result, "close", None)
+        if close is not None:
+            close()
+
+
+def _recording(send, recorder, record, body):
+    """send que completa el registro de traffic.py al enviar las cabeceras."""
+    async def recording_send(message):
+        if message["type"] == "http.response.start" and "_started" in record:
+            rid = next((v for k, v in message.get("headers", []) if k == b"x-request-id"), b"").decode("latin-1")
+            recorder.finish(record, body, message["status"], rid or request_id.get())
+        await send(message)
+    return recording_send
+
+
+def _encode_headers(headers):
+    return [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers]
+
+
+async def _send_json(send, body, status, headers=None, origin=None):
+    """Respuesta JSON nativa, con las mismas cabeceras CORS que añade flask-cors."""
+    data = json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8") + b"\n"
+    extra = dict(headers or {})
+    extra.update({"Content-Type": "application/json", "Content-Length": str(len(data))})
+    await send({"type": "http.response.start", "status": status,
+                "headers": _encode_headers(list(extra.items()) + _cors_headers(origin))})
+    await send({"type": "http.response.body", "body": data})
+
+
+def _cors_headers(origin):
+    return [("Access-Control-Allow-Origin", origin), ("Vary", "Origin")] if origin else []
+
+
+async def _read_body(receive, limit):
+    """Cuerpo completo, o None si el cliente se desconecta / False si supera `limit`."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return False
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def _parse_ai_body(body, endpoint):
+    """Igual que app._parse_ai_request pero sobre el cuerpo ya leído. Devuelve (data, None) o (None, (body, status))."""
+    if not core.OPENAI_API_KEY:
+        log.error(f"⚠️ ERROR en {endpoint}: OPENAI_API_KEY no configurado")
+        return None, ({"ok": False, "error": "Servicio de IA no disponible"}, 503)
+    if not body:
+        log.error(f"⚠️ ERROR en {endpoint}: Request no contiene JSON")
+        return None, ({"ok": False, "error": "Request debe contener JSON"}, 400)
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        log.error(f"⚠️ ERROR en {endpoint}: JSON inválido: {type(e).__name__}: {e}")
+        return None, ({"ok": False, "error": "JSON inválido"}, 400)
+    if data is None:
+        log.error(f"⚠️ ERROR en {endpoint}: JSON parseado es None")
+        return None, ({"ok": False, "error": "JSON vacío"}, 400)
+    if not isinstance(data, dict):
+        return None, ({"ok": False, "error": "JSON inválido"}, 400)
+    return data, None
+
+
+# =============================================================
+# APLICACIÓN ASGI
+# =============================================================
+class ShadowASGI:
+    """Aplicación ASGI con las mismas rutas que app.app."""
+
+    def __init__(self):
+        self.lanes = {
+            "sheets": _Lane("sheets", ASGI_SHEETS_WORKERS, ASGI_MAX_PENDING),
+            "openai": _Lane("openai", ASGI_OPENAI_WORKERS, ASGI_MAX_PENDING),
+            "local":  _Lane("local", ASGI_LOCAL_WORKERS, ASGI_MAX_PENDING),
+        }
+        self._http = None
+        self._inflight = {}         # Clave de caché → Future de la sugerencia en vuelo
+        self.stats = {"requests": 0, "open_requests": 0, "max_open_requests": 0, "too_large": 0,
+                      "disconnected": 0, "ai_leaders": 0, "ai_coalesced": 0}
+        core._serving_info.update(mode="asgi", describe=self.describe)
+
+    def _client(self):
+        if self._http is None and httpx is not None:
+            self._http = httpx.AsyncClient(
+                timeout=core.OPENAI_TIMEOUT,
+                limits=httpx.Limits(max_connections=core.BULKHEAD_OPENAI_MAX,
+                                    max_keepalive_connections=core.OPENAI_POOL_SIZE))
+        return self._http
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            self.stats["requests"] += 1
+            self.stats["open_requests"] += 1
+            self.stats["max_open_requests"] = max(self.stats["max_open_requests"], self.stats["open_requests"])
+            try:
+                await self._http_request(scope, receive, send)
+            finally:
+                self.stats["open_requests"] -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                mode = "httpx" if httpx is not None else "executor (sin httpx)"
+                log.info(f"✅ Modo ASGI: executors sheets={ASGI_SHEETS_WORKERS} openai={ASGI_OPENAI_WORKERS} "
+                      f"local={ASGI_LOCAL_WORKERS}, /ai-suggest vía {mode}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._http is not None:
+                    await self._http.aclose()
+                for lane in self.lanes.values():
+                    lane.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http_request(self, scope, receive, send):
+        # Las respuestas que no pasan por Flask (rutas nativas, 413, 503 de los executors)
+        # se miden aquí; las de las vistas Flask las mide su after_request
+        started = _time.perf_counter()
+        path, method = scope["path"], scope["method"]
+
+        # Mismo X-Request-ID en los logs nativos y en los de la vista Flask (cada
+        # request corre en su propia tarea, así que el ContextVar no se hereda)
+        incoming = next((v for k, v in scope.get("headers", []) if k == b"x-request-id"), b"").decode("latin-1")
+        rid = new_request_id(incoming)
+        request_id.set(rid)
+        if rid != incoming:
+            scope = dict(scope, headers=[(k, v) for k, v in scope.get("headers", []) if k != b"x-request-id"]
+                         + [(b"x-request-id", rid.encode("latin-1"))])
+
+        async def measured(message):
+            if message["type"] == "http.response.start":
+                route = path if path in _SHEETS_ROUTES or path in _AI_ROUTES else "asgi"
+                core._m_http_latency.observe(_time.perf_counter() - started, route, method, str(message["status"]))
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-request-id", rid.encode("latin-1"))])
+            await send(message)
+
+        await self._dispatch(scope, receive, send, measured)
+
+    async def _dispatch(self, scope, receive, raw_send, send):
+        """Lee el cuerpo y reparte: rutas nativas responden por `send` (medido), las vistas Flask por `raw_send`."""
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        origin = headers.get("origin")
+        declared = headers.get("content-length", "")
+        if declared.isdigit() and int(declared) > ASGI_MAX_BODY:
+            self.stats["too_large"] += 1
+            return await _send_json(send, {"ok": False, "error": "Cuerpo demasiado grande"}, 413, origin=origin)
+        body = await _read_body(receive, ASGI_MAX_BODY)
+        if body is None:
+            self.stats["disconnected"] += 1
+            return
+        if body is False:
+            self.stats["too_large"] += 1
+            return await _send_json(send, {"ok": False, "error": "Cuerpo demasiado grande"}, 413, origin=origin)
+
+        path, method = scope["path"], scope["method"]
+        recorder = core._traffic_recorder
+        if recorder is not None and path in recorder.paths:
+            # Se graba aquí (rutas nativas y 503 de los bulkheads incluidos), no en el middleware
+            record = recorder.begin(_wsgi_environ(scope, body), body)
+            if record is not None:
+                send, raw_send = _recording(send, recorder, record, body), _recording(raw_send, recorder, record, body)
+        try:
+            if method == "POST" and path in _AI_ROUTES and httpx is not None:
+                if path == "/ai-suggest":
+                    try:
+                        result = await self._ai_suggest(body)
+                    except Exception as e:
+                        log.exception(f"⚠️ ERROR inesperado en /ai-suggest: {type(e).__name__}: {e}")
+                        result = {"ok": False, "error": "Error del servidor"}, 500, {}
+                    return await _send_json(send, *result, origin=origin)
+                return await self._ai_suggest_stream(body, send, origin)
+            if path in _SHEETS_ROUTES and method != "OPTIONS":
+                lane = self.lanes["sheets"]
+            elif path in _AI_ROUTES and method != "OPTIONS":
+                lane = self.lanes["openai"]
+            else:
+                lane = self.lanes["local"]
+            await self._run_wsgi(lane, scope, body, raw_send)
+        except BulkheadFull as e:
+            log.warning(f"⚠️ {path} rechazado: {e}")
+            await _send_json(send, {"ok": False, "error": "Servicio saturado, intenta de nuevo en unos segundos",
+                                    "bulkhead": e.name}, 503, {"Retry-After": str(e.retry_after)}, origin)
+
+    async def _run_wsgi(self, lane, scope, body, send):
+        environ = _wsgi_environ(scope, body)
+        environ[RECORDED] = True    # La grabación de tráfico, si la hay, ya la hizo _dispatch
+        status, headers, result = await lane.run(_call_wsgi, environ)
+        await send({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                    "headers": _encode_headers(headers)})
+        if isinstance(result, bytes):
+            await send({"type": "http.response.body", "body": result})
+            return
+        # Stream SSE de la vista Flask (sin httpx): cada fragmento se pide en el executor
+        iterator = iter(result)
+        try:
+            while True:
+                chunk = await lane.run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                await asyncio.get_running_loop().run_in_executor(lane.executor, close)
+
+    # ── /ai-suggest nativo ──
+    async def _single_flight(self, key, factory):
+        """Versión asyncio de SingleFlight: las peticiones idénticas esperan la misma llamada."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["ai_coalesced"] += 1
+            return await asyncio.shield(future), True
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.stats["ai_leaders"] += 1
+        try:
+            result = await factory()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()      # Marcarla como leída aunque nadie más espere
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._inflight.pop(key, None)
+        return result, False
+
+    async def _ai_suggest(self, body):
+        data, error = _parse_ai_body(body, "/ai-suggest")
+        if error is not None:
+            return error[0], error[1], {}
+
+        text = data.get("text", "")
+        selection = data.get("selection", "")
+        policy = data.get("policy", "")
+        system_prompt, prompt = core._build_ai_prompt(text, selection)
+
+        key = core._ai_cache_key(text, selection, policy)
+        if key is None:
+            return await self._request_suggestion(system_prompt, prompt)
+        cached = core._suggestion_cache.get(key)
+        if cached is not None:
+            return {"ok": True, "suggestion": cached, "cached": True}, 200, {}
+
+        (body, status, headers), shared = await self._single_flight(
+            key, lambda: self._request_suggestion(system_prompt, prompt))
+        if status == 200 and body.get("ok"):
+            if not shared:
+                core._suggestion_cache.put(key, body["suggestion"])
+            body = dict(body, cached=False, coalesced=shared)
+        return body, status, headers
+
+    async def _request_suggestion(self, system_prompt, prompt):
+        """Como app._request_suggestion: bulkhead de OpenAI (esperando en el loop) + circuit breaker."""
+        try:
+            permit = await core._openai_bulkhead.acquire_async()
+        except BulkheadFull as e:
+            return core._bulkhead_busy_body(e)
+        try:
+            if not core._openai_breaker.allow():
+                core._observe_openai("suggest", "circuit_open")
+                return ({"ok": False, "error": "El servicio de IA no está disponible temporalmente"}, 503,
+                        {"Retry-After": str(core._openai_breaker.retry_after())})
+            sent = _time.perf_counter()
+            try:
+                response = await self._client().post(
+                    f"{core.OPENAI_BASE_URL}/chat/completions",
+                    headers=core._openai_headers(),
+                    json=core._openai_payload(system_prompt, prompt))
+            except httpx.TimeoutException:
+                core._openai_breaker.record_failure()
+                core._observe_openai("suggest", "timeout", sent)
+                log.error("⚠️ ERROR en /ai-suggest: Timeout llamando a OpenAI API")
+                return {"ok": False, "error": "Timeout - la IA tardó demasiado en responder"}, 504, {}
+            except httpx.ConnectError as e:
+                core._openai_breaker.record_failure()
+                core._observe_openai("suggest", "connection_error", sent)
+                log.error(f"⚠️ ERROR en /ai-suggest: Error de conexión: {e}")
+                return {"ok": False, "error": "Error de conexión con el servicio de IA"}, 503, {}
+            except httpx.HTTPError as e:
+                core._openai_breaker.record_failure()
+                core._observe_openai("suggest", "network_error", sent)
+                log.error(f"⚠️ ERROR en /ai-suggest: Error de red: {type(e).__name__}: {e}")
+                return {"ok": False, "error": "Error de red"}, 503, {}
+
+            core._observe_openai("suggest", response.status_code, sent)
+            core._record_ai_status(response.status_code)
+            error = core._ai_status_error(response)
+            if error is not None:
+                return error
+            return core._parse_suggestion_response(response)
+        finally:
+            permit.release()
+
+    async def _ai_suggest_stream(self, body, send, origin):
+        data, error = _parse_ai_body(body, "/ai-suggest/stream")
+        if error is not None:
+            return await _send_json(send, error[0], error[1], origin=origin)
+
+        text = data.get("text", "")
+        selection = data.get("selection", "")
+        policy = data.get("policy", "")
+        system_prompt, prompt = core._build_ai_prompt(text, selection)
+
+        key = core._ai_cache_key(text, selection, policy)
+        cached = core._suggestion_cache.get(key) if key is not None else None
+        if cached is not None:
+            await self._start_sse(send, origin)
+            await send({"type": "http.response.body", "more_body": True,
+                        "body": core._sse_event({"token": cached}).encode("utf-8")})
+            await send({"type": "http.response.body",
+                        "body": core._sse_event({"done": True, "suggestion": cached, "cached": True}).encode("utf-8")})
+            return
+
+        try:
+            permit = await core._openai_bulkhead.acquire_async()
+        except BulkheadFull as e:
+            return await _send_json(send, *core._bulkhead_busy_body(e), origin=origin)
+        try:
+            if not core._openai_breaker.allow():
+                core._observe_openai("stream", "circuit_open")
+                return await _send_json(send, {"ok": False, "error": "El servicio de IA no está disponible temporalmente"},
+                                        503, {"Retry-After": str(core._openai_breaker.retry_after())}, origin)
+
+            started = _time.monotonic()
+            sent = _time.perf_counter()
+            client = self._client()
+            request = client.build_request("POST", f"{core.OPENAI_BASE_URL}/chat/completions",
+                                           headers=core._openai_headers(),
+                                           json=core._openai_payload(system_prompt, prompt, stream=True))
+            try:
+                upstream = await client.send(request, stream=True)
+            except httpx.TimeoutException:
+                core._openai_breaker.record_failure()
+                core._observe_openai("stream", "timeout", sent)
+                log.error("⚠️ ERROR en /ai-suggest/stream: Timeout llamando a OpenAI API")
+                return await _send_json(send, {"ok": False, "error": "Timeout - la IA tardó demasiado en responder"},
+                                        504, origin=origin)
+            except httpx.HTTPError as e:
+                core._openai_breaker.record_failure()
+                core._observe_openai("stream", "network_error", sent)
+                log.error(f"⚠️ ERROR en /ai-suggest/stream: Error de red: {type(e).__name__}: {e}")
+                return await _send_json(send, {"ok": False, "error": "Error de conexión con el servicio de IA"},
+                                        503, origin=origin)
+
+            try:
+                core._observe_openai("stream", upstream.status_code, sent)
+                core._record_ai_status(upstream.status_code)
+                if upstream.status_code != 200:
+                    await upstream.aread()      # _ai_status_error lee el detalle con .json()
+                error = core._ai_status_error(upstream)
+                if error is not None:
+                    return await _send_json(send, error[0], error[1], origin=origin)
+
+                await self._start_sse(send, origin)
+                parts, ttft_ms = [], None
+                try:
+                    async for line in upstream.aiter_lines():
+                        done, token = core._stream_token(line)
+                        if done:
+                            break
+                        if not token:
+                            continue
+                        if ttft_ms is None:
+                            ttft_ms = core._stream_first_token(started)
+                        parts.append(token)
+                        await send({"type": "http.response.body", "more_body": True,
+                                    "body": core._sse_event({"token": token}).encode("utf-8")})
+                    last = core._stream_finished(parts, key, started, ttft_ms)
+                except httpx.HTTPError as e:
+                    last = core._stream_broken(e)
+                await send({"type": "http.response.body", "body": last.encode("utf-8")})
+            finally:
+                await upstream.aclose()
+        finally:
+            permit.release()
+
+    @staticmethod
+    async def _start_sse(send, origin):
+        headers = [("Content-Type", "text/event-stream; charset=utf-8"), ("Cache-Control", "no-cache"),
+                   ("X-Accel-Buffering", "no")] + _cors_headers(origin)
+        await send({"type": "http.response.start", "status": 200, "headers": _encode_headers(headers)})
+
+    def describe(self):
+        return dict(self.stats, mode="asgi", async_http="httpx" if httpx is not None else None,
+                    lanes={name: lane.describe() for name, lane in self.lanes.items()})
+
+
+def create_app():
+    """Factory ASGI (uvicorn asgi:create_app --factory)."""
+    return ShadowASGI()
+
+
+# =============================================================
+# EJECUCIÓN LOCAL (solo si corres manualmente)
+# =============================================================
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:create_app", factory=True, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,132 @@
+# =============================================================
+# Shadow AI — Decodificación de lotes de /log-batch
+# =============================================================
+# El frontend puede enviar el cuerpo comprimido (Content-Encoding: gzip, o
+# zstd si el paquete `zstandard` está instalado) y en formato compacto:
+#
+#     {"v": 2, "subject_id": "S-…", "policy": "…", "t0": <epoch ms>,
+#      "events": [[seq, dt_ms, "evento", {payload}], …]}
+#
+# Los campos comunes van una sola vez por lote y cada evento lleva sólo su
+# desfase en ms respecto a t0; el payload se omite si está vacío. Los items
+# no se convierten a dicts: _build_event_row los expande directamente con la
+# cabecera del lote. El formato antiguo ({"events": [...]} o una lista de
+# eventos) se sigue aceptando.
+
+import time as _time
+import zlib
+
+try:
+    import zstandard
+except ImportError:     # zstd opcional: sin el paquete sólo se acepta gzip/deflate
+    zstandard = None
+
+
+_MILLIS_SUFFIX = [f"{ms:03d}Z" for ms in range(1000)]
+
+
+class BodyTooLarge(Exception):
+    """El cuerpo descomprimido supera el límite configurado."""
+
+
+def supported_encodings():
+    return ["identity", "gzip", "deflate"] + (["zstd"] if zstandard is not None else [])
+
+
+def decode_body(raw, content_encoding, max_bytes):
+    """Descomprime el cuerpo según Content-Encoding sin pasar de max_bytes.
+    Lanza BodyTooLarge si se supera el límite y ValueError si la codificación no es válida."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        data = raw
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+        # wbits: 16+ → cabecera gzip, +32 → autodetecta zlib/gzip (deflate con cabecera zlib)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding != "deflate" else 32 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(raw, max_bytes + 1)
+        except zlib.error as e:
+            raise ValueError(f"cuerpo {encoding} inválido: {e}")
+        if decompressor.unconsumed_tail:
+            raise BodyTooLarge(f"el lote descomprimido supera {max_bytes} bytes")
+    elif encoding == "zstd" and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                data = reader.read(max_bytes + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"cuerpo zstd inválido: {e}")
+    else:
+        raise ValueError(f"Content-Encoding no soportado: {encoding}")
+    if len(data) > max_bytes:
+        raise BodyTooLarge(f"el lote descomprimido supera {max_bytes} bytes")
+    return data
+
+
+def iso_from_ms(epoch_ms):
+    """Epoch en ms → ISO 8601 UTC con milisegundos y 'Z' (igual que Date.toISOString())."""
+    seconds, millis = divmod(int(epoch_ms), 1000)
+    return _time.strftime("%Y-%m-%dT%H:%M:%S.", _time.gmtime(seconds)) + f"{millis:03d}Z"
+
+
+class CompactBatch:
+    """Lote v2 sin expandir: cabecera común + items [seq, dt_ms, evento, payload?].
+    _build_event_row expande cada item directamente, sin crear un dict por evento."""
+
+    __slots__ = ("subject_id", "policy", "t0", "items", "_id_prefix", "_prefixes")
+
+    def __init__(self, subject_id, policy, t0, items):
+        self.subject_id = subject_id
+        self.policy = policy
+        self.t0 = t0
+        self.items = items
+        self._id_prefix = f"{subject_id}-"
+        self._prefixes = {}     # segundo → "YYYY-MM-DDTHH:MM:SS." (pocos por lote)
+
+    def event_id(self, item):
+        seq = item[0]
+        return self._id_prefix + str(seq) if seq is not None and seq != "" else None
+
+    def timestamp(self, item):
+        """ISO del item (t0 + dt_ms), o None si el desfase no es válido."""
+        dt_ms = item[1]
+        if type(dt_ms) is not int:
+            try:
+                return iso_from_ms(self.t0 + float(dt_ms))
+            except (TypeError, ValueError, OverflowError, OSError):
+                return None
+        seconds, millis = divmod(self.t0 + dt_ms, 1000)
+        prefix = self._prefixes.get(seconds)
+        if prefix is None:
+            try:
+                prefix = self._prefixes[seconds] = _time.strftime("%Y-%m-%dT%H:%M:%S.", _time.gmtime(seconds))
+            except (OverflowError, OSError, ValueError):
+                return None
+        return prefix + _MILLIS_SUFFIX[millis]
+
+    @staticmethod
+    def event(item):
+        return item[2]
+
+    @staticmethod
+    def payload(item):
+        return item[3] if len(item) > 3 and type(item[3]) is dict else {}
+
+
+def parse_batch(data):
+    """JSON recibido → (lista de items, CompactBatch o None).
+    Formato v2: items compactos + su cabecera; formato clásico: dicts y None."""
+    if isinstance(data, list):
+        return [evt for evt in data if isinstance(evt, dict)], None
+    if not isinstance(data, dict):
+        return [], None
+    events = data.get("events")
+    if not isinstance(events, list):
+        return [], None
+    if data.get("v") != 2:
+        return [evt for evt in events if isinstance(evt, dict)], None
+    try:
+        t0 = int(data.get("t0") or 0)
+    except (TypeError, ValueError):
+        t0 = 0
+    batch = CompactBatch(str(data.get("subject_id", "")), data.get("policy", ""), t0,
+                         [item for item in events if type(item) is list and len(item) >= 3])
+    return batch.items, batch
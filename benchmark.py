@@ -0,0 +1,488 @@
+# =============================================================
+# Shadow AI — Benchmark offline (sin Sheets ni OpenAI reales)
+# =============================================================
+# Arranca app.py en este proceso contra el emulador de Sheets y el stub de
+# OpenAI (sheets_emulator.py), lanza sesiones de participantes que siguen la
+# secuencia de eventos de public/js/experiment.js y mide cada petición HTTP.
+#
+#   python benchmark.py                                   # 40 participantes, 20 a la vez
+#   python benchmark.py --participants 200 --concurrency 50 --error-429 0.02
+#   python benchmark.py --save-baseline                   # guarda bench_baseline.json (si no hay errores)
+#   python benchmark.py --baseline bench_baseline.json    # compara; sale con 1 si hay regresión
+#
+# La configuración de app.py se toma del entorno como siempre (INGEST_MODE,
+# EVENTS_WAL_DIR, STORAGE_SINKS, …); las rutas de datos van a un directorio
+# temporal salvo que se indiquen. Cada ejecución necesita un proceso nuevo
+# (app.py se configura al importarse).
+#
+# Los tiempos reales de una sesión (≈2 s entre acciones, flush del cliente cada
+# 5 s) se escalan con --time-scale para que un benchmark dure segundos.
+
+import os
+import sys
+import json
+import gzip
+import math
+import time as _time
+import random
+import string
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from sheets_emulator import SheetsEmulator, OpenAIStub
+
+POLICIES = ("permisiva", "difusa", "restrictiva")
+
+# Pantallas de experiment.js: (trial_type, clics medios, eventos propios de la pantalla)
+SCREENS = (
+    ("survey-html-form", 3, ("demographics_basic",)),
+    ("survey-html-form", 2, ("policy_assigned",)),
+    ("html-button-response", 1, ()),
+    ("html-button-response", 6, ("task",)),             # Tarea: paste/copy, IA, task_snapshot
+    ("survey-html-form", 3, ("ai_usage_declaration",)),
+    ("survey-html-form", 3, ("control_answers",)),
+    ("survey-html-form", 5, ("demographics_extended",)),
+    ("survey-html-form", 4, ("personality_answers",)),
+    ("survey-html-form", 2, ("ai_motivation_answers",)),
+    ("call-function", 0, ("finalize",)),
+    ("survey-html-form", 1, ("email_provided",)),
+)
+
+FLUSH_SIZE = 10             # Como experiment.js: lote al llegar a 10 eventos…
+FLUSH_INTERVAL_SEC = 5.0    # …o 5 s después del primer evento pendiente
+GZIP_MIN_BYTES = 1024
+THINK_SEC = 2.0             # Tiempo medio entre acciones de un participante real
+
+TASK_TEXT = ("Mis estudios me han dado herramientas para analizar problemas y trabajar en equipo. "
+             "Gracias a las prácticas aprendí a organizar proyectos reales y a comunicar resultados. "
+             "Espero aplicar estas competencias en mi futuro profesional y seguir aprendiendo.")
+
+
+# =============================================================
+# MEDICIÓN
+# =============================================================
+class Recorder:
+    """Latencias por endpoint (segundos) y respuestas no 2xx."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok=True):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def timed(self, endpoint, fn, *args, **kwargs):
+        started = _time.perf_counter()
+        try:
+            response = fn(*args, **kwargs)
+        except requests.RequestException:
+            self.record(endpoint, _time.perf_counter() - started, ok=False)
+            return None
+        self.record(endpoint, _time.perf_counter() - started, ok=response.status_code < 400)
+        return response
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(recorder, elapsed):
+    summary = {}
+    for endpoint, values in sorted(recorder.samples.items()):
+        values = sorted(values)
+        summary[endpoint] = {
+            "n": len(values), "errors": recorder.errors.get(endpoint, 0),
+            "rps": round(len(values) / elapsed, 2) if elapsed > 0 else None,
+            "p50_ms": round(percentile(values, 50) * 1000, 2), "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2), "max_ms": round(values[-1] * 1000, 2),
+        }
+    return summary
+
+
+# =============================================================
+# SESIÓN DE UN PARTICIPANTE (modelada sobre experiment.js)
+# =============================================================
+class Participant:
+    def __init__(self, base_url, recorder, rng, time_scale, stream_share, use_log_endpoint):
+        self.base = base_url
+        self.rec = recorder
+        self.rng = rng
+        self.scale = time_scale
+        self.stream_share = stream_share
+        self.use_log = use_log_endpoint     # Cliente antiguo: un POST /log por evento
+        self.http = requests.Session()
+        self.subject_id = "S-" + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        self.policy = rng.choice(POLICIES)
+        self.seq = 0
+        self.buffer = []
+        self.buffer_since = None
+        self.events_sent = 0
+
+    def think(self, mean=THINK_SEC):
+        _time.sleep(self.rng.expovariate(1 / mean) * self.scale)
+
+    # ── Eventos ──
+    def event(self, name, payload=None):
+        self.seq += 1
+        if self.use_log:
+            body = {"subject_id": self.subject_id, "policy": self.policy, "event": name,
+                    "event_id": f"{self.subject_id}-{self.seq}", "payload": payload or {},
+                    "ts": _time.strftime("%Y-%m-%dT%H:%M:%SZ", _time.gmtime())}
+            response = self.rec.timed("/log", self.http.post, self.base + "/log", json=body)
+            self.events_sent += response is not None and response.ok
+            return
+        now = _time.time()
+        self.buffer.append((self.seq, int(now * 1000), name, payload or {}))
+        if self.buffer_since is None:
+            self.buffer_since = now
+        if len(self.buffer) >= FLUSH_SIZE or now - self.buffer_since >= FLUSH_INTERVAL_SEC * self.scale:
+            self.flush()
+
+    def flush(self, beacon=False):
+        if not self.buffer:
+            return
+        batch, self.buffer, self.buffer_since = self.buffer, [], None
+        t0 = batch[0][1]
+        body = json.dumps({"v": 2, "subject_id": self.subject_id, "policy": self.policy, "t0": t0,
+                           "events": [[seq, t - t0, name] + ([payload] if payload else [])
+                                      for seq, t, name, payload in batch]}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if not beacon and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        response = self.rec.timed("/log-batch", self.http.post, self.base + "/log-batch", data=body, headers=headers)
+        if response is not None and response.ok:
+            self.events_sent += len(batch)
+        elif not beacon:
+            self.buffer = batch + self.buffer    # Como el cliente: se reintenta en el siguiente flush
+            self.buffer_since = _time.time()
+
+    # ── Pantallas ──
+    def load_page(self):
+        response = self.rec.timed("static", self.http.get, self.base + "/", headers={"Accept-Encoding": "gzip, br"})
+        if response is None or not response.ok:
+            return
+        for part in response.text.split('"'):
+            if part.startswith("assets/") or part.startswith("jsPsych/") or part.startswith("js/") \
+                    or part.startswith("css/"):
+                self.rec.timed("static", self.http.get, self.base + "/" + part, headers={"Accept-Encoding": "gzip, br"})
+
+    def ai_suggestion(self, text, selection):
+        body = {"text": text, "selection": selection, "policy": self.policy}
+        if self.rng.random() < self.stream_share:
+            started = _time.perf_counter()
+            try:
+                with self.http.post(self.base + "/ai-suggest/stream", json=body, stream=True) as response:
+                    first = None
+                    for line in response.iter_lines():
+                        if first is None and line.startswith(b"data:"):
+                            first = _time.perf_counter() - started
+                    ok = response.ok
+            except requests.RequestException:
+                first, ok = None, False
+            self.rec.record("/ai-suggest/stream", _time.perf_counter() - started, ok)
+            if first is not None:
+                self.rec.record("/ai-suggest/stream (ttft)", first)
+        else:
+            self.rec.timed("/ai-suggest", self.http.post, self.base + "/ai-suggest", json=body)
+
+    def task_screen(self):
+        text = f"({self.subject_id}) "     # Cada participante escribe su propio texto (la caché de IA no lo oculta)
+        for sentence in TASK_TEXT.split(". "):
+            self.think()
+            text += sentence + ". "
+            if self.rng.random() < 0.15:
+                self.event("paste", {"chars": len(sentence), "length_after": len(text)})
+            if self.rng.random() < 0.1:
+                self.event("copy", {"chars": 20})
+        for _ in range(self.rng.choice((0, 1, 1, 2, 3))):
+            selection = text[:40] if self.rng.random() < 0.5 else ""
+            self.event("ai_help_open", {"has_selection": bool(selection)})
+            self.ai_suggestion(text, selection)
+            self.think()
+            self.event("ai_text_inserted", {"suggestion": "palabra " * 12, "chars_inserted": 96,
+                                            "selection_chars": len(selection), "replaced_selection": bool(selection)})
+        self.event("task_snapshot", {"words": len(text.split()), "text_len": len(text),
+                                     "edits": [{"t": i * 1500, "len": i * 10} for i in range(50)],
+                                     "ai_chars_inserted": 96, "paste_count": 1})
+        return text
+
+    def finalize(self, text):
+        self.flush()
+        self.rec.timed("/flush-events", self.http.post, self.base + "/flush-events")
+        body = {"subject_id": self.subject_id, "email": "",
+                "demographics": {"dob": "2001-05-04", "sex": "x", "studies": "grado", "grad_year": "2024",
+                                 "uni": "UV", "field": "Psicología", "city": "Valencia", "policy": self.policy},
+                "results": {"task_text": text, "words": len(text.split()), "edits": [], "ai_usage": {"generated_pct": 10},
+                            "control": {"noticed_policy": "si"}, "personality": {"q1": 3, "q2": 4, "q3": 2},
+                            "ai_motivation": {"m1": 2}}}
+        response = self.rec.timed("/finalize", self.http.post, self.base + "/finalize", json=body)
+        ok = response is not None and response.ok
+        self.event("finalize_sent", {"success": ok, "error": None if ok else "bench"})
+        return ok
+
+    def run(self):
+        self.load_page()
+        text, finalized = "", False
+        for index, (trial_type, clicks, specials) in enumerate(SCREENS):
+            self.event("screen_enter", {"trial_index": index, "trial_type": trial_type})
+            if "policy_assigned" in specials:
+                self.event("policy_assigned", {"policy": self.policy})
+            for _ in range(self.rng.randint(0, clicks * 2)):
+                self.think(THINK_SEC / 2)
+                self.event("click", {"trial_index": index, "since_prev_click_ms": 900,
+                                     "element": {"tag": "BUTTON", "id": None, "class": "jspsych-btn",
+                                                 "text": "Continuar", "type": "button"}})
+            if "task" in specials:
+                text = self.task_screen()
+            elif "finalize" in specials:
+                finalized = self.finalize(text)
+            else:
+                for name in specials:
+                    if name == "email_provided" and self.rng.random() < 0.7:
+                        continue
+                    self.event(name, {"answers": {f"q{i}": self.rng.randint(1, 5) for i in range(6)}})
+            self.think()
+            self.event("screen_leave", {"rt_ms": 4200, "clicks": clicks, "idle_ms": 0, "trial_type": trial_type,
+                                        "time_on_screen_ms": 4200, "time_on_screen_seconds": 4, "trial_index": index})
+        self.flush(beacon=True)    # beforeunload → sendBeacon sin comprimir
+        return finalized
+
+
+# =============================================================
+# ARRANQUE DE LA APP CONTRA EL EMULADOR
+# =============================================================
+def start_app(emulator, openai_stub, workdir, server_kind):
+    """Importa app.py con gspread sustituido por el emulador y lo sirve en un puerto local."""
+    import gspread
+    credentials = {"type": "service_account", "project_id": "bench", "private_key": "-", "client_email": "bench@local"}
+    defaults = {
+        "GOOGLE_SHEETS_CREDENTIALS": json.dumps(credentials),
+        "OPENAI_API_KEY": "sk-benchmark-0000000000000000",
+        "OPENAI_BASE_URL": openai_stub.base_url,
+        "LOG_LEVEL": "WARNING",
+        "SHEETS_KEYS_PATH": "",
+        "EVENTS_SPILL_DIR": os.path.join(workdir, "events_spill"),
+        "FINALIZE_OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "SHARED_QUEUE_PATH": os.path.join(workdir, "ingest_queue.db"),
+        "FLUSHER_LOCK_PATH": os.path.join(workdir, "flusher.lock"),
+        "STORAGE_SQLITE_PATH": os.path.join(workdir, "shadowai.db"),
+        "STORAGE_FILE_DIR": os.path.join(workdir, "exports"),
+        "BLOB_DIR": os.path.join(workdir, "blobs"),
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    if os.environ["OPENAI_BASE_URL"] != openai_stub.base_url:
+        print("⚠️ OPENAI_BASE_URL del entorno apunta fuera del stub: /ai-suggest no usará el stub")
+    emulator.add_spreadsheet(os.getenv("GOOGLE_SHEET_NAME", "Shadow AI - Experimento"))
+    gspread.service_account_from_dict = lambda *args, **kwargs: emulator.client()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as core
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    if server_kind == "asgi":
+        import uvicorn
+        import asgi
+        server = uvicorn.Server(uvicorn.Config(asgi.create_app(), host="127.0.0.1", port=0,
+                                               log_level="warning", lifespan="on"))
+        threading.Thread(target=server.run, name="bench-asgi", daemon=True).start()
+        while not server.started:
+            _time.sleep(0.02)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        return core, f"http://127.0.0.1:{port}", lambda: setattr(server, "should_exit", True)
+
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, core.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-wsgi", daemon=True).start()
+    return core, f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def warm_up(core):
+    """Crea las hojas antes de la carga: en producción ya existen, y la carrera entre las primeras
+    escrituras al crearlas (503 sueltos según el orden de llegada) no es lo que se mide."""
+    client = core.get_cached_client()
+    tables = [("results", core.RESULTS_HEADERS), ("blobs", core.BLOB_HEADERS)]
+    if core._events_shards is None:
+        tables.append(("events", core.EVENTS_HEADERS))
+    for table, headers in tables:
+        core.get_cached_worksheet(client, core.GOOGLE_SHEET_NAME, table, headers)
+
+
+def wait_drained(core, timeout):
+    """Espera a que la cola de eventos y la outbox se vacíen; devuelve los segundos o None."""
+    started = _time.monotonic()
+    while _time.monotonic() - started < timeout:
+        outbox = core._results_outbox.stats()["pending"] if core._results_outbox is not None else 0
+        if core._pending_events() == 0 and outbox == 0:
+            return round(_time.monotonic() - started, 2)
+        _time.sleep(0.1)
+    return None
+
+
+# =============================================================
+# BASELINES
+# =============================================================
+MIN_TAIL_SAMPLES = 10   # Muestras por encima de un percentil para compararlo (p95 → n ≥ 200)
+
+
+def compare(summary, baseline, tolerance, slack_ms, error_tolerance):
+    """Regresiones de p50/p95/p99 frente al baseline (más de tolerance y de slack_ms) y de la tasa
+    de errores (más de error_tolerance en términos absolutos: con pocas peticiones, un 503 suelto
+    ya es un porcentaje alto). Un percentil con menos de MIN_TAIL_SAMPLES muestras por encima es
+    prácticamente el máximo y cambia de una ejecución a otra: se informa, pero no se compara."""
+    regressions = []
+    for endpoint, stats in summary.items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if base is None:
+            continue
+        for p in (50, 95, 99):
+            key = f"p{p}_ms"
+            if min(stats["n"], base["n"]) * (100 - p) / 100 < MIN_TAIL_SAMPLES:
+                continue
+            limit = base[key] * (1 + tolerance) + slack_ms
+            if stats[key] > limit:
+                regressions.append(f"{endpoint} {key}: {stats[key]:.1f} ms > {limit:.1f} ms (baseline {base[key]:.1f} ms)")
+        if stats["errors"] > base.get("errors", 0) and stats["n"]:
+            error_rate, base_rate = stats["errors"] / stats["n"], base.get("errors", 0) / max(1, base["n"])
+            if error_rate > base_rate + error_tolerance:
+                regressions.append(f"{endpoint} errores: {error_rate:.1%} (baseline {base_rate:.1%})")
+    return regressions
+
+
+def print_report(summary, totals):
+    print(f"\n{'endpoint':<28}{'n':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, s in summary.items():
+        print(f"{endpoint:<28}{s['n']:>7}{s['errors']:>6}{s['rps']:>9}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}")
+    print()
+    for key, value in totals.items():
+        print(f"{key}: {value}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de app.py con Sheets emulado")
+    parser.add_argument("--participants", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20, help="Sesiones simultáneas")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="Escala de los tiempos reales de una sesión")
+    parser.add_argument("--stream-share", type=float, default=0.8, help="Fracción de sugerencias por /ai-suggest/stream")
+    parser.add_argument("--log-share", type=float, default=0.2, help="Fracción de clientes que usan /log por evento")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--sheets-latency", type=float, default=0.08, help="Latencia media de escritura (s)")
+    parser.add_argument("--sheets-read-latency", type=float, default=0.03)
+    parser.add_argument("--latency-per-100k-rows", type=float, default=0.0)
+    parser.add_argument("--error-429", type=float, default=0.0, help="Probabilidad de 429 por llamada")
+    parser.add_argument("--error-500", type=float, default=0.0, help="Probabilidad de 500 por llamada")
+    parser.add_argument("--cell-limit", type=int, default=10_000_000)
+    parser.add_argument("--openai-latency", type=float, default=0.4)
+    parser.add_argument("--openai-error", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Empeoramiento relativo permitido")
+    parser.add_argument("--slack-ms", type=float, default=10.0, help="Margen absoluto para latencias pequeñas")
+    parser.add_argument("--error-tolerance", type=float, default=0.02,
+                        help="Aumento absoluto permitido de la tasa de errores por endpoint (0.02 = 2 puntos)")
+    parser.add_argument("--json", help="Escribe el resumen completo en este fichero")
+    args = parser.parse_args(argv)
+
+    emulator = SheetsEmulator(latency=args.sheets_latency, read_latency=args.sheets_read_latency,
+                              latency_per_100k_rows=args.latency_per_100k_rows, error_429_rate=args.error_429,
+                              error_500_rate=args.error_500, cell_limit=args.cell_limit, seed=args.seed)
+    openai_stub = OpenAIStub(latency=args.openai_latency, error_rate=args.openai_error, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="shadowai-bench-")
+    # Las sesiones van 1/time_scale veces más deprisa: la cuota de Sheets (por minuto real) se escala
+    # igual, si no el benchmark mide sobre todo las esperas por cuota y sus colas varían de una
+    # ejecución a otra según cómo caiga la ráfaga inicial
+    for key in ("SHEETS_READ_PER_MIN", "SHEETS_WRITE_PER_MIN"):
+        os.environ.setdefault(key, str(round(60 / args.time_scale)))
+    core, base_url, stop = start_app(emulator, openai_stub, workdir, args.server)
+    warm_up(core)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    participants = [Participant(base_url, recorder, random.Random(rng.random()), args.time_scale,
+                                args.stream_share, rng.random() < args.log_share)
+                    for _ in range(args.participants)]
+    print(f"📊 {args.participants} participantes ({args.concurrency} a la vez) contra {base_url} [{args.server}]")
+    started = _time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        finalized = sum(pool.map(lambda p: p.run(), participants))
+    elapsed = _time.perf_counter() - started
+    drain_sec = wait_drained(core, args.drain_timeout)
+    stop()
+    openai_stub.stop()
+
+    summary = summarize(recorder, elapsed)
+    events_sent = sum(p.events_sent for p in participants)
+    events_in_sheets = emulator.rows("events", exclude=("events_index",))
+    totals = {
+        "duración (s)": round(elapsed, 2),
+        "peticiones/s": round(sum(s["n"] for s in summary.values()) / elapsed, 1),
+        "participantes finalizados": f"{finalized}/{args.participants}",
+        "eventos aceptados": events_sent,
+        "eventos en Sheets": events_in_sheets,
+        "resultados en Sheets": emulator.rows("results"),
+        "drenado tras la carga (s)": drain_sec if drain_sec is not None else f"> {args.drain_timeout}",
+        "llamadas a Sheets": sum(emulator.describe()["calls"].values()),
+        "429/500 inyectados": f"{emulator.stats['injected_429']}/{emulator.stats['injected_500']}",
+        "OpenAI stub": openai_stub.stats,
+    }
+    print_report(summary, totals)
+    if events_in_sheets < events_sent:
+        print(f"⚠️ Faltan {events_sent - events_in_sheets} eventos aceptados en Sheets")
+
+    config = {k: v for k, v in vars(args).items()
+              if k not in ("baseline", "save_baseline", "tolerance", "slack_ms", "error_tolerance", "json",
+                           "drain_timeout")}
+    result = {"config": config, "endpoints": summary, "totals": {k: v for k, v in totals.items()}}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False, default=str)
+
+    if args.save_baseline:
+        failing = [endpoint for endpoint, stats in summary.items() if stats["errors"]]
+        if failing:
+            # Un baseline con errores los da por buenos: cualquier ejecución que falle igual "pasa"
+            print(f"❌ Baseline no guardado: hay errores en {', '.join(failing)}")
+            return 1
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "endpoints": summary}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"✅ Baseline guardado en '{args.baseline}'")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"⚠️ Sin baseline en '{args.baseline}' (usa --save-baseline para crearlo)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        changed = sorted(k for k in set(config) | set(baseline.get("config", {}))
+                         if config.get(k) != baseline.get("config", {}).get(k))
+        print(f"⚠️ Configuración distinta a la del baseline ({', '.join(changed)}): la comparación es orientativa")
+    regressions = compare(summary, baseline, args.tolerance, args.slack_ms, args.error_tolerance)
+    if regressions:
+        print("❌ Regresiones frente al baseline:")
+        for line in regressions:
+            print(f"   • {line}")
+        return 1
+    print(f"✅ Sin regresiones frente a '{args.baseline}' (tolerancia {args.tolerance:.0%} + {args.slack_ms} ms, "
+          f"errores +{args.error_tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+# =============================================================
+# Shadow AI — Almacén de blobs para payloads grandes de eventos
+# =============================================================
+# Los campos grandes de un payload (p. ej. "edits" de task_snapshot o la
+# "suggestion" de ai_text_inserted) se sacan de la celda payload_json: el
+# valor se guarda una sola vez, direccionado por el SHA-256 de su contenido
+# completo (y su tipo), y el evento sólo lleva una referencia:
+#
+#     "edits": {"$blob": "<sha256>", "bytes": 2210}
+#
+# Si el mismo participante ya envió ese campo antes, el blob se guarda como
+# delta contra el valor anterior (listas que crecen por el final o texto
+# editado en medio); cada max_chain deltas se guarda el valor completo para
+# que la reconstrucción no recorra cadenas largas. La clave siempre es el
+# hash del valor completo, así que un reintento del mismo evento no escribe
+# nada nuevo.
+#
+# Los blobs viven en archivos locales (<dir>/<aa>/<hash>.json, escritura
+# atómica). Opcionalmente se replican a la tabla "blobs" de los sinks de
+# almacenamiento, troceados para no pasar del límite de 50k caracteres por
+# celda de Google Sheets. Lo replicado se marca en disco (<hash>.sent), así que
+# el proceso que escribe (el flusher elegido en INGEST_MODE=shared) ve también
+# los blobs que guardaron los demás workers: app.py incluye en cada ciclo los
+# blobs que referencian sus eventos, con las bases de sus deltas, y retiene
+# los eventos si no puede (o si falta el archivo de alguno).
+#
+# Reconstruir valores (el disco de Render es efímero: lo que vale es la tabla
+# "blobs" replicada, descargada de Sheets como CSV o leída de los sinks locales):
+#
+#     python blobs.py <directorio> <sha256>
+#     python blobs.py --table blobs.csv <sha256>
+#     python blobs.py --table blobs.csv --events events.csv --out events_completos.csv
+
+import os
+import re
+import sys
+import csv
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time as _time
+from collections import OrderedDict
+
+log = logging.getLogger("shadowai.blobs")
+
+BLOB_REF_KEY = "$blob"
+BLOB_HEADERS = ["hash", "chunk", "chunks", "record"]
+CHUNK_CHARS  = 45000        # Margen bajo el límite de 50.000 caracteres por celda
+
+_REF_RE = re.compile(r'"\$blob":\s*"([0-9a-f]{64})"')
+
+
+def _serialize(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def is_blob_ref(value):
+    return isinstance(value, dict) and BLOB_REF_KEY in value
+
+
+def blob_refs(text):
+    """Hashes referenciados en un payload ya serializado (celda payload_json)."""
+    return _REF_RE.findall(text) if isinstance(text, str) and BLOB_REF_KEY in text else []
+
+
+def _delta(base, value):
+    """Delta de `value` respecto a `base`, o None si no compensa (tipos distintos, poco en común)."""
+    if isinstance(base, list) and isinstance(value, list):
+        keep = 0
+        limit = min(len(base), len(value))
+        while keep < limit and base[keep] == value[keep]:
+            keep += 1
+        # editLog.slice(-50): la ventana puede desplazarse; buscar dónde empieza el valor nuevo
+        if keep == 0 and value:
+            try:
+                start = base.index(value[0])
+            except ValueError:
+                return None
+            shift = 0
+            while start + shift < len(base) and shift < len(value) and base[start + shift] == value[shift]:
+                shift += 1
+            if start + shift != len(base):
+                return None
+            return {"op": "list_shift", "drop": start, "items": value[shift:]}
+        if keep == 0:
+            return None
+        return {"op": "list_splice", "keep": keep, "items": value[keep:]}
+    if isinstance(base, str) and isinstance(value, str):
+        limit = min(len(base), len(value))
+        prefix = 0
+        while prefix < limit and base[prefix] == value[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and base[-1 - suffix] == value[-1 - suffix]:
+            suffix += 1
+        if prefix + suffix < len(value) // 2:
+            return None
+        return {"op": "text_splice", "prefix": prefix, "suffix": suffix,
+                "insert": value[prefix:len(value) - suffix]}
+    return None
+
+
+def _apply_delta(base, delta):
+    op = delta["op"]
+    if op == "list_splice":
+        return base[:delta["keep"]] + delta["items"]
+    if op == "list_shift":
+        return base[delta["drop"]:] + delta["items"]
+    if op == "text_splice":
+        end = len(base) - delta["suffix"]
+        return base[:delta["prefix"]] + delta["insert"] + base[end:]
+    raise ValueError(f"operación de delta desconocida: {op}")
+
+
+def resolve_value(digest, read):
+    """Valor completo de un blob, aplicando la cadena de deltas; read(hash) devuelve su registro."""
+    chain = []
+    record = read(digest)
+    while "delta" in record:
+        chain.append(record["delta"])
+        record = read(record["delta"]["base"])
+    value = record["full"]
+    for delta in reversed(chain):
+        value = _apply_delta(value, delta)
+    return value
+
+
+def expand_refs(payload, read):
+    """Copia del payload con las referencias a blobs sustituidas por el valor completo."""
+    if not isinstance(payload, dict):
+        return payload
+    return {key: resolve_value(value[BLOB_REF_KEY], read) if is_blob_ref(value) else value
+            for key, value in payload.items()}
+
+
+def _blob_table_rows(path):
+    """Filas (dict con BLOB_HEADERS) de una copia de la tabla "blobs": CSV (descarga de Sheets o
+    sink de archivos), JSONL (sink de archivos) o la base SQLite del sink."""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        conn = sqlite3.connect(path)
+        try:
+            cursor = conn.execute('SELECT "hash", "chunk", "chunks", "record" FROM "blobs"')
+            return [dict(zip(BLOB_HEADERS, row)) for row in cursor]
+        finally:
+            conn.close()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def load_blob_table(paths):
+    """Registros {hash: registro} de una o varias copias de la tabla "blobs", uniendo los trozos.
+    Los blobs a los que les falta algún trozo se dejan fuera (y se avisa)."""
+    chunks = {}
+    for path in paths:
+        for row in _blob_table_rows(path):
+            # Un reintento puede haber escrito el mismo trozo dos veces: es idéntico
+            parts = chunks.setdefault(row["hash"], {"total": int(row["chunks"]), "parts": {}})
+            parts["parts"][int(row["chunk"])] = row["record"] or ""
+    records, incomplete = {}, 0
+    for digest, parts in chunks.items():
+        if len(parts["parts"]) != parts["total"]:
+            incomplete += 1
+            continue
+        records[digest] = json.loads("".join(parts["parts"][i] for i in range(parts["total"])))
+    if incomplete:
+        log.warning(f"⚠️ blobs: {incomplete} blobs de la tabla están incompletos (faltan trozos)")
+    return records
+
+
+def table_reader(records):
+    """read(hash) sobre lo que devuelve load_blob_table, con un error claro si falta un blob."""
+    def read(digest):
+        try:
+            return records[digest]
+        except KeyError:
+            raise KeyError(f"el blob {digest} no está en la tabla \"blobs\"") from None
+    return read
+
+
+class BlobStore:
+    """Blobs direccionados por contenido con deltas por (participante, campo)."""
+
+    def __init__(self, directory, min_bytes=1024, max_chain=10, max_tracked=2000, replicate=False,
+                 scan_interval=60.0):
+        self.directory = directory
+        self.min_bytes = min_bytes
+        self.max_chain = max_chain
+        self.max_tracked = max_tracked
+        self.replicate = replicate
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._last = OrderedDict()      # (subject_id, campo) → (hash, valor, profundidad de delta)
+        self._pending = []              # Candidatos a replicar (la marca .sent en disco es la que manda)
+        self._replicated = set()        # hashes con marca .sent ya comprobada
+        self._last_scan = 0.0
+        self.stats = {"offloaded_fields": 0, "stored_full": 0, "stored_delta": 0, "reused": 0,
+                      "bytes_offloaded": 0, "bytes_stored": 0, "replicated": 0, "missing": 0}
+        os.makedirs(directory, exist_ok=True)
+        if replicate:
+            self._pending = self._scan_unreplicated()
+            self._last_scan = _time.monotonic()
+
+    # ── Archivos ──
+    def _path(self, digest, suffix=".json"):
+        return os.path.join(self.directory, digest[:2], digest + suffix)
+
+    def _scan_unreplicated(self):
+        """Blobs sin marca .sent en disco, de este proceso o de cualquier otro."""
+        pending = []
+        for sub in sorted(os.listdir(self.directory)):
+            folder = os.path.join(self.directory, sub)
+            if not os.path.isdir(folder):
+                continue
+            names = set(os.listdir(folder))
+            for name in sorted(names):
+                if name.endswith(".json") and name[:-5] + ".sent" not in names:
+                    pending.append(name[:-5])
+        return pending
+
+    def _is_replicated(self, digest):
+        """Llamar con _lock adquirido."""
+        if digest in self._replicated:
+            return True
+        if os.path.exists(self._path(digest, ".sent")):
+            self._replicated.add(digest)
+            return True
+        return False
+
+    def _write(self, digest, record):
+        """Escritura atómica de un registro; no hace nada si el blob ya existe."""
+        path = self._path(digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        text = _serialize(record)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if self.replicate:
+            self._pending.append(digest)
+        return len(text)
+
+    def _read(self, digest):
+        with open(self._path(digest), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # ── Offload ──
+    def offload(self, subject_id, payload):
+        """Devuelve una copia del payload con los campos grandes sustituidos por referencias."""
+        result = None
+        for key, value in payload.items():
+            if not isinstance(value, (str, list, dict)) or is_blob_ref(value):
+                continue
+            serialized = value if isinstance(value, str) else _serialize(value)
+            if len(serialized.encode("utf-8")) < self.min_bytes:
+                continue
+            if result is None:
+                result = dict(payload)
+            result[key] = self._store_field(str(subject_id), key, value, serialized)
+        return result if result is not None else payload
+
+    def _store_field(self, subject_id, key, value, serialized):
+        # El tipo entra en el hash: un texto igual al JSON de una lista no colisiona con ella
+        tag = "s:" if isinstance(value, str) else "j:"
+        digest = hashlib.sha256((tag + serialized).encode("utf-8")).hexdigest()
+        ref = {BLOB_REF_KEY: digest, "bytes": len(serialized)}
+        track = (subject_id, key)
+        with self._lock:
+            self.stats["offloaded_fields"] += 1
+            self.stats["bytes_offloaded"] += len(serialized)
+            previous = self._last.get(track)
+            depth = 0
+            if os.path.exists(self._path(digest)):
+                self.stats["reused"] += 1
+                if previous is not None and previous[0] == digest:
+                    depth = previous[2]
+                elif "delta" in self._read(digest):
+                    depth = self.max_chain      # Profundidad desconocida: el siguiente se guarda completo
+            else:
+                record = None
+                if previous is not None and previous[2] < self.max_chain:
+                    delta = _delta(previous[1], value)
+                    if delta is not None:
+                        delta["base"] = previous[0]
+                        record = {"delta": delta}
+                        depth = previous[2] + 1
+                if record is None:
+                    record = {"full": value}
+                    self.stats["stored_full"] += 1
+                else:
+                    self.stats["stored_delta"] += 1
+                self.stats["bytes_stored"] += self._write(digest, record)
+            self._last[track] = (digest, value, depth)
+            self._last.move_to_end(track)
+            while len(self._last) > self.max_tracked:
+                self._last.popitem(last=False)
+        return ref
+
+    # ── Lectura ──
+    def resolve(self, digest):
+        """Valor completo de un blob, aplicando la cadena de deltas."""
+        return resolve_value(digest, self._read)
+
+    # ── Replicación a la tabla "blobs" ──
+    def unreplicated(self, digests):
+        """Los hashes de `digests` que aún no están en la tabla "blobs"."""
+        with self._lock:
+            return {digest for digest in digests if not self._is_replicated(digest)}
+
+    def unreplicated_closure(self, digests):
+        """Los hashes de `digests` sin replicar más las bases de sus deltas (transitivamente) que
+        tampoco lo están: (hashes, hashes cuyo archivo falta). Una base ya replicada corta la cadena."""
+        needed, missing = set(), set()
+        stack = list(digests)
+        while stack:
+            digest = stack.pop()
+            if digest in needed or digest in missing:
+                continue
+            with self._lock:
+                if self._is_replicated(digest):
+                    continue
+            try:
+                record = self._read(digest)
+            except FileNotFoundError:
+                missing.add(digest)
+                continue
+            needed.add(digest)
+            if "delta" in record:
+                stack.append(record["delta"]["base"])
+        return needed, missing
+
+    def pending_rows(self, max_blobs=50, required=()):
+        """Filas (BLOB_HEADERS) de blobs aún no replicados: ([hashes], [filas]). Van siempre todos los
+        `required` (los que referencian los eventos del ciclo) y hasta max_blobs de los demás, cada
+        uno con las bases de su cadena de deltas que falten por replicar."""
+        required = set(required)
+        with self._lock:
+            now = _time.monotonic()
+            if self.scan_interval and now - self._last_scan >= self.scan_interval:
+                # Blobs huérfanos de otros procesos (sus eventos no llegaron a la cola)
+                known = set(self._pending)
+                self._pending.extend(d for d in self._scan_unreplicated() if d not in known)
+                self._last_scan = now
+            self._pending = [d for d in self._pending if not self._is_replicated(d)]
+            others = [d for d in self._pending if d not in required][:max_blobs]
+        digests, missing = self.unreplicated_closure(required | set(others))
+        found, rows = [], []
+        for digest in sorted(digests):
+            try:
+                with open(self._path(digest), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except FileNotFoundError:
+                missing.add(digest)
+                continue
+            chunks = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or [""]
+            rows.extend([digest, i, len(chunks), chunk] for i, chunk in enumerate(chunks))
+            found.append(digest)
+        if missing:
+            # Disco perdido o borrado a mano: no hay nada que replicar (app.py retiene los eventos que lo usan)
+            log.error(f"❌ blobs: faltan los archivos de {len(missing)} blobs "
+                      f"({', '.join(d[:12] + '…' for d in sorted(missing)[:3])}), no se pueden replicar")
+            with self._lock:
+                self.stats["missing"] += len(missing)
+                self._pending = [d for d in self._pending if d not in missing]
+        return found, rows
+
+    def mark_replicated(self, digests):
+        done = set(digests)
+        for digest in digests:
+            open(self._path(digest, ".sent"), "w").close()
+        with self._lock:
+            self._replicated.update(done)
+            self._pending = [d for d in self._pending if d not in done]
+            self.stats["replicated"] += len(done)
+
+    def describe(self):
+        with self._lock:
+            return dict(self.stats, directory=self.directory, min_bytes=self.min_bytes,
+                        tracked_fields=len(self._last), pending_replication=len(self._pending))
+
+
+def _expand_events(read, events_path, out_path):
+    """Copia un CSV de eventos con los blobs de payload_json ya reconstruidos. Devuelve (filas, fallos)."""
+    rows = failed = 0
+    with open(events_path, "r", encoding="utf-8", newline="") as src, \
+         open(out_path, "w", encoding="utf-8", newline="") as dst:
+        reader = csv.DictReader(src)
+        writer = csv.DictWriter(dst, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        for row in reader:
+            text = row.get("payload_json") or ""
+            if blob_refs(text):
+                try:
+                    row["payload_json"] = _serialize(expand_refs(json.loads(text), read))
+                except (KeyError, ValueError) as e:
+                    failed += 1     # Se deja la referencia tal cual
+                    log.warning(f"⚠️ blobs: fila {rows + 2} de {events_path}: {e}")
+            writer.writerow(row)
+            rows += 1
+    return rows, failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="Reconstruye blobs desde el disco o desde la tabla \"blobs\".")
+    parser.add_argument("args", nargs="*", help="<directorio> <sha256>, o <sha256> con --table")
+    parser.add_argument("--table", action="append", default=[],
+                        help="copia de la tabla blobs (.csv, .jsonl o .db); se puede repetir")
+    parser.add_argument("--events", help="CSV de eventos cuyo payload_json se expande")
+    parser.add_argument("--out", help="CSV de salida para --events")
+    opts = parser.parse_args()
+
+    if opts.table:
+        read = table_reader(load_blob_table(opts.table))
+        if opts.events:
+            if not opts.out or opts.args:
+                parser.error("--events necesita --out y ningún hash")
+            total, failed = _expand_events(read, opts.events, opts.out)
+            print(f"✅ {total} eventos escritos en {opts.out} ({failed} con blobs que no están en la tabla)")
+            sys.exit(1 if failed else 0)
+        if len(opts.args) != 1:
+            parser.error("con --table se espera un solo <sha256>")
+        print(_serialize(resolve_value(opts.args[0], read)))
+    else:
+        if len(opts.args) != 2 or opts.events:
+            parser.error("uso: python blobs.py <directorio> <sha256>  (o --table, ver --help)")
+        print(_serialize(BlobStore(opts.args[0]).resolve(opts.args[1])))
@@ -0,0 +1,174 @@
+# =============================================================
+# Shadow AI — Bulkheads por dependencia externa
+# =============================================================
+# Cada dependencia lenta (OpenAI, Google Sheets) tiene su compartimento con
+# un máximo de llamadas concurrentes y una cola de espera acotada. Si la cola
+# está llena, o una petición espera más de queue_timeout sin conseguir hueco,
+# se lanza BulkheadFull y la ruta responde 503 al instante: una dependencia
+# lenta ocupa como mucho max_concurrent + max_queue workers y el resto
+# (eventos, estáticos) sigue atendiéndose.
+#
+# Las llamadas se ejecutan en el propio hilo de la petición (el worker WSGI
+# espera igualmente la respuesta y así conserva el contexto de Flask); el
+# compartimento sólo limita cuántos hilos pueden estar dentro a la vez.
+# En modo ASGI (asgi.py) acquire_async() comparte los mismos contadores pero
+# espera en el event loop sin bloquear ningún hilo.
+
+import math
+import asyncio
+import threading
+import time as _time
+from contextlib import contextmanager
+
+
+class BulkheadFull(Exception):
+    """El compartimento está saturado: responder 503 en lugar de esperar."""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"bulkhead '{name}' saturado ({reason})")
+        self.name = name
+        self.reason = reason            # "queue_full", "queue_timeout" o "busy" (try_acquire sin hueco)
+        self.retry_after = retry_after  # Segundos sugeridos para Retry-After
+
+
+class _Permit:
+    """Hueco ocupado en un bulkhead; release() es idempotente (p. ej. call_on_close de un stream)."""
+
+    __slots__ = ("_bulkhead", "_acquired_at", "_released")
+
+    def __init__(self, bulkhead):
+        self._bulkhead = bulkhead
+        self._acquired_at = _time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._bulkhead._release(_time.monotonic() - self._acquired_at)
+
+
+class Bulkhead:
+    """Límite de concurrencia con cola de espera acotada, timeout de espera y métricas de saturación."""
+
+    def __init__(self, name, max_concurrent, max_queue=0, queue_timeout=1.0):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self.stats = {"admitted": 0, "completed": 0, "rejected_queue_full": 0, "rejected_queue_timeout": 0,
+                      "not_waited": 0, "max_active": 0, "max_waiting": 0, "queued": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                      "busy_sec_total": 0.0}
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.queue_timeout))
+
+    # ── Con self._cond tomado ──
+    def _enqueue_locked(self):
+        """Entra en la cola de espera o lanza BulkheadFull si está llena."""
+        if self._waiting >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise BulkheadFull(self.name, "queue_full", self._retry_after())
+        self._waiting += 1
+        self.stats["queued"] += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self._waiting)
+
+    def _timeout_locked(self):
+        self.stats["rejected_queue_timeout"] += 1
+        return BulkheadFull(self.name, "queue_timeout", self._retry_after())
+
+    def _admit_locked(self, started=None):
+        if started is not None:
+            wait_ms = (_time.monotonic() - started) * 1000
+            self.stats["wait_ms_total"] += wait_ms
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+        self._active += 1
+        self.stats["admitted"] += 1
+        self.stats["max_active"] = max(self.stats["max_active"], self._active)
+        return _Permit(self)
+
+    def acquire(self):
+        """Ocupa un hueco (esperando como mucho queue_timeout). Lanza BulkheadFull si no hay."""
+        with self._cond:
+            if self._active < self.max_concurrent:
+                return self._admit_locked()
+            self._enqueue_locked()
+            started = _time.monotonic()
+            deadline = started + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - _time.monotonic()
+                    if remaining <= 0:
+                        raise self._timeout_locked()
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            return self._admit_locked(started)
+
+    def try_acquire(self):
+        """Ocupa un hueco sólo si hay uno libre ahora mismo; si no, None (sin esperar ni contar rechazo).
+        Para rutas con alternativa barata a esperar (p. ej. encolar en memoria)."""
+        with self._cond:
+            if self._active < self.max_concurrent:
+                return self._admit_locked()
+            self.stats["not_waited"] += 1
+            return None
+
+    async def acquire_async(self, poll=0.01):
+        """Como acquire(), pero la espera cede el event loop (los huecos los liberan hilos o corrutinas)."""
+        with self._cond:
+            if self._active < self.max_concurrent:
+                return self._admit_locked()
+            self._enqueue_locked()
+        started = _time.monotonic()
+        deadline = started + self.queue_timeout
+        try:
+            while True:
+                await asyncio.sleep(min(poll, max(0.0, deadline - _time.monotonic())))
+                with self._cond:
+                    if self._active < self.max_concurrent:
+                        self._waiting -= 1
+                        return self._admit_locked(started)
+                    if _time.monotonic() >= deadline:
+                        self._waiting -= 1
+                        raise self._timeout_locked()
+        except asyncio.CancelledError:
+            with self._cond:
+                self._waiting -= 1
+            raise
+
+    def _release(self, held_sec):
+        with self._cond:
+            self._active -= 1
+            self.stats["completed"] += 1
+            self.stats["busy_sec_total"] += held_sec
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        permit = self.acquire()
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def call(self, fn, *args, **kwargs):
+        """Ejecuta fn dentro del compartimento."""
+        with self.slot():
+            return fn(*args, **kwargs)
+
+    def describe(self):
+        with self._cond:
+            info = dict(self.stats, active=self._active, waiting=self._waiting,
+                        max_concurrent=self.max_concurrent, max_queue=self.max_queue,
+                        queue_timeout_sec=self.queue_timeout)
+        info["saturation"] = round(info["active"] / self.max_concurrent, 3)
+        info["wait_ms_total"] = round(info["wait_ms_total"], 1)
+        info["wait_ms_max"] = round(info["wait_ms_max"], 1)
+        info["busy_sec_total"] = round(info["busy_sec_total"], 3)
+        rejected = info["rejected_queue_full"] + info["rejected_queue_timeout"]
+        total = info["admitted"] + rejected
+        info["rejection_rate"] = round(rejected / total, 4) if total else 0.0
+        return info
@@ -0,0 +1,96 @@
+# =============================================================
+# Shadow AI — Deduplicación de eventos por event_id
+# =============================================================
+# El frontend reenvía lotes que pueden haber llegado ya (reintento tras un
+# timeout, sendBeacon en beforeunload, flushAndWait). Cada evento lleva un
+# event_id generado en el cliente; aquí se recuerdan los últimos IDs vistos
+# por participante en un LRU acotado, así que la memoria máxima es
+# max_subjects × max_ids_per_subject IDs y la deduplicación es exacta (sin
+# falsos positivos que borren eventos reales).
+
+import threading
+from collections import OrderedDict
+
+
+class EventDeduper:
+    """LRU de participantes, cada uno con un LRU de sus event_id recientes."""
+
+    def __init__(self, max_subjects=2000, max_ids_per_subject=1024):
+        self.max_subjects = max_subjects
+        self.max_ids_per_subject = max_ids_per_subject
+        self._lock = threading.Lock()
+        self._subjects = OrderedDict()      # subject_id → OrderedDict(event_id → None)
+        self.stats = {"seen": 0, "duplicates": 0, "without_id": 0, "evicted_subjects": 0}
+
+    def _ids_for(self, subject):
+        """LRU de IDs del participante, creándolo si hace falta (llamar con _lock adquirido)."""
+        ids = self._subjects.get(subject)
+        if ids is None:
+            ids = OrderedDict()
+            self._subjects[subject] = ids
+            if len(self._subjects) > self.max_subjects:
+                self._subjects.popitem(last=False)
+                self.stats["evicted_subjects"] += 1
+        else:
+            self._subjects.move_to_end(subject)
+        return ids
+
+    def _admit(self, ids, event_id):
+        """True si event_id es nuevo (y lo registra). Llamar con _lock adquirido."""
+        self.stats["seen"] += 1
+        key = str(event_id)
+        if key in ids:
+            ids.move_to_end(key)
+            self.stats["duplicates"] += 1
+            return False
+        ids[key] = None
+        if len(ids) > self.max_ids_per_subject:
+            ids.popitem(last=False)
+        return True
+
+    def filter(self, events):
+        """Devuelve (eventos nuevos, nº de duplicados descartados). Los eventos sin event_id pasan siempre."""
+        fresh = []
+        with self._lock:
+            for event in events:
+                event_id = event.get("event_id")
+                if not event_id:
+                    self.stats["without_id"] += 1
+                    fresh.append(event)
+                elif self._admit(self._ids_for(str(event.get("subject_id", ""))), event_id):
+                    fresh.append(event)
+        return fresh, len(events) - len(fresh)
+
+    def filter_ids(self, subject, event_ids):
+        """Variante para un lote de un solo participante: lista de booleanos (True = nuevo)."""
+        keep = []
+        with self._lock:
+            ids = self._ids_for(str(subject))
+            for event_id in event_ids:
+                if not event_id:
+                    self.stats["without_id"] += 1
+                    keep.append(True)
+                else:
+                    keep.append(self._admit(ids, event_id))
+        return keep
+
+    def forget(self, events):
+        """Olvida los IDs de eventos que finalmente no se guardaron (para aceptar su reintento)."""
+        with self._lock:
+            for event in events:
+                event_id = event.get("event_id")
+                ids = self._subjects.get(str(event.get("subject_id", "")))
+                if event_id and ids is not None:
+                    ids.pop(str(event_id), None)
+
+    def forget_ids(self, subject, event_ids):
+        with self._lock:
+            ids = self._subjects.get(str(subject))
+            if ids is not None:
+                for event_id in event_ids:
+                    if event_id:
+                        ids.pop(str(event_id), None)
+
+    def describe(self):
+        with self._lock:
+            return dict(self.stats, subjects=len(self._subjects))
@@ -0,0 +1,260 @@
+# =============================================================
+# Shadow AI — Cola de eventos en memoria, acotada y con spill a disco
+# =============================================================
+# Cola FIFO del modo "local" sin WAL. Cada evento se guarda como un
+# EventRecord con __slots__ (sin el dict por instancia de un objeto normal)
+# y la cola lleva la cuenta aproximada de bytes. Al superar el techo de
+# memoria, los eventos nuevos van a segmentos en disco (SegmentedLog) hasta
+# que el spill se vacía; si el spill también está lleno, put() rechaza y
+# /log devuelve backpressure al cliente en lugar de crecer sin límite.
+#
+# El flush usa peek → escribir → commit: los eventos sólo salen de la cola
+# cuando Sheets confirma la escritura, así que un fallo no re-inserta nada.
+#
+# Con varios workers en modo local todos comparten EVENTS_SPILL_DIR, así que
+# cada proceso escribe en su propio subdirectorio (<pid>-<aleatorio>) y lo
+# marca con un flock sobre owner.lock. Al arrancar, el worker adopta los
+# subdirectorios cuyo lock está libre (su proceso murió) y los entrega antes
+# que su propio spill; los que ya están vacíos se borran.
+
+import os
+import logging
+import threading
+from collections import deque
+from itertools import islice
+
+from wal import SegmentedLog
+
+try:
+    import fcntl
+except ImportError:     # Windows: sin flock, se asume un único proceso
+    fcntl = None
+
+log = logging.getLogger("shadowai.event_queue")
+
+QUEUE_ACCEPTED = "accepted"
+QUEUE_SPILLED  = "spilled"
+QUEUE_REJECTED = "rejected"
+
+
+class QueueFull(Exception):
+    """La cola (memoria y spill) está llena: el cliente debe reintentar más tarde."""
+
+
+_RECORD_OVERHEAD = 200      # bytes aprox. del objeto + referencias, además del texto
+_OWNER_FILE = "owner.lock"
+
+
+def _lock_spill_dir(directory):
+    """flock exclusivo sin esperar sobre <directory>/owner.lock. Devuelve el fd, o None si el
+    directorio es de otro proceso vivo. El sistema operativo suelta el lock si el proceso muere."""
+    if fcntl is None:
+        return -1
+    fd = os.open(os.path.join(directory, _OWNER_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _unlock_spill_dir(fd):
+    if fd is not None and fd != -1:
+        os.close(fd)
+
+
+class EventRecord:
+    """Fila de la hoja "events" (mismo orden que EVENTS_HEADERS) en formato compacto."""
+
+    __slots__ = ("timestamp", "subject_id", "policy", "event", "trial_index",
+                 "time_on_screen_sec", "element_clicked", "payload_json", "nbytes")
+
+    def __init__(self, row):
+        (self.timestamp, self.subject_id, self.policy, self.event, self.trial_index,
+         self.time_on_screen_sec, self.element_clicked, self.payload_json) = (list(row) + [""] * 8)[:8]
+        self.nbytes = _RECORD_OVERHEAD + sum(len(v) for v in (self.timestamp, self.subject_id, self.policy,
+                                                                self.event, self.element_clicked, self.payload_json)
+                                             if isinstance(v, str))
+
+    def to_row(self):
+        return [self.timestamp, self.subject_id, self.policy, self.event, self.trial_index,
+                self.time_on_screen_sec, self.element_clicked, self.payload_json]
+
+
+class BoundedEventQueue:
+    """Cola de filas de eventos con techo de memoria, spill a disco y señal de backpressure."""
+
+    def __init__(self, max_bytes, spill_dir="", spill_max_bytes=0, high_watermark=0.8):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.high_watermark = high_watermark
+        self._lock = threading.Lock()
+        self._records = deque()
+        self._bytes = 0
+        self._spill = None          # SegmentedLog propio (se crea con el primer spill)
+        self._spill_fd = None
+        self._spill_bytes = 0
+        self._orphans = []          # [(SegmentedLog, fd, directorio)] de procesos muertos, por entregar
+        self.stats = {"accepted": 0, "spilled": 0, "rejected": 0, "delivered": 0}
+        # Spill de ejecuciones anteriores: se recupera y se entrega después de la memoria
+        if spill_dir and os.path.isdir(spill_dir):
+            self._adopt_orphans()
+
+    def _adopt_orphans(self):
+        """Adopta los spills sin dueño vivo (también el de versiones que escribían en la raíz)."""
+        candidates = [os.path.join(self.spill_dir, name) for name in sorted(os.listdir(self.spill_dir))]
+        candidates = [d for d in candidates if os.path.isdir(d)]
+        if any(name.endswith(".wal") for name in os.listdir(self.spill_dir)):
+            candidates.insert(0, self.spill_dir)
+        for directory in candidates:
+            fd = _lock_spill_dir(directory)
+            if fd is None:
+                continue        # Spill de otro worker vivo
+            spill = SegmentedLog(directory)
+            if spill.pending():
+                self._orphans.append((spill, fd, directory))
+            else:
+                self._discard(spill, fd, directory)
+        if self._orphans:
+            pending = sum(spill.pending() for spill, _, _ in self._orphans)
+            log.info(f"✅ Spill de eventos en '{self.spill_dir}': {pending} eventos pendientes "
+                     f"de {len(self._orphans)} ejecuciones anteriores")
+
+    def _discard(self, spill, fd, directory):
+        """Borra un spill ya vaciado y suelta su lock."""
+        try:
+            spill.remove_files()
+            if directory != self.spill_dir:
+                os.remove(os.path.join(directory, _OWNER_FILE))
+                os.rmdir(directory)
+        except OSError as e:
+            log.warning(f"⚠️ Spill de eventos: no se pudo borrar '{directory}': {type(e).__name__}: {e}")
+        _unlock_spill_dir(fd)
+
+    def _open_spill(self):
+        """Abre el SegmentedLog de spill de este proceso (llamar con _lock adquirido)."""
+        while self._spill is None:
+            directory = os.path.join(self.spill_dir, f"{os.getpid()}-{os.urandom(4).hex()}")
+            os.makedirs(directory, exist_ok=True)
+            fd = _lock_spill_dir(directory)
+            if fd is None:
+                continue        # Otro worker lo adoptó antes de que lo bloqueáramos: otro nombre
+            self._spill, self._spill_fd, self._spill_bytes = SegmentedLog(directory), fd, 0
+        return self._spill
+
+    def _spilling(self):
+        return self._spill is not None and self._spill.pending() > 0
+
+    def put(self, rows):
+        """Encola filas. Devuelve QUEUE_ACCEPTED, QUEUE_SPILLED o QUEUE_REJECTED (nada encolado)."""
+        records = [EventRecord(row) for row in rows]
+        size = sum(r.nbytes for r in records)
+        with self._lock:
+            # Mientras haya spill pendiente, lo nuevo también va a disco (orden FIFO)
+            if not self._spilling() and self._bytes + size <= self.max_bytes:
+                self._records.extend(records)
+                self._bytes += size
+                self.stats["accepted"] += len(records)
+                return QUEUE_ACCEPTED
+            if not self.spill_dir or self._spill_bytes + size > self.spill_max_bytes:
+                self.stats["rejected"] += len(records)
+                return QUEUE_REJECTED
+            try:
+                self._open_spill().append([r.to_row() for r in records])
+            except OSError as e:
+                log.warning(f"⚠️ Spill de eventos: error escribiendo en '{self.spill_dir}': {type(e).__name__}: {e}")
+                self.stats["rejected"] += len(records)
+                return QUEUE_REJECTED
+            self._spill_bytes += size
+            self.stats["spilled"] += len(records)
+            return QUEUE_SPILLED
+
+    def peek_batch(self, max_rows):
+        """Devuelve (filas, token) con las más antiguas sin sacarlas; commit(token) las retira.
+        Pensado para un único consumidor (flush_events con _flush_lock)."""
+        with self._lock:
+            if self._records:
+                batch = [r.to_row() for r in islice(self._records, max_rows)]
+                return batch, ("memory", len(batch))
+            spill = self._orphans[0][0] if self._orphans else self._spill
+        if spill is None or spill.pending() == 0:
+            return [], None
+        rows, end = spill.read_batch(spill.committed, max_rows)
+        return rows, ("spill", end, len(rows), spill)
+
+    def commit(self, token):
+        """Retira definitivamente el lote devuelto por peek_batch."""
+        if token is None:
+            return
+        if token[0] == "memory":
+            with self._lock:
+                for _ in range(token[1]):
+                    self._bytes -= self._records.popleft().nbytes
+                self.stats["delivered"] += token[1]
+            return
+        spill = token[3]
+        with self._lock:
+            spill.commit(token[1])
+            self.stats["delivered"] += token[2]
+            if spill is self._spill:
+                if spill.pending() == 0:
+                    self._spill_bytes = 0
+            elif spill.pending() == 0 and self._orphans and self._orphans[0][0] is spill:
+                self._discard(*self._orphans.pop(0))
+
+    def oldest(self):
+        """Fila pendiente más antigua (memoria antes que spill) sin retirarla, o None."""
+        with self._lock:
+            if self._records:
+                return self._records[0].to_row()
+            spill = self._orphans[0][0] if self._orphans else self._spill
+        if spill is None or spill.pending() == 0:
+            return None
+        rows, _ = spill.read_batch(spill.committed, 1, remember=False)
+        return rows[0] if rows else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records) + self._spill_pending()
+
+    def _spill_pending(self):
+        """Eventos en disco, propios y adoptados (llamar con _lock adquirido)."""
+        return (sum(spill.pending() for spill, _, _ in self._orphans)
+                + (self._spill.pending() if self._spill is not None else 0))
+
+    def pressure(self):
+        """Ocupación de 0 a 1 (memoria, o disco si ya se está usando el spill)."""
+        with self._lock:
+            if self._spilling() and self.spill_max_bytes > 0:
+                return min(1.0, self._spill_bytes / self.spill_max_bytes)
+            return min(1.0, self._bytes / self.max_bytes) if self.max_bytes > 0 else 1.0
+
+    def backpressure(self):
+        """True cuando conviene que los clientes frenen (por encima de high_watermark)."""
+        with self._lock:
+            spilling = self._spilling()
+        return spilling or self.pressure() >= self.high_watermark
+
+    def describe(self):
+        with self._lock:
+            info = dict(self.stats, memory_events=len(self._records), memory_bytes=self._bytes,
+                        max_bytes=self.max_bytes,
+                        spill_events=self._spill_pending(), spill_bytes=self._spill_bytes,
+                        spill_orphans=len(self._orphans),
+                        spill_dir=self._spill.directory if self._spill is not None else None)
+        info["pressure"] = round(self.pressure(), 3)
+        return info
+
+    def close(self):
+        """Cierra los spills y suelta sus locks (lo pendiente lo adopta el siguiente proceso)."""
+        with self._lock:
+            for spill, fd, _ in self._orphans:
+                spill.close()
+                _unlock_spill_dir(fd)
+            self._orphans = []
+            if self._spill is not None:
+                self._spill.close()
+                _unlock_spill_dir(self._spill_fd)
+                self._spill, self._spill_fd = None, None
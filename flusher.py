@@ -0,0 +1,200 @@
+# =============================================================
+# Shadow AI — Flusher adaptativo de eventos
+# =============================================================
+# Un único hilo de larga vida sustituye al Timer que se re-programaba cada
+# 10 s y a los hilos que /log lanzaba por petición. Las peticiones sólo
+# llaman a notify(); el hilo espera en una Condition y decide cuándo
+# escribir a partir de:
+#
+#   - la tasa de llegada de eventos (EWMA, eventos/s)
+#   - la latencia observada de append_rows (EWMA)
+#   - el presupuesto de escritura que queda en la cuota de Sheets
+#
+# Espera lo suficiente para juntar lotes que no agoten la cuota, nunca menos
+# que un par de latencias de append_rows y nunca más que max_lag. Si el lote
+# objetivo se llena antes, la petición que lo completa despierta al hilo.
+
+import logging
+import threading
+import time as _time
+
+log = logging.getLogger("shadowai.flusher")
+
+_EWMA_ALPHA = 0.2
+
+
+class AdaptiveFlusher:
+    """Hilo flusher con decisiones de lote y espera adaptativas."""
+
+    def __init__(self, flush_fn, pending_fn, budget_fn, min_interval=0.5, max_lag=10.0,
+                 max_batch=500, quota_share=0.5, max_backoff=120.0):
+        self._flush = flush_fn          # (max_rows) → True si el lote se escribió
+        self._pending = pending_fn      # () → eventos pendientes
+        self._budget = budget_fn        # () → SheetsQuotaGovernor.budget()
+        self.min_interval = min_interval
+        self.max_lag = max_lag
+        self.max_batch = max_batch
+        self.quota_share = quota_share  # Fracción de la cuota de escritura que pueden usar los eventos
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._arrivals = 0              # Eventos notificados desde la última muestra de tasa
+        self._arrivals_total = 0
+        self._rate_sampled_at = _time.monotonic()
+        self._rate = 0.0                # eventos/s (EWMA)
+        self._append_latency = None     # segundos por append_rows (EWMA)
+        self._first_pending_at = None   # Llegada del evento pendiente más antiguo (aprox.)
+        self._target_batch = 1
+        self._reason = "adaptive"       # Durante backoff o cooldown, las llegadas no despiertan al hilo
+        self._failures = 0
+        self._urgent = False
+        self._thread = None
+        self.stats = {"flushes": 0, "failures": 0, "wakeups_size": 0, "wakeups_timer": 0,
+                      "wakeups_forced": 0, "skipped_cooldown": 0}
+        self.last_decision = {}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-flusher", daemon=True)
+            self._thread.start()
+
+    # ── Señales desde las peticiones ──
+    def notify(self, count, pending=None):
+        """Llamar tras encolar `count` eventos. Despierta al hilo si el lote objetivo está lleno."""
+        with self._cond:
+            self._arrivals += count
+            self._arrivals_total += count
+            if self._first_pending_at is None:
+                self._first_pending_at = _time.monotonic()
+            if self._reason == "adaptive" and pending is not None and pending >= self._target_batch:
+                self._cond.notify()
+
+    def flush_now(self):
+        """Pide un flush inmediato (p. ej. tras un reinicio con eventos pendientes)."""
+        with self._cond:
+            self._urgent = True
+            self._cond.notify()
+
+    def record_append(self, seconds):
+        """Latencia observada de una llamada append_rows (la reporta _append_event_rows)."""
+        with self._cond:
+            if self._append_latency is None:
+                self._append_latency = seconds
+            else:
+                self._append_latency += _EWMA_ALPHA * (seconds - self._append_latency)
+
+    # ── Decisión ──
+    def _update_rate(self, now):
+        """Actualiza la EWMA de la tasa de llegada (llamar con _cond adquirido)."""
+        elapsed = now - self._rate_sampled_at
+        if elapsed >= 0.5:
+            sample = self._arrivals / elapsed
+            self._rate += _EWMA_ALPHA * (sample - self._rate)
+            self._arrivals = 0
+            self._rate_sampled_at = now
+
+    def _decide(self, now):
+        """Calcula (lote objetivo, espera en segundos). Llamar con _cond adquirido."""
+        self._update_rate(now)
+        budget = self._budget()
+        if budget.get("cooldown_sec", 0) > 0:
+            return self._target_batch, budget["cooldown_sec"], "cooldown"
+
+        if self._failures:
+            wait = min(self.max_backoff, self.min_interval * (2 ** self._failures))
+            return self._target_batch, max(wait, 1.0), "backoff"
+
+        # Intervalo mínimo entre escrituras para no gastar más de quota_share de la cuota;
+        # con poco presupuesto restante se espacian más (lotes más grandes)
+        writes_per_sec = budget.get("write_per_min", 60.0) / 60.0 * self.quota_share
+        fraction = max(budget.get("write_fraction", 1.0), 0.1)
+        quota_interval = 1.0 / max(writes_per_sec * fraction, 1e-6)
+        latency_interval = 2.0 * (self._append_latency or 0.0)
+        wait = min(self.max_lag, max(self.min_interval, quota_interval, latency_interval))
+        target = int(min(self.max_batch, max(1, round(self._rate * wait))))
+        return target, wait, "adaptive"
+
+    def _lag(self, now):
+        return round(now - self._first_pending_at, 3) if self._first_pending_at is not None else 0.0
+
+    # ── Hilo ──
+    def _run(self):
+        last_flush = 0.0
+        while True:
+            with self._cond:
+                now = _time.monotonic()
+                target, wait, reason = self._decide(now)
+                self._target_batch, self._reason = target, reason
+                if self._urgent:
+                    self._urgent = False
+                    self.stats["wakeups_forced"] += 1
+                else:
+                    # Respetar la espera máxima desde el evento más antiguo (max_lag)
+                    if self._first_pending_at is not None and reason == "adaptive":
+                        wait = min(wait, max(0.0, self._first_pending_at + self.max_lag - now))
+                    # Si el lote objetivo ya se llenó durante el flush anterior, no esperar entero
+                    woke = (reason == "adaptive" and self._pending() >= target) or self._cond.wait(timeout=wait)
+                    if self._urgent:
+                        self._urgent = False
+                        self.stats["wakeups_forced"] += 1
+                    elif woke:
+                        # Lote lleno antes de tiempo: respetar el intervalo mínimo entre flushes
+                        self.stats["wakeups_size"] += 1
+                        gap = self.min_interval - (_time.monotonic() - last_flush)
+                        if gap > 0:
+                            self._cond.wait(timeout=gap)
+                    else:
+                        self.stats["wakeups_timer"] += 1
+
+            pending = self._pending()
+            if pending == 0:
+                with self._cond:
+                    self._first_pending_at = None
+                continue
+            if self._budget().get("cooldown_sec", 0) > 0:
+                self.stats["skipped_cooldown"] += 1
+                continue
+
+            # Sólo lo pendiente al decidir: lo que llegue durante el flush espera al siguiente ciclo
+            with self._cond:
+                arrivals_before = self._arrivals_total
+            started = _time.monotonic()
+            try:
+                ok = self._flush(pending)
+            except Exception as e:
+                log.warning(f"⚠️ flusher: error inesperado: {type(e).__name__}: {e}")
+                ok = False
+            last_flush = _time.monotonic()
+            remaining = self._pending()
+
+            with self._cond:
+                arrived = self._arrivals_total - arrivals_before
+                self.stats["flushes"] += 1
+                if ok:
+                    self._failures = 0
+                else:
+                    self._failures += 1
+                    self.stats["failures"] += 1
+                self.last_decision = {
+                    "reason": reason,
+                    "target_batch": target,
+                    "wait_sec": round(wait, 3),
+                    "flushed": max(0, pending + arrived - remaining),
+                    "lag_sec": self._lag(started),
+                    "flush_ms": round((last_flush - started) * 1000, 1),
+                    "ok": ok,
+                }
+                if remaining == 0:
+                    self._first_pending_at = None
+                elif ok:
+                    # Lo que queda llegó durante el flush: su espera empieza ahora
+                    self._first_pending_at = last_flush
+
+    def describe(self):
+        with self._cond:
+            return dict(self.stats,
+                        arrival_rate=round(self._rate, 3),
+                        append_latency_ms=round(self._append_latency * 1000, 1) if self._append_latency is not None else None,
+                        target_batch=self._target_batch,
+                        consecutive_failures=self._failures,
+                        lag_sec=self._lag(_time.monotonic()),
+                        last_decision=dict(self.last_decision))
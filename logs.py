@@ -0,0 +1,199 @@
+# =============================================================
+# Shadow AI — Logging estructurado sin bloquear el hot path
+# =============================================================
+# Los print() a stdout escriben de forma síncrona en el hilo de la petición:
+# con stdout lento (pipe lleno, agregador de logs) cada /log esperaba al
+# terminal. Aquí el hilo que loguea sólo encola el registro (put_nowait en una
+# cola acotada) y un QueueListener lo formatea y lo escribe en su propio hilo.
+# Si la cola está llena el registro se descarta y se cuenta: perder una línea
+# de log es preferible a frenar la ingesta.
+#
+# - LOG_FORMAT=text (por defecto) o json (un objeto por línea, con los campos
+#   extra de fields(...) como claves de primer nivel).
+# - Cada registro lleva el request_id de la petición en curso (ContextVar,
+#   fijado por app.py desde X-Request-ID o generado).
+# - WARNING y superiores se limitan por sitio de llamada: como mucho
+#   error_burst registros por ventana; al reabrirse la ventana se informa de
+#   cuántos se suprimieron. Así una caída de Sheets no genera miles de líneas.
+# - Sampler(n) deja pasar 1 de cada n llamadas, para líneas por evento.
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
+import time as _time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = "shadowai"
+
+request_id = ContextVar("request_id", default="-")
+
+_REQUEST_ID_MAX = 64
+_REQUEST_ID_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.:")
+
+_handler = None
+_listener = None
+
+
+def fields(**kwargs):
+    """extra= para adjuntar campos estructurados: log.info("msg", extra=fields(subject=...))."""
+    return {"fields": kwargs}
+
+
+def new_request_id(incoming=None):
+    """Usa el X-Request-ID del cliente si es razonable; si no, genera uno."""
+    if incoming and len(incoming) <= _REQUEST_ID_MAX and set(incoming) <= _REQUEST_ID_CHARS:
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+class Sampler:
+    """Devuelve True 1 de cada `every` llamadas (la primera incluida). every <= 1 → siempre."""
+
+    def __init__(self, every):
+        self.every = max(1, int(every))
+        self._counter = itertools.count()   # next() es atómico bajo el GIL
+
+    def __call__(self):
+        return self.every == 1 or next(self._counter) % self.every == 0
+
+
+class _ContextFilter(logging.Filter):
+    """Copia el request_id del hilo/tarea que loguea (antes de pasar a la cola)."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class _RateLimitFilter(logging.Filter):
+    """Como mucho `burst` registros WARNING+ por sitio de llamada y ventana."""
+
+    def __init__(self, burst, window):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.suppressed_total = 0
+        self._lock = threading.Lock()
+        self._sites = {}    # (pathname, lineno) → [inicio de ventana, emitidos, suprimidos]
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = _time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site is not None else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            self.suppressed_total += 1
+            return False
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler que nunca bloquea: si la cola está llena descarta y cuenta."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Se resuelven los %-args aquí (los objetos pueden cambiar después) pero el
+        # formateo completo (fecha, JSON) se hace en el hilo del listener
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Al parar se espera hueco (la cola puede estar llena justo al salir)
+        self.queue.put(self._sentinel, timeout=5)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _timestamp(record):
+    return datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{_timestamp(record)} {record.levelname:<7} [{getattr(record, 'request_id', '-')}] {record.message}"
+        extra = dict(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            extra["suppressed"] = record.suppressed
+        if extra:
+            line += " " + " ".join(f"{k}={v}" for k, v in extra.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": _timestamp(record), "level": record.levelname, "logger": record.name,
+                 "request_id": getattr(record, "request_id", "-"), "msg": record.message}
+        entry.update(getattr(record, "fields", None) or {})
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", fmt="text", queue_size=10000, error_burst=5, error_window=60.0, stream=None):
+    """Configura el logger "shadowai" (y sus hijos: shadowai.wal, …). Idempotente."""
+    global _handler, _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    if _handler is not None:
+        return logger
+
+    log_queue = queue.Queue(maxsize=max(1, queue_size))
+    _handler = _DroppingQueueHandler(log_queue)
+    _handler.addFilter(_ContextFilter())
+    _handler.addFilter(_RateLimitFilter(error_burst, error_window))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _listener = _Listener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)     # Vacía la cola al salir
+
+    logger.addHandler(_handler)
+    logger.propagate = False            # No duplicar en los handlers de gunicorn/werkzeug
+    return logger
+
+
+def logging_stats():
+    if _handler is None:
+        return None
+    rate_limit = next(f for f in _handler.filters if isinstance(f, _RateLimitFilter))
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped,
+            "suppressed": rate_limit.suppressed_total, "level": logging.getLevelName(logging.getLogger(LOGGER_NAME).level)}
@@ -0,0 +1,224 @@
+# =============================================================
+# Shadow AI — Métricas en formato de texto de Prometheus (/metrics)
+# =============================================================
+# Contadores e histogramas con un shard por hilo: cada hilo suma en su
+# propio dict sin tomar ningún lock (sólo la primera vez que un hilo toca una
+# métrica se registra su shard). /metrics suma los shards al exportar; los de
+# hilos que ya terminaron se funden en un acumulado para que la lista no crezca
+# con servidores que crean un hilo por petición.
+#
+# Los gauges no se actualizan en el hot path: son funciones que se evalúan en
+# cada scrape (profundidad de cola, edad del evento más antiguo, …).
+#
+# Con varios workers de gunicorn cada proceso tiene su propio registro y el
+# scrape ve el del worker que atiende la petición.
+
+import math
+import logging
+import threading
+from bisect import bisect_left
+
+log = logging.getLogger("shadowai.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS    = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_MAX_LIVE_SHARDS = 256      # A partir de aquí se funden los shards de hilos muertos al registrar uno nuevo
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _sorted(values):
+    return sorted(values.items(), key=lambda item: tuple(str(v) for v in item[0]))
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _PerThread:
+    """Valores por hilo: el hilo escribe sólo en su dict; export() los combina."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()       # Sólo para registrar shards y exportar
+        self._shards = []                   # (hilo, dict)
+        self._retired = {}                  # Acumulado de hilos terminados
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > _MAX_LIVE_SHARDS:
+                    self._retire_dead()
+        return shard
+
+    def _retire_dead(self):
+        """Funde en _retired los shards de hilos terminados (llamar con _lock adquirido)."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._merge(self._retired, key, value)
+        self._shards = alive
+
+    def _merge(self, into, key, value):
+        raise NotImplementedError
+
+    def _snapshot(self, value):
+        return value
+
+    def export(self):
+        """{etiquetas: valor} sumando todos los hilos."""
+        with self._lock:
+            self._retire_dead()
+            total = {key: self._snapshot(value) for key, value in self._retired.items()}
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            # dict(shard) es atómico bajo el GIL; el hilo dueño puede seguir escribiendo
+            for key, value in dict(shard).items():
+                self._merge(total, key, self._snapshot(value))
+        return total
+
+
+class Counter(_PerThread):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__()
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+
+    def inc(self, *label_values, amount=1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def _merge(self, into, key, value):
+        into[key] = into.get(key, 0) + value
+
+    def render(self):
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+                for key, value in _sorted(self.export())]
+
+
+class Histogram(_PerThread):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        shard = self._shard()
+        entry = shard.get(label_values)
+        if entry is None:
+            # [cuenta por bucket (no acumulada)…, +Inf, suma, total]
+            entry = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _merge(self, into, key, value):
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value)
+        else:
+            into[key] = [a + b for a, b in zip(current, value)]
+
+    def render(self):
+        lines = []
+        for key, entry in _sorted(self.export()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', _number(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(entry[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {entry[-1]}")
+        return lines
+
+
+class Gauge:
+    """Valor calculado en cada scrape: fn() devuelve un número o {etiquetas: número}."""
+
+    def __init__(self, name, help_text, fn, labels=(), kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label_names = tuple(labels)
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(v)}"
+                for key, v in _sorted(value) if v is not None]
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+        self.errors = 0
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self.prefix + name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, fn, labels=()):
+        return self._add(Gauge(self.prefix + name, help_text, fn, labels))
+
+    def counter_from(self, name, help_text, fn, labels=()):
+        """Contador que ya lleva otro objeto (p. ej. los stats de un bulkhead), leído en cada scrape."""
+        return self._add(Gauge(self.prefix + name, help_text, fn, labels, kind="counter"))
+
+    def render(self):
+        """Texto de exposición de Prometheus (version=0.0.4)."""
+        out = []
+        for metric in self._metrics:
+            try:
+                lines = metric.render()
+            except Exception as e:
+                # Un gauge que falla (p. ej. la cola compartida bloqueada) no tumba el scrape
+                self.errors += 1
+                log.warning(f"⚠️ /metrics: error calculando {metric.name}: {type(e).__name__}: {e}")
+                continue
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
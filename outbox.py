@@ -0,0 +1,166 @@
+# =============================================================
+# Shadow AI — Outbox persistente para /finalize
+# =============================================================
+# /finalize guarda la fila de resultados en esta outbox (SQLite, clave =
+# subject_id) y responde al instante; un hilo de entrega la lleva después a la
+# hoja "results". Como la clave es el subject_id, los reintentos del cliente
+# (fetchWithRetry) no crean filas duplicadas: si la fila aún no se ha
+# entregado se actualiza, y si ya se entregó se ignora.
+
+import os
+import json
+import sqlite3
+import threading
+import time as _time
+
+OUTBOX_QUEUED    = "queued"
+OUTBOX_UPDATED   = "updated"
+OUTBOX_DUPLICATE = "duplicate"
+
+
+class ResultsOutbox:
+    """Outbox idempotente por clave, segura entre hilos y procesos."""
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " key TEXT PRIMARY KEY,"
+                " row TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " delivered_at REAL,"
+                " last_error TEXT)"
+            )
+            self._connection().execute(
+                "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (delivered_at, created_at)"
+            )
+            # Outbox creada antes de los leases
+            columns = {row[1] for row in self._connection().execute("PRAGMA table_info(outbox)")}
+            if "claimed_by" not in columns:
+                self._connection().execute("ALTER TABLE outbox ADD COLUMN claimed_by TEXT")
+            if "lease_until" not in columns:
+                self._connection().execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+            if "attempted_at" not in columns:
+                self._connection().execute("ALTER TABLE outbox ADD COLUMN attempted_at REAL")
+
+    def _connection(self):
+        """Conexión del proceso actual (se reabre tras un fork). Llamar con _lock adquirido."""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=self.busy_timeout_ms / 1000.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def put(self, key, row):
+        """Guarda la fila de `key`. Devuelve OUTBOX_QUEUED, OUTBOX_UPDATED u OUTBOX_DUPLICATE."""
+        payload = json.dumps(row, ensure_ascii=False)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = conn.execute("SELECT delivered_at FROM outbox WHERE key = ?", (key,)).fetchone()
+                if existing is None:
+                    conn.execute("INSERT INTO outbox (key, row, created_at) VALUES (?, ?, ?)",
+                                 (key, payload, _time.time()))
+                    outcome = OUTBOX_QUEUED
+                elif existing[0] is None:
+                    conn.execute("UPDATE outbox SET row = ? WHERE key = ?", (payload, key))
+                    outcome = OUTBOX_UPDATED
+                else:
+                    outcome = OUTBOX_DUPLICATE
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return outcome
+
+    def pending(self, limit):
+        """Filas no entregadas, más antiguas primero: [(key, row, attempts)]."""
+        with self._lock:
+            items = self._connection().execute(
+                "SELECT key, row, attempts FROM outbox WHERE delivered_at IS NULL "
+                "ORDER BY created_at LIMIT ?", (limit,)
+            ).fetchall()
+        return [(key, json.loads(row), attempts) for key, row, attempts in items]
+
+    def claim(self, limit, owner, lease_sec):
+        """Reserva hasta `limit` filas no entregadas y sin lease vigente para `owner` durante
+        lease_sec (atómico entre procesos). Devuelve [(key, row, attempts)], más antiguas primero."""
+        now = _time.time()
+        with self._lock:
+            conn = self._connection()
+            # Casi siempre no hay nada: comprobarlo sin abrir una transacción de escritura (fsync)
+            if conn.execute("SELECT 1 FROM outbox WHERE delivered_at IS NULL "
+                            "AND (lease_until IS NULL OR lease_until < ?) LIMIT 1", (now,)).fetchone() is None:
+                return []
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                items = conn.execute(
+                    "SELECT key, row, attempts FROM outbox WHERE delivered_at IS NULL "
+                    "AND (lease_until IS NULL OR lease_until < ?) ORDER BY created_at LIMIT ?", (now, limit)
+                ).fetchall()
+                conn.executemany("UPDATE outbox SET claimed_by = ?, lease_until = ? WHERE key = ?",
+                                 [(owner, now + lease_sec, key) for key, _, _ in items])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [(key, json.loads(row), attempts) for key, row, attempts in items]
+
+    def release(self, keys):
+        """Devuelve filas reservadas sin enviarlas (otro ciclo, o proceso, las puede reclamar)."""
+        with self._lock:
+            self._connection().executemany(
+                "UPDATE outbox SET claimed_by = NULL, lease_until = NULL WHERE key = ?", [(k,) for k in keys])
+
+    def mark_attempt(self, keys):
+        """Registra un intento ANTES de escribir: si el proceso muere a mitad, el siguiente
+        intento sabe que debe comprobar si la fila ya llegó al destino."""
+        now = _time.time()
+        with self._lock:
+            self._connection().executemany(
+                "UPDATE outbox SET attempts = attempts + 1, attempted_at = ? WHERE key = ?",
+                [(now, k) for k in keys])
+
+    def last_attempt(self, keys):
+        """Hora (time.time()) del intento más reciente de cualquiera de `keys`, de cualquier proceso; 0 si ninguno."""
+        if not keys:
+            return 0.0
+        keys = list(keys)
+        with self._lock:
+            latest, = self._connection().execute(
+                f"SELECT MAX(attempted_at) FROM outbox WHERE key IN ({','.join('?' * len(keys))})", keys).fetchone()
+        return latest or 0.0
+
+    def mark_delivered(self, keys):
+        now = _time.time()
+        with self._lock:
+            self._connection().executemany(
+                "UPDATE outbox SET delivered_at = ?, last_error = NULL, claimed_by = NULL, lease_until = NULL "
+                "WHERE key = ?", [(now, k) for k in keys])
+
+    def record_error(self, keys, error):
+        with self._lock:
+            self._connection().executemany(
+                "UPDATE outbox SET last_error = ?, claimed_by = NULL, lease_until = NULL WHERE key = ?",
+                [(str(error)[:500], k) for k in keys])
+
+    def stats(self):
+        with self._lock:
+            pending, delivered, oldest = self._connection().execute(
+                "SELECT SUM(delivered_at IS NULL), SUM(delivered_at IS NOT NULL), "
+                "MIN(CASE WHEN delivered_at IS NULL THEN created_at END) FROM outbox"
+            ).fetchone()
+        return {"pending": pending or 0, "delivered": delivered or 0,
+                "oldest_pending_age_sec": round(_time.time() - oldest, 1) if oldest else None}
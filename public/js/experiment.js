@@ -47,9 +47,12 @@
   let flushTimer = null;
   const FLUSH_INTERVAL = 5000;  // Enviar cada 5 segundos
   const FLUSH_SIZE = 10;        // O cuando haya 10+ eventos
+  let eventSeq = 0;             // event_id = subject_id + secuencia → el servidor descarta reenvíos
+  const GZIP_MIN_BYTES = 1024;  // Lotes más pequeños no compensan comprimir
+  let gzipBatches = typeof CompressionStream !== 'undefined';
 
   function queueEvent(event, payload={}) {
-    eventBuffer.push({ subject_id, event, payload, ts: nowIso(), policy: assignedPolicy.key });
+    eventBuffer.push({ seq: ++eventSeq, t: Date.now(), event, payload });
     // Flush inmediato si hay suficientes eventos
     if (eventBuffer.length >= FLUSH_SIZE) {
       flushEventBuffer();
@@ -58,18 +61,44 @@
     }
   }
 
+  // Formato compacto v2: subject_id, policy y t0 una sola vez; cada evento es
+  // [seq, ms desde t0, evento, payload] (payload omitido si está vacío)
+  function encodeBatch(batch) {
+    const t0 = batch[0].t;
+    return JSON.stringify({
+      v: 2, subject_id, policy: assignedPolicy.key, t0,
+      events: batch.map(e => {
+        const item = [e.seq, e.t - t0, e.event];
+        if (e.payload && Object.keys(e.payload).length > 0) item.push(e.payload);
+        return item;
+      })
+    });
+  }
+
+  async function gzipText(text) {
+    const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+    return await new Response(stream).arrayBuffer();
+  }
+
   async function flushEventBuffer() {
     if (flushTimer) { clearTimeout(flushTimer); flushTimer = null; }
     if (eventBuffer.length === 0) return;
 
     const batch = eventBuffer.splice(0);  // Vaciar buffer
+    let compressed = false;
     try {
-      const response = await fetch('/log-batch', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ events: batch })
-      });
+      const json = encodeBatch(batch);
+      const headers = { 'Content-Type': 'application/json' };
+      let body = json;
+      if (gzipBatches && json.length >= GZIP_MIN_BYTES) {
+        body = await gzipText(json);
+        headers['Content-Encoding'] = 'gzip';
+        compressed = true;
+      }
+      const response = await fetch('/log-batch', { method: 'POST', headers, body });
       if (!response.ok) {
+        // Si el servidor no acepta el cuerpo comprimido, seguir sin comprimir
+        if (compressed && (response.status === 400 || response.status === 415)) gzipBatches = false;
         console.warn(`⚠️ Batch log failed (${response.status}), reintentando en ${FLUSH_INTERVAL/1000}s`);
         // Re-encolar eventos que fallaron y programar reintento
         eventBuffer.unshift(...batch);
@@ -86,8 +115,8 @@
   window.addEventListener('beforeunload', () => {
     if (eventBuffer.length > 0) {
       const batch = eventBuffer.splice(0);
-      // sendBeacon es más fiable que fetch al cerrar página
-      const blob = new Blob([JSON.stringify({ events: batch })], { type: 'application/json' });
+      // sendBeacon es más fiable que fetch al cerrar página (no admite Content-Encoding: va sin comprimir)
+      const blob = new Blob([encodeBatch(batch)], { type: 'application/json' });
       navigator.sendBeacon('/log-batch', blob);
     }
   });
@@ -115,6 +144,127 @@
     }
   }
 
+  // ====== Sugerencias de IA ======
+  // Intenta /ai-suggest/stream (SSE) y llama a onToken con cada fragmento según llega.
+  // Si el navegador no soporta streams o el endpoint no existe, usa /ai-suggest (JSON).
+  async function fetchAISuggestion(body, onToken) {
+    let response = null;
+    try {
+      response = await fetch('/ai-suggest/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body
+      });
+    } catch (e) {
+      console.warn('⚠️ Streaming de IA no disponible, usando /ai-suggest:', e.message);
+    }
+
+    const contentType = response ? (response.headers.get('Content-Type') || '') : '';
+    if (!response || response.status === 404 || response.status === 405 ||
+        (response.ok && (!response.body || !contentType.includes('text/event-stream')))) {
+      return fetchAISuggestionJSON(body);
+    }
+
+    if (!response.ok) {
+      let errorMessage = 'Error al obtener sugerencia';
+      try {
+        const errorData = await response.json();
+        if (errorData && errorData.error) {
+          errorMessage = errorData.error;
+        }
+      } catch (e) {
+        // Si no se puede parsear el error, usar mensaje genérico
+      }
+      throw new Error(errorMessage);
+    }
+
+    // Parsear eventos SSE: bloques separados por línea en blanco con líneas "data: {...}"
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let suggestion = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const dataText = rawEvent.split('\n')
+          .filter(line => line.startsWith('data:'))
+          .map(line => line.slice(5).trim())
+          .join('\n');
+        if (!dataText) continue;
+        let msg;
+        try {
+          msg = JSON.parse(dataText);
+        } catch (e) {
+          continue;
+        }
+        if (msg.error) throw new Error(msg.error);
+        if (typeof msg.token === 'string') {
+          suggestion += msg.token;
+          onToken(msg.token);
+        }
+        if (msg.done) {
+          return typeof msg.suggestion === 'string' ? msg.suggestion : suggestion;
+        }
+      }
+    }
+    return suggestion;
+  }
+
+  // Versión sin streaming (respuesta JSON completa)
+  async function fetchAISuggestionJSON(body) {
+    const response = await fetch('/ai-suggest', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body
+    });
+
+    // Validar código de respuesta
+    if (!response.ok) {
+      let errorMessage = 'Error al obtener sugerencia';
+      try {
+        const errorData = await response.json();
+        if (errorData && errorData.error) {
+          errorMessage = errorData.error;
+        }
+      } catch (e) {
+        // Si no se puede parsear el error, usar mensaje genérico
+      }
+      throw new Error(errorMessage);
+    }
+
+    // Parsear JSON con validación
+    let result;
+    try {
+      result = await response.json();
+    } catch (e) {
+      console.error('Error parseando JSON de respuesta:', e);
+      throw new Error('Respuesta inválida del servidor');
+    }
+
+    // Validar estructura de respuesta
+    if (!result || typeof result !== 'object') {
+      console.error('Respuesta no es un objeto:', result);
+      throw new Error('Respuesta inválida del servidor');
+    }
+
+    if (!result.ok) {
+      const errorMessage = result.error || 'Error desconocido';
+      throw new Error(errorMessage);
+    }
+
+    if (!result.suggestion || typeof result.suggestion !== 'string') {
+      console.error('Respuesta sin sugerencia válida:', result);
+      throw new Error('El servidor no devolvió una sugerencia válida');
+    }
+
+    return result.suggestion;
+  }
+
   // Arranca contador de inactividad (inactividad >2s suma)
   function startIdleWatch(){
     stopIdleWatch(); // Limpia siempre listeners y timer previos antes de añadir nuevos
@@ -437,69 +587,38 @@
           sendLog('ai_help_open', { has_selection: selection.length > 0 }).catch(() => {});
 
           try {
-            const response = await fetch('/ai-suggest', {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({
+            // Chip que se rellena token a token mientras llega la respuesta (SSE)
+            panel.innerHTML = `
+              <div style="display:flex; flex-direction:column; gap:8px; width:100%;">
+                <p class="muted" style="margin:0; font-size:0.9em;">Haz clic para insertar:</p>
+                <button class="chip ai-chip" type="button" style="text-align:left; white-space:normal;" disabled></button>
+              </div>
+            `;
+            const chip = panel.querySelector('.ai-chip');
+            let streamed = '';
+
+            const rawSuggestion = await fetchAISuggestion(
+              JSON.stringify({
                 text: text,
                 selection: selection,
                 policy: assignedPolicy.key
-              })
-            });
-
-            // Validar código de respuesta
-            if (!response.ok) {
-              let errorMessage = 'Error al obtener sugerencia';
-              try {
-                const errorData = await response.json();
-                if (errorData && errorData.error) {
-                  errorMessage = errorData.error;
-                }
-              } catch (e) {
-                // Si no se puede parsear el error, usar mensaje genérico
+              }),
+              (token) => {
+                streamed += token;
+                chip.textContent = streamed;  // textContent evita XSS
+                panel.classList.remove('hidden');
               }
-              throw new Error(errorMessage);
-            }
+            );
 
-            // Parsear JSON con validación
-            let result;
-            try {
-              result = await response.json();
-            } catch (e) {
-              console.error('Error parseando JSON de respuesta:', e);
-              throw new Error('Respuesta inválida del servidor');
-            }
-
-            // Validar estructura de respuesta
-            if (!result || typeof result !== 'object') {
-              console.error('Respuesta no es un objeto:', result);
-              throw new Error('Respuesta inválida del servidor');
-            }
-
-            if (!result.ok) {
-              const errorMessage = result.error || 'Error desconocido';
-              throw new Error(errorMessage);
-            }
-
-            if (!result.suggestion || typeof result.suggestion !== 'string') {
-              console.error('Respuesta sin sugerencia válida:', result);
-              throw new Error('El servidor no devolvió una sugerencia válida');
-            }
-
-            const suggestion = result.suggestion.trim();
+            const suggestion = rawSuggestion.trim();
 
             if (!suggestion) {
               throw new Error('La sugerencia está vacía');
             }
 
-            // Mostrar sugerencia como botón clickeable (textContent evita XSS)
-            panel.innerHTML = `
-              <div style="display:flex; flex-direction:column; gap:8px; width:100%;">
-                <p class="muted" style="margin:0; font-size:0.9em;">Haz clic para insertar:</p>
-                <button class="chip ai-chip" type="button" style="text-align:left; white-space:normal;"></button>
-              </div>
-            `;
-            panel.querySelector('.ai-chip').textContent = suggestion;
+            // Mostrar sugerencia definitiva como botón clickeable
+            chip.textContent = suggestion;
+            chip.disabled = false;
             panel.classList.remove('hidden');
 
             // Al hacer click, insertar la sugerencia
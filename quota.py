@@ -0,0 +1,169 @@
+# =============================================================
+# Shadow AI — Gobernador de cuota para la API de Google Sheets
+# =============================================================
+# Todas las llamadas a gspread pasan por un único SheetsQuotaGovernor:
+#   • Dos token buckets (lecturas y escrituras) con la cuota por minuto.
+#   • Prioridades: las llamadas de prioridad baja (flush de eventos) no pueden
+#     gastar la reserva, que queda para /finalize (prioridad alta).
+#   • Ante un 429 se activa un cooldown global con backoff exponencial y
+#     jitter, y la tasa se reduce a la mitad; se recupera poco a poco con cada
+#     llamada exitosa (AIMD).
+#   • budget() expone el presupuesto restante para que el flush agrande los
+#     lotes en lugar de hacer más llamadas.
+
+import random
+import logging
+import threading
+import time as _time
+
+log = logging.getLogger("shadowai.quota")
+
+PRIORITY_HIGH   = 0     # /finalize
+PRIORITY_NORMAL = 1     # lecturas de metadatos, /health
+PRIORITY_LOW    = 2     # flush de eventos
+
+
+class QuotaExhausted(Exception):
+    """No se obtuvo cuota de Sheets dentro del tiempo máximo de espera."""
+
+
+def api_error_status(e):
+    """Código HTTP de un gspread APIError (o None si no se puede determinar)."""
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+
+class TokenBucket:
+    """Token bucket clásico; la tasa se puede escalar en caliente (rate_factor)."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.per_minute = float(per_minute)
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self.tokens = self.capacity
+        self.rate_factor = 1.0
+        self._last = _time.monotonic()
+
+    @property
+    def rate_per_sec(self):
+        return self.per_minute * self.rate_factor / 60.0
+
+    def refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_sec)
+
+    def take(self, reserve=0.0):
+        """Consume un token si quedan más de `reserve`. Devuelve los segundos a esperar (0 = concedido)."""
+        if self.tokens - 1.0 >= reserve:
+            self.tokens -= 1.0
+            return 0.0
+        missing = reserve + 1.0 - self.tokens
+        return missing / max(self.rate_per_sec, 1e-6)
+
+
+class SheetsQuotaGovernor:
+    """Gobernador de cuota compartido por todo el proceso."""
+
+    def __init__(self, read_per_min=60, write_per_min=60, reserve_fraction=0.1,
+                 backoff_base=2.0, backoff_max=64.0, max_wait=20.0):
+        self._lock = threading.Lock()
+        self._buckets = {"read": TokenBucket(read_per_min), "write": TokenBucket(write_per_min)}
+        self.reserve_fraction = reserve_fraction
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self._cooldown_until = 0.0
+        self._consecutive_429 = 0
+        self.stats = {"calls": 0, "rate_limited": 0, "waits": 0, "wait_seconds": 0.0, "rejected": 0}
+
+    def _reserve_for(self, bucket, priority):
+        if priority == PRIORITY_HIGH:
+            return 0.0
+        if priority == PRIORITY_NORMAL:
+            return bucket.capacity * self.reserve_fraction / 2
+        return bucket.capacity * self.reserve_fraction
+
+    def acquire(self, kind, priority=PRIORITY_NORMAL, timeout=None):
+        """Bloquea hasta obtener un token de `kind` ("read"/"write"). Lanza QuotaExhausted si se agota el tiempo."""
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = _time.monotonic() + timeout
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = _time.monotonic()
+                bucket = self._buckets[kind]
+                bucket.refill(now)
+                wait = max(0.0, self._cooldown_until - now)
+                if wait == 0.0:
+                    wait = bucket.take(self._reserve_for(bucket, priority))
+                    if wait == 0.0:
+                        self.stats["calls"] += 1
+                        if waited:
+                            self.stats["waits"] += 1
+                            self.stats["wait_seconds"] += waited
+                        return
+                if now + wait > deadline:
+                    self.stats["rejected"] += 1
+                    raise QuotaExhausted(f"cuota de Sheets ({kind}) agotada, espera estimada {wait:.1f}s")
+            # Pequeño jitter para que los hilos que esperan no despierten todos a la vez
+            sleep_for = min(wait, max(0.0, deadline - _time.monotonic())) + random.uniform(0, 0.05)
+            _time.sleep(sleep_for)
+            waited += sleep_for
+
+    def report_success(self):
+        """Tras una llamada exitosa: recupera la tasa poco a poco (incremento aditivo)."""
+        with self._lock:
+            self._consecutive_429 = 0
+            for bucket in self._buckets.values():
+                if bucket.rate_factor < 1.0:
+                    bucket.rate_factor = min(1.0, bucket.rate_factor + 0.05)
+
+    def report_rate_limited(self):
+        """Tras un 429: cooldown global con backoff exponencial + jitter y tasa reducida a la mitad."""
+        with self._lock:
+            self._consecutive_429 += 1
+            self.stats["rate_limited"] += 1
+            backoff = min(self.backoff_max, self.backoff_base * (2 ** (self._consecutive_429 - 1)))
+            backoff = random.uniform(backoff / 2, backoff)
+            self._cooldown_until = max(self._cooldown_until, _time.monotonic() + backoff)
+            for bucket in self._buckets.values():
+                bucket.rate_factor = max(0.1, bucket.rate_factor / 2)
+            return backoff
+
+    def retry_delay(self, attempt):
+        """Espera recomendada antes de reintentar (backoff con jitter, respetando el cooldown)."""
+        with self._lock:
+            cooldown = max(0.0, self._cooldown_until - _time.monotonic())
+        backoff = min(self.backoff_max, self.backoff_base * (2 ** attempt)) / 2
+        return max(cooldown, random.uniform(backoff / 2, backoff))
+
+    def call(self, kind, fn, *args, priority=PRIORITY_NORMAL, timeout=None, **kwargs):
+        """Ejecuta fn(*args, **kwargs) consumiendo cuota; registra los 429 para el backoff adaptativo."""
+        self.acquire(kind, priority=priority, timeout=timeout)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if api_error_status(e) == 429:
+                backoff = self.report_rate_limited()
+                log.warning(f"⚠️ Sheets 429 (cuota excedida): cooldown global de {backoff:.1f}s")
+            raise
+        self.report_success()
+        return result
+
+    def budget(self):
+        """Presupuesto actual: tokens disponibles, fracción de capacidad y cooldown restante."""
+        with self._lock:
+            now = _time.monotonic()
+            info = {"cooldown_sec": round(max(0.0, self._cooldown_until - now), 2),
+                    "consecutive_429": self._consecutive_429}
+            for kind, bucket in self._buckets.items():
+                bucket.refill(now)
+                info[f"{kind}_tokens"] = round(bucket.tokens, 2)
+                info[f"{kind}_fraction"] = round(max(0.0, bucket.tokens) / bucket.capacity, 3)
+                info[f"{kind}_rate_factor"] = round(bucket.rate_factor, 2)
+                info[f"{kind}_per_min"] = round(bucket.per_minute * bucket.rate_factor, 2)
+            info.update(self.stats)
+            return info
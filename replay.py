@@ -0,0 +1,200 @@
+# =============================================================
+# Shadow AI — Reproducción de tráfico grabado (ver traffic.py)
+# =============================================================
+# Envía las peticiones grabadas en producción a otra instancia de app.py
+# respetando los tiempos entre llegadas originales, escalados por --speed:
+#
+#     python replay.py data/traffic --target http://localhost:5000 --speed 1
+#     python replay.py data/traffic --target http://staging:5000 --speed 10
+#     python replay.py data/traffic/traffic-20261017-0001.jsonl --speed max
+#
+# --speed max envía todo lo antes posible (limitado por --concurrency).
+# Cada ejecución añade un sufijo a subject_id/event_id (salvo --keep-ids): si no,
+# la deduplicación por event_id y el outbox de /finalize descartarían los
+# eventos de una segunda reproducción contra la misma instancia.
+# El texto libre llega redactado (TRAFFIC_REDACT_FIELDS): las /ai-suggest
+# reproducidas comparten texto y, tras la primera, salen de la caché de
+# sugerencias; sus latencias no representan las llamadas a OpenAI.
+#
+# Informe: latencias p50/p95/p99 por endpoint, códigos de estado, errores de
+# conexión y el retraso de envío respecto al programa (si crece, el cliente
+# no da abasto y hay que subir --concurrency).
+
+import sys
+import gzip
+import json
+import uuid
+import argparse
+import threading
+import time as _time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmark import percentile
+from traffic import load_recordings
+
+_ID_FIELDS = ("subject_id", "event_id")
+
+
+def rewrite_ids(value, suffix):
+    """Copia de `value` con "~<suffix>" añadido a cada subject_id y event_id."""
+    if isinstance(value, dict):
+        return {k: (f"{v}~{suffix}" if k in _ID_FIELDS and isinstance(v, str) and v else rewrite_ids(v, suffix))
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [rewrite_ids(v, suffix) for v in value]
+    return value
+
+
+def build_request(record, suffix=None):
+    """(method, path, headers, body) para reenviar un registro grabado."""
+    headers = {}
+    recorded = record.get("headers") or {}
+    if recorded.get("CONTENT_TYPE"):
+        headers["Content-Type"] = recorded["CONTENT_TYPE"]
+    if recorded.get("HTTP_ACCEPT"):
+        headers["Accept"] = recorded["HTTP_ACCEPT"]
+    body = None
+    if record.get("json") is not None:
+        data = rewrite_ids(record["json"], suffix) if suffix else record["json"]
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if record.get("encoding") == "gzip":
+            body = gzip.compress(body, mtime=0)
+            headers["Content-Encoding"] = "gzip"
+    path = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    return record.get("method", "POST"), path, headers, body
+
+
+class Results:
+    """Latencias, estados y errores por endpoint durante la reproducción."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.lag = []
+
+    def add(self, endpoint, seconds, status=None, error=None, lag=0.0):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if status is not None:
+                self.statuses.setdefault(endpoint, Counter())[status] += 1
+            if error is not None:
+                self.errors.setdefault(endpoint, Counter())[error] += 1
+            self.lag.append(lag)
+
+    def summary(self, elapsed, recorded):
+        report = {"elapsed_s": round(elapsed, 2), "endpoints": {}}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = self.statuses.get(endpoint, Counter())
+            errors = self.errors.get(endpoint, Counter())
+            failed = sum(n for code, n in statuses.items() if code >= 400) + sum(errors.values())
+            entry = {
+                "n": len(values), "error_rate": round(failed / len(values), 4),
+                "p50_ms": round(percentile(values, 50) * 1000, 2), "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2), "max_ms": round(values[-1] * 1000, 2),
+                "status": {str(code): n for code, n in sorted(statuses.items())},
+            }
+            if errors:
+                entry["connection_errors"] = dict(errors)
+            original = sorted(r["duration_ms"] for r in recorded
+                              if r.get("path") == endpoint and r.get("duration_ms") is not None)
+            if original:
+                entry["recorded_p50_ms"] = percentile(original, 50)
+                entry["recorded_p95_ms"] = percentile(original, 95)
+            report["endpoints"][endpoint] = entry
+        lag = sorted(self.lag)
+        report["send_lag_p95_ms"] = round(percentile(lag, 95) * 1000, 2) if lag else None
+        report["send_lag_max_ms"] = round(lag[-1] * 1000, 2) if lag else None
+        return report
+
+
+def replay(records, target, speed=1.0, concurrency=64, timeout=60.0, keep_ids=False):
+    """Reproduce `records` contra `target`. speed=None → lo antes posible."""
+    suffix = None if keep_ids else uuid.uuid4().hex[:6]
+    results = Results()
+    local = threading.local()
+    target = target.rstrip("/")
+
+    def send(record, due):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, path, headers, body = build_request(record, suffix)
+        headers["X-Request-ID"] = f"replay-{suffix or 'x'}-{record.get('request_id') or uuid.uuid4().hex[:8]}"
+        started = _time.perf_counter()
+        lag = max(0.0, started - due) if due is not None else 0.0
+        try:
+            with session.request(method, target + path, data=body, headers=headers,
+                                 timeout=timeout, stream=True) as response:
+                for _ in response.iter_content(chunk_size=None):   # Respuesta completa (incluido SSE)
+                    pass
+                results.add(record["path"], _time.perf_counter() - started, status=response.status_code, lag=lag)
+        except requests.RequestException as e:
+            results.add(record["path"], _time.perf_counter() - started, error=type(e).__name__, lag=lag)
+
+    first_ts = (records[0].get("ts") or 0) if records else 0
+    started = _time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            due = None
+            if speed:
+                due = started + ((record.get("ts") or first_ts) - first_ts) / speed
+                wait = due - _time.perf_counter()
+                if wait > 0:
+                    _time.sleep(wait)
+            pool.submit(send, record, due)
+    return results, _time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado por traffic.py contra una instancia de app.py")
+    parser.add_argument("paths", nargs="+", help="Ficheros traffic-*.jsonl o directorios que los contienen")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", default="1", help="Factor de velocidad (1, 10, …) o 'max'")
+    parser.add_argument("--concurrency", type=int, default=64, help="Peticiones simultáneas como máximo")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--paths-only", default="", help="Sólo estas rutas (separadas por comas)")
+    parser.add_argument("--keep-ids", action="store_true", help="No añadir sufijo a subject_id/event_id")
+    parser.add_argument("--json", default="", help="Guardar el informe en este fichero")
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    records = load_recordings(args.paths)
+    if args.paths_only:
+        wanted = {p.strip() for p in args.paths_only.split(",") if p.strip()}
+        records = [r for r in records if r.get("path") in wanted]
+    if not records:
+        print("⚠️ No hay peticiones grabadas que reproducir")
+        return 1
+
+    span = (records[-1].get("ts") or 0) - (records[0].get("ts") or 0)
+    print(f"📊 {len(records)} peticiones grabadas en {span:.1f} s → {args.target} "
+          f"(velocidad {args.speed}{f', ~{span / speed:.1f} s' if speed else ''})")
+    results, elapsed = replay(records, args.target, speed, args.concurrency, args.timeout, args.keep_ids)
+    report = results.summary(elapsed, records)
+    report.update(target=args.target, speed=args.speed, requests=len(records), recorded_span_s=round(span, 2))
+
+    print(f"\n{'endpoint':<22}{'n':>7}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  status")
+    for endpoint, entry in report["endpoints"].items():
+        status = " ".join(f"{code}:{n}" for code, n in entry["status"].items())
+        if entry.get("connection_errors"):
+            status += " " + " ".join(f"{name}:{n}" for name, n in entry["connection_errors"].items())
+        print(f"{endpoint:<22}{entry['n']:>7}{entry['error_rate'] * 100:>6.1f}%"
+              f"{entry['p50_ms']:>9.1f}{entry['p95_ms']:>9.1f}{entry['p99_ms']:>9.1f}{entry['max_ms']:>9.1f}  {status}")
+    print(f"\nDuración {report['elapsed_s']} s · retraso de envío p95 {report['send_lag_p95_ms']} ms "
+          f"(máx {report['send_lag_max_ms']} ms)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"✅ Informe guardado en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# =============================================================
+# Shadow AI — Shards de la hoja "events" (rollover por filas o por fecha)
+# =============================================================
+# Una sola worksheet "events" crece sin límite: los appends se vuelven más
+# lentos y un spreadsheet no admite más de 10M de celdas. Con sharding, los
+# eventos van a una worksheet activa que rota automáticamente:
+#
+#   - modo "rows":  events_0001, events_0002, … (cada max_rows filas)
+#   - modo "daily": events_2026_10_17, … (una por día UTC de escritura)
+#
+# Cada `per_spreadsheet` shards se pasa a un spreadsheet nuevo
+# ("<nombre> (events 02)", …); con 0 todo queda en el spreadsheet principal.
+#
+# La hoja índice (events_index, en el spreadsheet principal) tiene una fila
+# por shard con su rango de tiempo y de participantes; al arrancar se lee
+# para continuar el shard activo. Un lote nunca se parte entre dos shards:
+# la rotación ocurre antes de escribir, así que un shard puede pasar de
+# max_rows como mucho en un lote.
+#
+# Este módulo sólo decide nombres y lleva los rangos; las llamadas a gspread
+# las hace SheetsSink en app.py.
+
+import time as _time
+from datetime import datetime
+
+SHARD_MODE_ROWS  = "rows"
+SHARD_MODE_DAILY = "daily"
+
+SHARD_INDEX_HEADERS = ["shard", "spreadsheet", "status", "opened_at", "closed_at",
+                       "first_timestamp", "last_timestamp", "min_subject", "max_subject",
+                       "subjects", "rows", "subject_ids"]
+SUBJECT_IDS_MAX_CHARS = 45000   # Margen bajo el límite de 50.000 caracteres por celda
+
+_TIMESTAMP_COL = 0              # Posiciones en EVENTS_HEADERS
+_SUBJECT_COL   = 1
+
+
+def _utc_now_iso():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+class Shard:
+    """Una worksheet de eventos y el resumen que se guarda en el índice."""
+
+    __slots__ = ("name", "spreadsheet", "seq", "status", "opened_at", "closed_at",
+                 "first_ts", "last_ts", "subjects", "rows", "index_row", "dirty")
+
+    def __init__(self, name, spreadsheet, seq):
+        self.name = name
+        self.spreadsheet = spreadsheet
+        self.seq = seq
+        self.status = "open"
+        self.opened_at = _utc_now_iso()
+        self.closed_at = ""
+        self.first_ts = ""
+        self.last_ts = ""
+        self.subjects = set()
+        self.rows = 0
+        self.index_row = None       # Fila en la hoja índice (1-based), si ya se conoce
+        self.dirty = True           # Cambios aún no escritos en el índice
+
+    def record(self, rows):
+        """Actualiza el resumen tras escribir `rows` (filas de EVENTS_HEADERS)."""
+        for row in rows:
+            ts = row[_TIMESTAMP_COL] if len(row) > _TIMESTAMP_COL else ""
+            if isinstance(ts, str) and ts:
+                if not self.first_ts or ts < self.first_ts:
+                    self.first_ts = ts
+                if ts > self.last_ts:
+                    self.last_ts = ts
+            subject = row[_SUBJECT_COL] if len(row) > _SUBJECT_COL else ""
+            if subject:
+                self.subjects.add(str(subject))
+        self.rows += len(rows)
+        self.dirty = True
+
+    def close(self):
+        self.status = "closed"
+        self.closed_at = _utc_now_iso()
+        self.dirty = True
+
+    def to_index_row(self):
+        subjects = sorted(self.subjects)
+        ids = ",".join(subjects)
+        if len(ids) > SUBJECT_IDS_MAX_CHARS:
+            ids = ids[:SUBJECT_IDS_MAX_CHARS].rsplit(",", 1)[0] + ",…"
+        return [self.name, self.spreadsheet, self.status, self.opened_at, self.closed_at,
+                self.first_ts, self.last_ts, subjects[0] if subjects else "",
+                subjects[-1] if subjects else "", len(subjects), self.rows, ids]
+
+    @classmethod
+    def from_index_row(cls, values, seq, index_row):
+        values = list(values) + [""] * (len(SHARD_INDEX_HEADERS) - len(values))
+        shard = cls(values[0], values[1], seq)
+        shard.status = values[2] or "open"
+        shard.opened_at, shard.closed_at = values[3], values[4]
+        shard.first_ts, shard.last_ts = values[5], values[6]
+        shard.subjects = {s for s in values[11].split(",") if s and s != "…"}
+        try:
+            shard.rows = int(values[10] or 0)
+        except ValueError:
+            shard.rows = 0
+        shard.index_row = index_row
+        shard.dirty = False
+        return shard
+
+    def describe(self):
+        return {"name": self.name, "spreadsheet": self.spreadsheet, "rows": self.rows,
+                "subjects": len(self.subjects), "first_timestamp": self.first_ts,
+                "last_timestamp": self.last_ts}
+
+
+class ShardPlanner:
+    """Elige el shard activo de la hoja de eventos y decide cuándo rotar."""
+
+    def __init__(self, base_spreadsheet, prefix="events", mode=SHARD_MODE_ROWS, max_rows=200000,
+                 per_spreadsheet=0, index_interval=300.0):
+        if mode not in (SHARD_MODE_ROWS, SHARD_MODE_DAILY):
+            raise ValueError(f"modo de sharding desconocido: {mode}")
+        self.base_spreadsheet = base_spreadsheet
+        self.prefix = prefix
+        self.mode = mode
+        self.max_rows = max_rows
+        self.per_spreadsheet = per_spreadsheet
+        self.index_interval = index_interval
+        self.index_name = f"{prefix}_index"
+        self.restored = False
+        self.active = None
+        self.unindexed = []             # Shards abiertos o cerrados cuya fila del índice falta por escribir
+        self._seq = 0                   # Shards creados hasta ahora (filas del índice)
+        self._index_written_at = 0.0
+        self.stats = {"rollovers": 0, "index_writes": 0, "index_failures": 0}
+
+    # ── Nombres ──
+    def name_for(self, seq, day):
+        if self.mode == SHARD_MODE_DAILY:
+            return f"{self.prefix}_{day.replace('-', '_')}"
+        return f"{self.prefix}_{seq:04d}"
+
+    def spreadsheet_for(self, seq):
+        group = (seq - 1) // self.per_spreadsheet if self.per_spreadsheet > 0 else 0
+        return self.base_spreadsheet if group == 0 else f"{self.base_spreadsheet} ({self.prefix} {group + 1:02d})"
+
+    # ── Estado ──
+    def restore(self, index_values):
+        """Continúa desde el índice (get_all_values(), con cabecera): el último shard abierto sigue activo."""
+        entries = [(row, values) for row, values in enumerate(index_values[1:], start=2) if values and values[0]]
+        self._seq = len(entries)
+        self.active = None
+        if entries and (entries[-1][1] + [""] * 3)[2] != "closed":
+            self.active = Shard.from_index_row(entries[-1][1], self._seq, entries[-1][0])
+        self.restored = True
+        self._index_written_at = _time.monotonic()
+
+    def rollover(self, today=None):
+        """Devuelve (shard activo, shard que se acaba de cerrar o None), rotando si hace falta."""
+        today = today or datetime.utcnow().strftime("%Y-%m-%d")
+        shard = self.active
+        if shard is not None:
+            # El nombre delata otro día u otro modo (p. ej. un índice de antes de cambiar EVENTS_SHARD_MODE)
+            if shard.name == self.name_for(shard.seq, today) and (
+                    self.mode == SHARD_MODE_DAILY or shard.rows < self.max_rows):
+                return shard, None
+            shard.close()
+            if shard not in self.unindexed:
+                self.unindexed.append(shard)
+        self._seq += 1
+        self.active = Shard(self.name_for(self._seq, today), self.spreadsheet_for(self._seq), self._seq)
+        self.unindexed.append(self.active)
+        self.stats["rollovers"] += 1
+        return self.active, shard
+
+    def index_due(self):
+        """True si el resumen del shard activo debe volcarse al índice (cada index_interval)."""
+        return (self.active is not None and self.active.dirty
+                and _time.monotonic() - self._index_written_at >= self.index_interval)
+
+    def index_written(self, shard, ok):
+        """Resultado de escribir la fila de `shard` en el índice."""
+        if ok:
+            self._index_written_at = _time.monotonic()
+            self.stats["index_writes"] += 1
+            if shard in self.unindexed:
+                self.unindexed.remove(shard)
+        else:
+            self.stats["index_failures"] += 1
+
+    def describe(self):
+        return dict(self.stats, mode=self.mode, max_rows=self.max_rows if self.mode == SHARD_MODE_ROWS else None,
+                    per_spreadsheet=self.per_spreadsheet, index=self.index_name, shards=self._seq,
+                    restored=self.restored, unindexed=len(self.unindexed), active=self.active.describe() if self.active is not None else None)
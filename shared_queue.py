@@ -0,0 +1,120 @@
+# =============================================================
+# Shadow AI — Cola de ingesta compartida entre procesos (gunicorn)
+# =============================================================
+# Con varios workers, cada proceso mete sus eventos en una misma base SQLite
+# (modo WAL, una transacción por petición) y sólo el proceso que tiene el
+# file lock del flusher la vacía hacia Google Sheets. Si ese proceso muere,
+# el sistema operativo libera el lock y otro worker toma el relevo.
+
+import os
+import json
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:     # Windows: sin flock, se asume un único proceso
+    fcntl = None
+
+
+class SharedEventQueue:
+    """Cola FIFO persistente en SQLite, segura entre procesos y hilos."""
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL)"
+            )
+
+    def _connection(self):
+        """Conexión del proceso actual (se reabre tras un fork). Llamar con _lock adquirido."""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=self.busy_timeout_ms / 1000.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def put(self, rows):
+        """Inserta filas en una sola transacción (duraderas al volver)."""
+        if not rows:
+            return
+        payloads = [(json.dumps(row, ensure_ascii=False, separators=(",", ":")),) for row in rows]
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO queue (row) VALUES (?)", payloads)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def peek_batch(self, max_rows):
+        """Devuelve (filas, último id) de las filas más antiguas sin borrarlas."""
+        with self._lock:
+            cursor = self._connection().execute(
+                "SELECT id, row FROM queue ORDER BY id LIMIT ?", (max_rows,)
+            )
+            items = cursor.fetchall()
+        if not items:
+            return [], None
+        return [json.loads(row) for _, row in items], items[-1][0]
+
+    def delete_upto(self, last_id):
+        """Borra las filas ya escritas (id <= last_id)."""
+        with self._lock:
+            self._connection().execute("DELETE FROM queue WHERE id <= ?", (last_id,))
+
+    def size(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+
+class FlusherElection:
+    """Elección del flusher por file lock (flock exclusivo no bloqueante)."""
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        directory = os.path.dirname(lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = None
+        self._pid = None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None and self._pid == os.getpid()
+
+    def try_acquire(self):
+        """Intenta convertirse en flusher. Devuelve True si este proceso tiene el lock."""
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self._fd, self._pid = -1, os.getpid()
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd, self._pid = fd, os.getpid()
+        return True
+
+    def release(self):
+        if self.is_leader and self._fd != -1:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
@@ -0,0 +1,371 @@
+# =============================================================
+# Shadow AI — Emulador en proceso de Google Sheets y stub de OpenAI
+# =============================================================
+# Sustituye a gspread en benchmark.py: implementa sólo lo que usa app.py
+# (open/open_by_key/create, worksheet/add_worksheet/worksheets, append_rows,
+# batch_update con appendCells, col_values, update, resize, …) con:
+#
+# - latencia configurable por llamada (lognormal alrededor de la media) y que
+#   puede crecer con las filas de la hoja (latency_per_100k_rows);
+# - inyección de 429 y 500 con la probabilidad indicada, como APIError de gspread
+#   (así pasan por quota.py y los reintentos igual que los errores reales);
+# - el límite de celdas por spreadsheet (10M en Sheets): la rejilla crece al
+#   añadir filas y add_worksheet/append fallan con 400 al superarlo;
+# - escrituras serializadas por spreadsheet, como en la API real.
+#
+# OpenAIStub es un servidor HTTP local compatible con /chat/completions
+# (JSON y stream SSE) con latencia, tokens y tasa de error configurables.
+
+import json
+import time as _time
+import uuid
+import random
+import threading
+from itertools import count
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import gspread
+
+SHEETS_CELL_LIMIT = 10_000_000
+
+
+class _ErrorResponse:
+    """Lo mínimo de requests.Response que necesita gspread.exceptions.APIError."""
+
+    def __init__(self, code, message):
+        self.status_code = code
+        self.text = message
+        self._error = {"code": code, "message": message, "status": "EMULATED"}
+
+    def json(self):
+        return {"error": self._error}
+
+
+def _api_error(code, message):
+    return gspread.exceptions.APIError(_ErrorResponse(code, message))
+
+
+class SheetsEmulator:
+    """Estado compartido (spreadsheets, latencias, fallos) y estadísticas de llamadas."""
+
+    def __init__(self, latency=0.08, read_latency=0.03, jitter=0.25, latency_per_100k_rows=0.0,
+                 error_429_rate=0.0, error_500_rate=0.0, cell_limit=SHEETS_CELL_LIMIT, seed=None):
+        self.latency = latency
+        self.read_latency = read_latency
+        self.jitter = jitter
+        self.latency_per_100k_rows = latency_per_100k_rows
+        self.error_429_rate = error_429_rate
+        self.error_500_rate = error_500_rate
+        self.cell_limit = cell_limit
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._spreadsheets = {}         # key → _Spreadsheet
+        self._sheet_ids = count(1)
+        self.stats = {"calls": {}, "injected_429": 0, "injected_500": 0, "cell_limit_errors": 0}
+
+    def client(self):
+        return _Client(self)
+
+    def add_spreadsheet(self, title):
+        """Spreadsheet que ya existe y está compartido con la cuenta de servicio (el principal)."""
+        spreadsheet = _Spreadsheet(self, title)
+        with self._lock:
+            self._spreadsheets[spreadsheet.id] = spreadsheet
+        return spreadsheet
+
+    def _call(self, method, write=False, rows_in_sheet=0):
+        """Cuenta la llamada, espera la latencia simulada y, a veces, falla como la API."""
+        with self._lock:
+            self.stats["calls"][method] = self.stats["calls"].get(method, 0) + 1
+            roll = self._rng.random()
+            base = self.latency if write else self.read_latency
+            delay = base * self._rng.lognormvariate(0, self.jitter) if base > 0 else 0.0
+            if write:
+                delay += self.latency_per_100k_rows * rows_in_sheet / 100_000
+            if roll < self.error_429_rate:
+                self.stats["injected_429"] += 1
+                error = _api_error(429, "Quota exceeded for quota metric 'Write requests' (emulated)")
+            elif roll < self.error_429_rate + self.error_500_rate:
+                self.stats["injected_500"] += 1
+                error = _api_error(500, "Internal error encountered (emulated)")
+            else:
+                error = None
+        if delay:
+            _time.sleep(delay)
+        if error is not None:
+            raise error
+
+    def spreadsheets(self):
+        with self._lock:
+            return list(self._spreadsheets.values())
+
+    def rows(self, prefix="", exclude=()):
+        """Filas de datos (sin cabecera) de las hojas cuyo título empieza por `prefix`."""
+        total = 0
+        for spreadsheet in self.spreadsheets():
+            for worksheet in spreadsheet.worksheets(_count=False):
+                if worksheet.title.startswith(prefix) and worksheet.title not in exclude:
+                    total += max(0, len(worksheet._values) - 1)
+        return total
+
+    def describe(self):
+        with self._lock:
+            info = dict(self.stats, calls=dict(self.stats["calls"]))
+        info["spreadsheets"] = len(self._spreadsheets)
+        info["cells"] = sum(s._cells() for s in self.spreadsheets())
+        return info
+
+
+class _Client:
+    http_client = None      # app.py busca aquí las credenciales para renovar el token
+
+    def __init__(self, emulator):
+        self._emu = emulator
+
+    def open(self, title):
+        self._emu._call("open")
+        for spreadsheet in self._emu.spreadsheets():
+            if spreadsheet.title == title:
+                return spreadsheet
+        raise gspread.exceptions.SpreadsheetNotFound(title)
+
+    def open_by_key(self, key):
+        self._emu._call("open_by_key")
+        with self._emu._lock:
+            spreadsheet = self._emu._spreadsheets.get(key)
+        if spreadsheet is None:
+            raise _api_error(404, f"Requested entity was not found: {key}")
+        return spreadsheet
+
+    def create(self, title):
+        self._emu._call("create", write=True)
+        return self._emu.add_spreadsheet(title)
+
+
+class _Spreadsheet:
+    def __init__(self, emulator, title):
+        self._emu = emulator
+        self.id = uuid.uuid4().hex
+        self.title = title
+        self._sheets = {}                       # título → _Worksheet (orden de creación)
+        self._write_lock = threading.Lock()     # Las escrituras a un spreadsheet se serializan
+
+    def _cells(self):
+        return sum(ws.row_count * ws.col_count for ws in list(self._sheets.values()))
+
+    def _check_cells(self, extra):
+        if self._cells() + extra > self._emu.cell_limit:
+            with self._emu._lock:
+                self._emu.stats["cell_limit_errors"] += 1
+            raise _api_error(400, f"This action would increase the number of cells in the workbook "
+                                  f"above the limit of {self._emu.cell_limit} cells.")
+
+    def worksheets(self, _count=True):
+        if _count:
+            self._emu._call("worksheets")
+        return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self._emu._call("worksheet")
+        worksheet = self._sheets.get(title)
+        if worksheet is None:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return worksheet
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        with self._write_lock:
+            self._emu._call("add_worksheet", write=True)
+            if title in self._sheets:
+                raise _api_error(400, f"A sheet with the name \"{title}\" already exists.")
+            self._check_cells(rows * cols)
+            worksheet = _Worksheet(self, next(self._emu._sheet_ids), title, rows, cols)
+            self._sheets[title] = worksheet
+            return worksheet
+
+    def batch_update(self, body):
+        requests_ = body.get("requests", [])
+        by_id = {ws.id: ws for ws in self._sheets.values()}
+        with self._write_lock:
+            self._emu._call("batch_update", write=True,
+                            rows_in_sheet=max((len(ws._values) for ws in by_id.values()), default=0))
+            # Se valida todo antes de aplicar: batchUpdate es atómico
+            appends = []
+            for request in requests_:
+                append = request.get("appendCells")
+                if append is None:
+                    continue
+                worksheet = by_id.get(append["sheetId"])
+                if worksheet is None:
+                    raise _api_error(400, f"No grid with id: {append['sheetId']}")
+                rows = [[_cell_value(cell) for cell in row.get("values", [])] for row in append.get("rows", [])]
+                appends.append((worksheet, rows))
+            growth = sum(ws._growth(len(rows)) * ws.col_count for ws, rows in appends)
+            self._check_cells(growth)
+            for worksheet, rows in appends:
+                worksheet._append(rows)
+        return {"spreadsheetId": self.id, "replies": [{} for _ in requests_]}
+
+    def share(self, email, perm_type="user", role="writer", notify=True, **kwargs):
+        self._emu._call("share", write=True)
+
+
+class _Worksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self._spreadsheet = spreadsheet
+        self._emu = spreadsheet._emu
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self._values = []
+
+    def _growth(self, n):
+        """Filas que hay que añadir a la rejilla para escribir n filas más."""
+        return max(0, len(self._values) + n - self.row_count)
+
+    def _append(self, rows):
+        self.row_count += self._growth(len(rows))
+        self._values.extend([str(v) if v is not None else "" for v in row] for row in rows)
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        with self._spreadsheet._write_lock:
+            self._emu._call("append_rows", write=True, rows_in_sheet=len(self._values))
+            self._spreadsheet._check_cells(self._growth(len(values)) * self.col_count)
+            self._append(values)
+        return {"updates": {"updatedRows": len(values)}}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option, **kwargs)
+
+    def col_values(self, col):
+        self._emu._call("col_values")
+        values = [row[col - 1] if len(row) >= col else "" for row in self._values]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def row_values(self, row):
+        self._emu._call("row_values")
+        return list(self._values[row - 1]) if row <= len(self._values) else []
+
+    def get_all_values(self):
+        self._emu._call("get_all_values")
+        return [list(row) for row in self._values]
+
+    def update(self, *args, values=None, range_name=None, **kwargs):
+        # gspread acepta update(values, range_name) y el orden antiguo update(range_name, values)
+        for arg in args:
+            if isinstance(arg, str):
+                range_name = arg
+            else:
+                values = arg
+        with self._spreadsheet._write_lock:
+            self._emu._call("update", write=True)
+            start = int("".join(ch for ch in (range_name or "A1").split(":")[0] if ch.isdigit()) or 1)
+            for offset, row in enumerate(values or []):
+                index = start - 1 + offset
+                while len(self._values) <= index:
+                    self._values.append([])
+                self._values[index] = [str(v) for v in row]
+            self.row_count = max(self.row_count, len(self._values))
+        return {"updatedRows": len(values or [])}
+
+    def resize(self, rows=None, cols=None):
+        with self._spreadsheet._write_lock:
+            self._emu._call("resize", write=True)
+            new_rows = rows if rows is not None else self.row_count
+            new_cols = cols if cols is not None else self.col_count
+            self._spreadsheet._check_cells(new_rows * new_cols - self.row_count * self.col_count)
+            self.row_count, self.col_count = new_rows, new_cols
+
+
+def _cell_value(cell):
+    value = cell.get("userEnteredValue", {})
+    return next(iter(value.values())) if value else ""
+
+
+# =============================================================
+# STUB DE OPENAI (/chat/completions)
+# =============================================================
+class OpenAIStub:
+    """Servidor local que responde como /v1/chat/completions (normal y stream)."""
+
+    def __init__(self, latency=0.4, tokens=12, token_delay=0.02, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0, "errors": 0}
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub._handle(self, body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="openai-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _handle(self, handler, body):
+        stream = bool(body.get("stream"))
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["streams"] += stream
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.stats["errors"] += 1
+            delay = self.latency * self._rng.lognormvariate(0, 0.25) if self.latency > 0 else 0.0
+        _time.sleep(delay)
+        if fail:
+            return _send(handler, 500, {"error": {"message": "stub: error inyectado", "type": "server_error"}})
+        words = [f" palabra{i}" for i in range(self.tokens)]
+        if not stream:
+            return _send(handler, 200, {"choices": [{"message": {"role": "assistant", "content": "".join(words).strip()}}]})
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for word in words:
+            _chunk(handler, "data: " + json.dumps({"choices": [{"delta": {"content": word}}]}) + "\n\n")
+            if self.token_delay:
+                _time.sleep(self.token_delay)
+        _chunk(handler, "data: [DONE]\n\n")
+        handler.wfile.write(b"0\r\n\r\n")
+
+
+def _send(handler, status, payload):
+    data = json.dumps(payload).encode("utf-8")
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+def _chunk(handler, text):
+    data = text.encode("utf-8")
+    handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    handler.wfile.flush()
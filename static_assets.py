@@ -0,0 +1,181 @@
+# =============================================================
+# Shadow AI — Estáticos: bundles con huella, precompresión y caché en memoria
+# =============================================================
+# Al arrancar se lee public/index.html y cada bloque
+#
+#     <!-- bundle: vendor.js -->
+#     <script src="jsPsych/jspsych.js"></script>
+#     ...
+#     <!-- /bundle -->
+#
+# se concatena en un único fichero con huella (assets/vendor.<sha>.js) y el
+# bloque se sustituye por una sola etiqueta. Abriendo index.html desde disco
+# (file://) los comentarios no hacen nada y se cargan los ficheros sueltos.
+#
+# Los bundles y el resto de ficheros que enlaza index.html se comprimen al
+# arrancar; los demás, la primera vez que se piden (una sola carga por ruta
+# aunque lleguen varias peticiones a la vez). Todos quedan en memoria ya
+# comprimidos (gzip y, si está instalado el paquete `brotli`, br): cada
+# petición negocia Accept-Encoding y responde sin tocar disco ni comprimir.
+# Los bundles llevan Cache-Control immutable (la huella cambia con el
+# contenido); el resto, incluido index.html, se revalida con ETag (304).
+
+import os
+import re
+import gzip
+import hashlib
+import threading
+import mimetypes
+
+try:
+    import brotli
+except ImportError:     # brotli opcional: sin él sólo se precomprime gzip
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_BUNDLE_RE = re.compile(r"<!--\s*bundle:\s*(\S+)\s*-->(.*?)<!--\s*/bundle\s*-->", re.S)
+_SOURCE_RE = re.compile(r"<(?:script\b[^>]*?\ssrc|link\b[^>]*?\shref)=\"([^\"]+)\"")
+
+
+class Asset:
+    """Fichero servido desde memoria: cuerpo original y variantes precomprimidas."""
+
+    __slots__ = ("path", "mimetype", "cache_control", "etag", "variants")
+
+    def __init__(self, path, body, cache_control, compress_min=1024):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {None: body}    # Content-Encoding → cuerpo
+        if len(body) >= compress_min and self.mimetype.startswith(_COMPRESSIBLE):
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants["br"] = br
+
+    def size(self):
+        return sum(len(body) for body in self.variants.values())
+
+    def variant(self, accepts):
+        """(encoding, cuerpo, etag) para un cliente; accepts(encoding) → calidad de Accept-Encoding."""
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepts(encoding):
+                # ETag distinto por codificación: son representaciones distintas del recurso
+                return encoding, self.variants[encoding], f"{self.etag}-{encoding}"
+        return None, self.variants[None], self.etag
+
+    def etags(self):
+        return [self.etag] + [f"{self.etag}-{encoding}" for encoding in self.variants if encoding]
+
+
+class StaticAssets:
+    """Manifiesto de bundles y caché en memoria de public/ (hasta max_bytes)."""
+
+    def __init__(self, root, index="index.html", max_bytes=64 * 1024 * 1024, compress_min=1024):
+        self.root = os.path.realpath(root)
+        self.index = index
+        self.max_bytes = max_bytes
+        self.compress_min = compress_min
+        self.manifest = {}              # nombre del bundle → ruta con huella
+        self._assets = {}               # ruta relativa → Asset
+        self._uncacheable = set()       # Rutas que no caben: se sirven desde disco
+        self._loading = {}              # ruta → Lock de la carga en curso (una compresión por ruta)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.stats = {"hits": 0, "loads": 0, "preloaded": 0, "not_modified": 0, "disk": 0}
+
+    def _resolve(self, path):
+        """Ruta absoluta dentro de root, o None si sale de él."""
+        full = os.path.realpath(os.path.join(self.root, path))
+        return full if full.startswith(self.root + os.sep) else None
+
+    def _read(self, path):
+        full = self._resolve(path)
+        if full is None:
+            raise PermissionError(path)
+        with open(full, "rb") as f:
+            return f.read()
+
+    def _store(self, path, asset):
+        with self._lock:
+            previous = self._assets.get(path)
+            self._bytes += asset.size() - (previous.size() if previous is not None else 0)
+            self._assets[path] = asset
+
+    def build(self, bundles=True):
+        """Construye los bundles del index y el index reescrito. Devuelve el manifiesto."""
+        html = self._read(self.index).decode("utf-8")
+        if bundles:
+            html = _BUNDLE_RE.sub(lambda m: self._bundle(m.group(1), m.group(2)), html)
+        self._store(self.index, Asset(self.index, html.encode("utf-8"), REVALIDATE, self.compress_min))
+        # Lo que enlaza el index se pide en cuanto llega el primer participante: comprimirlo ya
+        for source in _SOURCE_RE.findall(html):
+            path = os.path.normpath(source.split("?", 1)[0].split("#", 1)[0])
+            if "://" in source or source.startswith(("/", "data:")) or path in self._assets:
+                continue
+            if self._load(path) is not None:
+                self.stats["preloaded"] += 1
+        return dict(self.manifest)
+
+    def _bundle(self, name, block):
+        sources = _SOURCE_RE.findall(block)
+        stem, ext = os.path.splitext(name)
+        separator = b";\n" if ext == ".js" else b"\n"
+        body = separator.join(self._read(source).rstrip() for source in sources) + b"\n"
+        path = f"assets/{stem}.{hashlib.sha256(body).hexdigest()[:10]}{ext}"
+        self._store(path, Asset(path, body, IMMUTABLE, self.compress_min))
+        self.manifest[name] = path
+        if ext == ".css":
+            return f'<link rel="stylesheet" href="{path}" />'
+        return f'<script src="{path}"></script>'
+
+    def get(self, path):
+        """Asset en memoria para `path` (cargándolo la primera vez), o None → servir desde disco."""
+        asset = self._assets.get(path)
+        if asset is not None:
+            self.stats["hits"] += 1
+            return asset
+        if path in self._uncacheable:
+            self.stats["disk"] += 1
+            return None
+        with self._lock:
+            loading = self._loading.setdefault(path, threading.Lock())
+        with loading:
+            # Si otra petición lo cargó mientras esperábamos, se reutiliza en vez de comprimir otra vez
+            asset = self._assets.get(path)
+            if asset is not None:
+                self.stats["hits"] += 1
+                return asset
+            try:
+                asset = self._load(path)
+                if asset is not None:
+                    self.stats["loads"] += 1
+                return asset
+            finally:
+                with self._lock:
+                    self._loading.pop(path, None)
+
+    def _load(self, path):
+        full = self._resolve(path)
+        if full is None or not os.path.isfile(full):
+            return None
+        if os.path.getsize(full) + self._bytes > self.max_bytes:
+            self._uncacheable.add(path)
+            self.stats["disk"] += 1
+            return None
+        asset = Asset(path, self._read(path), REVALIDATE, self.compress_min)
+        self._store(path, asset)
+        return asset
+
+    def describe(self):
+        with self._lock:
+            return dict(self.stats, cached_files=len(self._assets), cached_mb=round(self._bytes / 1024 / 1024, 2),
+                        max_mb=round(self.max_bytes / 1024 / 1024, 1), brotli=brotli is not None,
+                        bundles=dict(self.manifest))
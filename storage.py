@@ -0,0 +1,318 @@
+# =============================================================
+# Shadow AI — Sinks de almacenamiento (SQLite, archivos, réplicas)
+# =============================================================
+# Todos los sinks exponen la misma interfaz que usa app.py:
+#
+#     append_rows(table, headers, rows) → None si todo fue bien, o mensaje de error
+#     append_many([(table, headers, rows), …]) → [error o None por tabla]
+#
+# append_many es lo que usa el planificador de escrituras de app.py para
+# llevar eventos, resultados y blobs de un ciclo en una sola llamada; por
+# defecto son append_rows sucesivos, y el sink de Sheets lo hace en un único
+# batchUpdate.
+# "table" es el nombre lógico ("events", "results"), igual que el nombre de la
+# worksheet en Google Sheets. El sink de Sheets vive en app.py porque depende
+# del cliente cacheado; aquí están los sinks locales y el sink compuesto.
+
+import os
+import logging
+import csv
+import json
+import sqlite3
+import threading
+import time as _time
+from collections import deque
+from datetime import datetime
+
+log = logging.getLogger("shadowai.storage")
+
+
+class StorageSink:
+    """Interfaz base de un sink de almacenamiento."""
+
+    name = "sink"
+    can_check_existing = False      # existing_values sabe responder (si no, siempre None)
+
+    def append_rows(self, table, headers, rows):
+        """Escribe filas (listas alineadas con headers). Devuelve None o el mensaje de error."""
+        raise NotImplementedError
+
+    def append_many(self, batches):
+        """Escribe varias tablas en orden. Devuelve la lista de errores (None = escrita) alineada con batches.
+        Si una tabla falla no se escriben las siguientes: el orden importa (blobs antes que los eventos
+        que los referencian, eventos antes que los resultados)."""
+        errors, failed = [], None
+        for table, headers, rows in batches:
+            if failed is not None:
+                errors.append(f"No escrita: falló '{failed}' antes")
+                continue
+            errors.append(self.append_rows(table, headers, rows))
+            if errors[-1] is not None:
+                failed = table
+        return errors
+
+    def existing_values(self, table, headers, column):
+        """Conjunto de valores ya escritos en `column` (para deduplicar), o None si no se puede saber."""
+        return None
+
+    def describe(self):
+        """Estado del sink para /health."""
+        return {"sink": self.name}
+
+    def close(self):
+        pass
+
+
+def _quote_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteSink(StorageSink):
+    """SQLite en modo WAL; cada llamada inserta todas las filas en una sola transacción."""
+
+    name = "sqlite"
+    can_check_existing = True
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._columns = {}      # table → lista de columnas conocidas
+        self._rows_written = 0
+
+    def _ensure_table(self, table, headers):
+        """Crea la tabla o añade columnas nuevas (llamar con _lock adquirido)."""
+        known = self._columns.get(table)
+        if known is None:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote_ident(table)} "
+                f"(_rowid INTEGER PRIMARY KEY AUTOINCREMENT, "
+                + ", ".join(f"{_quote_ident(h)} TEXT" for h in headers) + ")"
+            )
+            known = [r[1] for r in self._conn.execute(f"PRAGMA table_info({_quote_ident(table)})")]
+            self._columns[table] = known
+        for h in headers:
+            if h not in known:
+                self._conn.execute(f"ALTER TABLE {_quote_ident(table)} ADD COLUMN {_quote_ident(h)} TEXT")
+                known.append(h)
+
+    def append_rows(self, table, headers, rows):
+        if not rows:
+            return None
+        sql = (f"INSERT INTO {_quote_ident(table)} ({', '.join(_quote_ident(h) for h in headers)}) "
+               f"VALUES ({', '.join('?' for _ in headers)})")
+        values = [[None if v is None else str(v) for v in (list(row) + [""] * len(headers))[:len(headers)]]
+                  for row in rows]
+        try:
+            with self._lock:
+                self._ensure_table(table, headers)
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(sql, values)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._rows_written += len(rows)
+            return None
+        except Exception as e:
+            log.warning(f"⚠️ SQLiteSink: error insertando {len(rows)} filas en '{table}': {type(e).__name__}: {e}")
+            return f"SQLite: {type(e).__name__}: {e}"
+
+    def existing_values(self, table, headers, column):
+        try:
+            with self._lock:
+                self._ensure_table(table, headers)
+                cursor = self._conn.execute(
+                    f"SELECT DISTINCT {_quote_ident(column)} FROM {_quote_ident(table)}")
+                return {row[0] for row in cursor if row[0] is not None}
+        except Exception as e:
+            log.warning(f"⚠️ SQLiteSink: no se pudo leer '{table}.{column}': {type(e).__name__}: {e}")
+            return None
+
+    def describe(self):
+        return {"sink": self.name, "path": self.path, "rows_written": self._rows_written}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RotatingFileSink(StorageSink):
+    """Archivos JSONL o CSV por tabla, rotados por tamaño: <table>-<fecha>-<n>.<ext>."""
+
+    name = "file"
+
+    def __init__(self, directory, fmt="jsonl", max_bytes=50 * 1024 * 1024, fsync=False):
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError(f"formato de archivo no soportado: {fmt}")
+        self.directory = directory
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._files = {}        # table → (ruta, file object)
+        self._rows_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, table, headers):
+        """Devuelve el archivo activo de la tabla, rotando si hace falta (llamar con _lock)."""
+        current = self._files.get(table)
+        if current and current[1].tell() < self.max_bytes:
+            return current[1]
+        if current:
+            current[1].close()
+        stamp = datetime.utcnow().strftime("%Y%m%d")
+        n = 1
+        while True:
+            path = os.path.join(self.directory, f"{table}-{stamp}-{n:04d}.{self.fmt}")
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_bytes:
+                break
+            n += 1
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        f = open(path, "a", encoding="utf-8", newline="")
+        if self.fmt == "csv" and is_new:
+            csv.writer(f).writerow(headers)
+        self._files[table] = (path, f)
+        return f
+
+    def append_rows(self, table, headers, rows):
+        if not rows:
+            return None
+        try:
+            with self._lock:
+                f = self._open(table, headers)
+                if self.fmt == "jsonl":
+                    f.write("".join(json.dumps(dict(zip(headers, row)), ensure_ascii=False) + "\n"
+                                    for row in rows))
+                else:
+                    csv.writer(f).writerows(rows)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                self._rows_written += len(rows)
+            return None
+        except Exception as e:
+            log.warning(f"⚠️ RotatingFileSink: error escribiendo {len(rows)} filas en '{table}': {type(e).__name__}: {e}")
+            return f"Archivo: {type(e).__name__}: {e}"
+
+    def describe(self):
+        with self._lock:
+            active = {table: path for table, (path, _) in self._files.items()}
+        return {"sink": self.name, "format": self.fmt, "directory": self.directory,
+                "active_files": active, "rows_written": self._rows_written}
+
+    def close(self):
+        with self._lock:
+            for _, f in self._files.values():
+                f.close()
+            self._files = {}
+
+
+class _MirrorWorker:
+    """Replica en segundo plano las escrituras hacia un sink secundario, con reintentos."""
+
+    def __init__(self, sink, max_pending_rows, retry_interval=5.0, max_backoff=120.0):
+        self.sink = sink
+        self.max_pending_rows = max_pending_rows
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._queue = deque()       # (table, headers, rows)
+        self._pending_rows = 0
+        self.dropped_rows = 0
+        self.last_error = None
+        threading.Thread(target=self._run, name=f"mirror-{sink.name}", daemon=True).start()
+
+    def submit(self, table, headers, rows):
+        with self._cond:
+            self._queue.append((table, headers, list(rows)))
+            self._pending_rows += len(rows)
+            # Cola acotada: se descarta lo más antiguo (la copia principal ya está guardada)
+            while self._pending_rows > self.max_pending_rows and len(self._queue) > 1:
+                _, _, old = self._queue.popleft()
+                self._pending_rows -= len(old)
+                self.dropped_rows += len(old)
+            self._cond.notify()
+
+    def _take(self):
+        """Agrupa todo lo encolado por tabla (en orden de aparición) para una sola append_many."""
+        groups = {}
+        while self._queue:
+            table, headers, rows = self._queue.popleft()
+            groups.setdefault((table, tuple(headers)), []).extend(rows)
+        return [(table, list(headers), rows) for (table, headers), rows in groups.items()]
+
+    def _run(self):
+        delay = self.retry_interval
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batches = self._take()
+            errors = self.sink.append_many(batches)
+            with self._cond:
+                failed = [batch for batch, error in zip(batches, errors) if error is not None]
+                self._pending_rows -= sum(len(rows) for (_, _, rows), error in zip(batches, errors) if error is None)
+                if not failed:
+                    self.last_error = None
+                    delay = self.retry_interval
+                    continue
+                self._queue.extendleft(reversed(failed))
+                self.last_error = next(error for error in errors if error is not None)
+            _time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def describe(self):
+        with self._cond:
+            info = self.sink.describe()
+            info.update({"mirror_pending_rows": self._pending_rows,
+                         "mirror_dropped_rows": self.dropped_rows,
+                         "mirror_last_error": self.last_error})
+            return info
+
+
+class StackedSink(StorageSink):
+    """Sink principal síncrono + réplicas asíncronas (p. ej. SQLite local y Sheets en segundo plano)."""
+
+    name = "stacked"
+
+    def __init__(self, primary, mirrors=(), mirror_max_pending_rows=100000):
+        self.primary = primary
+        self.mirrors = [_MirrorWorker(m, mirror_max_pending_rows) for m in mirrors]
+
+    def append_rows(self, table, headers, rows):
+        error = self.primary.append_rows(table, headers, rows)
+        if error is None:
+            for mirror in self.mirrors:
+                mirror.submit(table, headers, rows)
+        return error
+
+    def append_many(self, batches):
+        errors = self.primary.append_many(batches)
+        for (table, headers, rows), error in zip(batches, errors):
+            if error is None:
+                for mirror in self.mirrors:
+                    mirror.submit(table, headers, rows)
+        return errors
+
+    @property
+    def can_check_existing(self):
+        return self.primary.can_check_existing
+
+    def existing_values(self, table, headers, column):
+        return self.primary.existing_values(table, headers, column)
+
+    def describe(self):
+        return {"sink": self.name, "primary": self.primary.describe(),
+                "mirrors": [m.describe() for m in self.mirrors]}
+
+    def close(self):
+        self.primary.close()
+        for mirror in self.mirrors:
+            mirror.sink.close()
@@ -0,0 +1,61 @@
+import gzip
+import zlib
+
+import pytest
+
+from batch_codec import BodyTooLarge, decode_body, iso_from_ms, parse_batch
+
+
+def test_decode_body_identity_gzip_and_deflate():
+    data = b'{"events": []}'
+    assert decode_body(data, None, 100) == data
+    assert decode_body(gzip.compress(data), "gzip", 100) == data
+    assert decode_body(zlib.compress(data), "deflate", 100) == data
+
+
+def test_decode_body_limits_decompressed_size():
+    bomb = gzip.compress(b"a" * 10000)
+    with pytest.raises(BodyTooLarge):
+        decode_body(bomb, "gzip", 1000)
+    with pytest.raises(BodyTooLarge):
+        decode_body(b"a" * 1001, "identity", 1000)
+
+
+def test_decode_body_rejects_invalid_and_unknown_encodings():
+    with pytest.raises(ValueError):
+        decode_body(b"not gzip", "gzip", 100)
+    with pytest.raises(ValueError):
+        decode_body(b"{}", "compress", 100)
+
+
+def test_iso_from_ms_matches_js_toisostring():
+    assert iso_from_ms(0) == "1970-01-01T00:00:00.000Z"
+    assert iso_from_ms(1700000000123) == "2023-11-14T22:13:20.123Z"
+
+
+def test_parse_classic_formats():
+    items, batch = parse_batch([{"event": "a"}, "basura"])
+    assert items == [{"event": "a"}] and batch is None
+    items, batch = parse_batch({"events": [{"event": "a"}, 1]})
+    assert items == [{"event": "a"}] and batch is None
+    assert parse_batch({"events": "x"}) == ([], None)
+    assert parse_batch("x") == ([], None)
+
+
+def test_parse_compact_v2_batch():
+    t0 = 1700000000000
+    items, batch = parse_batch({"v": 2, "subject_id": "S-1", "policy": "p", "t0": t0,
+                                "events": [[1, 123, "click", {"x": 1}], [2, 1500, "key"], ["bad"], [3, "x", "e"]]})
+    assert len(items) == 3 and batch.subject_id == "S-1" and batch.policy == "p"
+    first, second, third = items
+    assert batch.event_id(first) == "S-1-1"
+    assert batch.timestamp(first) == iso_from_ms(t0 + 123)
+    assert batch.timestamp(second) == iso_from_ms(t0 + 1500)
+    assert batch.event(second) == "key"
+    assert batch.payload(first) == {"x": 1} and batch.payload(second) == {}
+    assert batch.timestamp(third) is None      # Desfase no numérico
+
+
+def test_compact_batch_without_seq_has_no_event_id():
+    items, batch = parse_batch({"v": 2, "subject_id": "S-1", "t0": 0, "events": [[None, 0, "e"], ["", 0, "e"]]})
+    assert [batch.event_id(item) for item in items] == [None, None]
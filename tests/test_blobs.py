@@ -0,0 +1,161 @@
+import glob
+import json
+import os
+import time
+
+import pytest
+
+from blobs import (BLOB_HEADERS, BlobStore, CHUNK_CHARS, _apply_delta, _delta, blob_refs, expand_refs,
+                   is_blob_ref, load_blob_table, resolve_value, table_reader)
+from storage import RotatingFileSink, SQLiteSink
+
+
+def _store(tmp_path, **kwargs):
+    return BlobStore(os.path.join(str(tmp_path), "blobs"), min_bytes=100, **kwargs)
+
+
+def test_delta_roundtrips():
+    cases = [
+        (list(range(10)), list(range(12))),                 # Lista que crece por el final
+        (list(range(50)), list(range(5, 55))),              # Ventana desplazada (editLog.slice(-50))
+        ("a" * 100 + "b" * 100, "a" * 100 + "XY" + "b" * 100),
+    ]
+    for base, value in cases:
+        delta = _delta(base, value)
+        assert delta is not None
+        assert _apply_delta(base, delta) == value
+    assert _delta([1, 2], "texto") is None
+    assert _delta("abc" * 10, "xyz" * 10) is None          # Nada en común: no compensa
+
+
+def test_small_fields_stay_inline(tmp_path):
+    store = _store(tmp_path)
+    payload = {"a": "corto", "n": 3}
+    assert store.offload("S-1", payload) is payload
+
+
+def test_offload_and_resolve_with_delta_chain(tmp_path):
+    store = _store(tmp_path, max_chain=2)
+    values = [["edit %d" % i for i in range(20 + n)] for n in range(5)]
+    refs = []
+    for value in values:
+        payload = store.offload("S-1", {"edits": value, "other": 1})
+        assert is_blob_ref(payload["edits"]) and payload["other"] == 1
+        refs.append(payload["edits"]["$blob"])
+    stats = store.describe()
+    assert stats["stored_delta"] >= 2 and stats["stored_full"] >= 2    # La cadena se corta cada max_chain
+    for ref, value in zip(refs, values):
+        assert store.resolve(ref) == value
+
+
+def test_same_value_is_stored_once(tmp_path):
+    store = _store(tmp_path)
+    value = "x" * 500
+    first = store.offload("S-1", {"t": value})["t"]
+    second = store.offload("S-2", {"t": value})["t"]
+    assert first == second
+    assert store.describe()["reused"] == 1
+
+
+def test_blob_refs_in_serialized_payload(tmp_path):
+    store = _store(tmp_path)
+    payload = store.offload("S-1", {"a": "x" * 200, "b": "y" * 200})
+    refs = blob_refs(json.dumps(payload, ensure_ascii=False))
+    assert sorted(refs) == sorted([payload["a"]["$blob"], payload["b"]["$blob"]])
+    assert blob_refs('{"a": 1}') == [] and blob_refs(None) == []
+
+
+def test_pending_rows_are_chunked(tmp_path):
+    store = _store(tmp_path, replicate=True)
+    ref = store.offload("S-1", {"t": "z" * (CHUNK_CHARS + 10)})["t"]["$blob"]
+    digests, rows = store.pending_rows()
+    assert digests == [ref]
+    assert [row[1:3] for row in rows] == [[0, 2], [1, 2]]
+    assert json.loads("".join(row[3] for row in rows)) == {"full": "z" * (CHUNK_CHARS + 10)}
+
+
+def test_other_process_blobs_are_seen_through_disk(tmp_path):
+    writer = _store(tmp_path, replicate=True)       # Worker que recibió el evento
+    leader = _store(tmp_path, replicate=True)       # Flusher elegido, arrancado antes
+    ref = writer.offload("S-1", {"t": "w" * 300})["t"]["$blob"]
+
+    assert leader.unreplicated([ref]) == {ref}
+    digests, rows = leader.pending_rows(max_blobs=0, required={ref})    # Obligatorio aunque no quepa
+    assert digests == [ref] and rows
+    leader.mark_replicated(digests)
+
+    assert writer.unreplicated([ref]) == set()
+    assert writer.pending_rows() == ([], [])
+
+
+def test_orphans_are_found_by_periodic_scan(tmp_path):
+    leader = _store(tmp_path, replicate=True, scan_interval=0.001)
+    other = _store(tmp_path, replicate=True)
+    ref = other.offload("S-1", {"t": "o" * 300})["t"]["$blob"]
+    time.sleep(0.01)
+    digests, _ = leader.pending_rows()
+    assert digests == [ref]
+
+
+def test_missing_blob_file_is_reported(tmp_path):
+    store = _store(tmp_path, replicate=True)
+    ref = store.offload("S-1", {"t": "m" * 300})["t"]["$blob"]
+    os.remove(store._path(ref))
+    # app.py retiene los eventos que lo referencian; pending_rows no se queda atascado
+    assert store.unreplicated_closure([ref]) == (set(), {ref})
+    assert store.pending_rows(required={ref}) == ([], [])
+    assert store.describe()["missing"] == 1
+
+
+def test_delta_bases_are_replicated_with_the_delta(tmp_path):
+    store = _store(tmp_path, replicate=True, max_chain=5)
+    refs = [store.offload("S-1", {"edits": ["edit %d" % i for i in range(20 + n)]})["edits"]["$blob"]
+            for n in range(3)]
+    assert "delta" in json.loads(open(store._path(refs[-1])).read())
+    # Sólo el último evento en el ciclo: van también las dos bases de su cadena
+    digests, _ = store.pending_rows(max_blobs=0, required={refs[-1]})
+    assert sorted(digests) == sorted(refs)
+    store.mark_replicated(refs[:1])
+    assert store.unreplicated_closure([refs[-1]]) == (set(refs[1:]), set())
+
+
+def test_missing_delta_base_is_reported(tmp_path):
+    store = _store(tmp_path, replicate=True)
+    refs = [store.offload("S-1", {"edits": ["edit %d" % i for i in range(20 + n)]})["edits"]["$blob"]
+            for n in range(2)]
+    os.remove(store._path(refs[0]))
+    assert store.unreplicated_closure([refs[1]]) == ({refs[1]}, {refs[0]})
+
+
+@pytest.mark.parametrize("sink", ["sqlite", "csv", "jsonl"])
+def test_values_are_rebuilt_from_the_replicated_table(tmp_path, sink):
+    store = _store(tmp_path, replicate=True, max_chain=3)
+    values = [["edit %d" % i for i in range(20 + n)] for n in range(4)] + [["x" * CHUNK_CHARS] * 2]
+    payloads = [store.offload("S-1", {"edits": value, "n": i}) for i, value in enumerate(values)]
+    digests, rows = store.pending_rows()
+    if sink == "sqlite":
+        target = SQLiteSink(os.path.join(str(tmp_path), "data.db"))
+    else:
+        target = RotatingFileSink(os.path.join(str(tmp_path), "out"), fmt=sink)
+    # En dos escrituras, como dos ciclos; el primer trozo repetido simula un reintento
+    assert target.append_rows("blobs", BLOB_HEADERS, rows[:3]) is None
+    assert target.append_rows("blobs", BLOB_HEADERS, rows[2:]) is None
+    target.close()
+    paths = [target.path] if sink == "sqlite" else glob.glob(os.path.join(str(tmp_path), "out", "blobs-*"))
+
+    # Sin el disco de blobs: sólo la tabla
+    read = table_reader(load_blob_table(paths))
+    for payload, value in zip(payloads, values):
+        assert resolve_value(payload["edits"]["$blob"], read) == value
+        assert expand_refs(payload, read) == {"edits": value, "n": payload["n"]}
+
+
+def test_incomplete_blob_in_table_is_not_resolved(tmp_path):
+    store = _store(tmp_path, replicate=True)
+    ref = store.offload("S-1", {"t": "z" * (CHUNK_CHARS + 10)})["t"]["$blob"]
+    _, rows = store.pending_rows()
+    sink = SQLiteSink(os.path.join(str(tmp_path), "data.db"))
+    sink.append_rows("blobs", BLOB_HEADERS, rows[:1])
+    sink.close()
+    with pytest.raises(KeyError):
+        resolve_value(ref, table_reader(load_blob_table([sink.path])))
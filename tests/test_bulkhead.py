@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bulkhead import Bulkhead, BulkheadFull
+
+
+def test_admits_up_to_max_concurrent_and_releases_once():
+    bulkhead = Bulkhead("t", max_concurrent=2)
+    first, second = bulkhead.acquire(), bulkhead.acquire()
+    assert bulkhead.describe()["active"] == 2
+    first.release()
+    first.release()     # Idempotente
+    assert bulkhead.describe()["active"] == 1
+    second.release()
+    info = bulkhead.describe()
+    assert info["active"] == 0 and info["admitted"] == 2 and info["completed"] == 2
+
+
+def test_full_queue_rejects_immediately():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=0, queue_timeout=5)
+    permit = bulkhead.acquire()
+    started = time.monotonic()
+    with pytest.raises(BulkheadFull) as exc:
+        bulkhead.acquire()
+    assert exc.value.reason == "queue_full" and time.monotonic() - started < 1
+    permit.release()
+    assert bulkhead.describe()["rejected_queue_full"] == 1
+
+
+def test_waiter_times_out():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    permit = bulkhead.acquire()
+    with pytest.raises(BulkheadFull) as exc:
+        bulkhead.acquire()
+    assert exc.value.reason == "queue_timeout" and exc.value.retry_after == 1
+    permit.release()
+    info = bulkhead.describe()
+    assert info["rejected_queue_timeout"] == 1 and info["waiting"] == 0
+
+
+def test_waiter_gets_the_released_slot():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=1, queue_timeout=5)
+    permit = bulkhead.acquire()
+    threading.Timer(0.05, permit.release).start()
+    bulkhead.acquire().release()
+    assert bulkhead.describe()["queued"] == 1
+
+
+def test_try_acquire_never_waits():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=4, queue_timeout=5)
+    permit = bulkhead.try_acquire()
+    assert permit is not None
+    started = time.monotonic()
+    assert bulkhead.try_acquire() is None
+    assert time.monotonic() - started < 0.5
+    permit.release()
+    info = bulkhead.describe()
+    # Sin hueco no es un rechazo: la ruta tiene su alternativa
+    assert info["not_waited"] == 1 and info["rejected_queue_full"] == 0 and info["queued"] == 0
+    bulkhead.try_acquire().release()
+
+
+def test_call_releases_on_error():
+    bulkhead = Bulkhead("t", max_concurrent=1)
+    with pytest.raises(ValueError):
+        bulkhead.call(lambda: (_ for _ in ()).throw(ValueError("x")))
+    assert bulkhead.describe()["active"] == 0
+    assert bulkhead.call(lambda a, b=0: a + b, 1, b=2) == 3
+
+
+def test_acquire_async_shares_counters_with_threads():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=1, queue_timeout=5)
+    permit = bulkhead.acquire()
+    threading.Timer(0.05, permit.release).start()
+
+    async def main():
+        return await bulkhead.acquire_async()
+
+    asyncio.run(main()).release()
+    info = bulkhead.describe()
+    assert info["admitted"] == 2 and info["active"] == 0 and info["waiting"] == 0
+
+
+def test_acquire_async_times_out():
+    bulkhead = Bulkhead("t", max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    permit = bulkhead.acquire()
+
+    async def main():
+        await bulkhead.acquire_async()
+
+    with pytest.raises(BulkheadFull):
+        asyncio.run(main())
+    permit.release()
+    assert bulkhead.describe()["waiting"] == 0
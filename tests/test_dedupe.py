@@ -0,0 +1,58 @@
+from dedupe import EventDeduper
+
+
+def _event(subject, event_id):
+    return {"subject_id": subject, "event_id": event_id}
+
+
+def test_duplicates_are_dropped_per_subject():
+    deduper = EventDeduper()
+    fresh, duplicates = deduper.filter([_event("A", "A-1"), _event("A", "A-2"), _event("A", "A-1")])
+    assert [e["event_id"] for e in fresh] == ["A-1", "A-2"] and duplicates == 1
+    # Mismo event_id de otro participante: no es duplicado
+    fresh, duplicates = deduper.filter([_event("B", "A-1")])
+    assert len(fresh) == 1 and duplicates == 0
+
+
+def test_events_without_id_always_pass():
+    deduper = EventDeduper()
+    fresh, duplicates = deduper.filter([{"subject_id": "A"}, {"subject_id": "A"}])
+    assert len(fresh) == 2 and duplicates == 0
+    assert deduper.filter_ids("A", [None, ""]) == [True, True]
+    assert deduper.describe()["without_id"] == 4
+
+
+def test_filter_ids_and_forget_ids():
+    deduper = EventDeduper()
+    assert deduper.filter_ids("A", ["1", "2", "1"]) == [True, True, False]
+    deduper.forget_ids("A", ["1"])
+    assert deduper.filter_ids("A", ["1", "2"]) == [True, False]
+
+
+def test_forget_accepts_retry_of_unsaved_events():
+    deduper = EventDeduper()
+    events = [_event("A", "A-1")]
+    deduper.filter(events)
+    deduper.forget(events)
+    fresh, duplicates = deduper.filter(events)
+    assert len(fresh) == 1 and duplicates == 0
+
+
+def test_ids_per_subject_are_bounded_lru():
+    deduper = EventDeduper(max_ids_per_subject=3)
+    assert deduper.filter_ids("A", ["1", "2", "3"]) == [True] * 3
+    assert deduper.filter_ids("A", ["1"]) == [False]       # "1" pasa a ser el más reciente
+    assert deduper.filter_ids("A", ["4"]) == [True]        # Expulsa "2", el menos reciente
+    assert deduper.filter_ids("A", ["1", "3", "2"]) == [False, False, True]
+
+
+def test_subjects_are_bounded_lru():
+    deduper = EventDeduper(max_subjects=2)
+    deduper.filter_ids("A", ["1"])
+    deduper.filter_ids("B", ["1"])
+    deduper.filter_ids("A", ["2"])     # A es el más reciente
+    deduper.filter_ids("C", ["1"])     # Expulsa B
+    stats = deduper.describe()
+    assert stats["subjects"] == 2 and stats["evicted_subjects"] == 1
+    assert deduper.filter_ids("A", ["1"]) == [False]
+    assert deduper.filter_ids("B", ["1"]) == [True]
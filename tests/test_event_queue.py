@@ -0,0 +1,115 @@
+import os
+
+from event_queue import BoundedEventQueue, EventRecord, QUEUE_ACCEPTED, QUEUE_SPILLED, QUEUE_REJECTED
+from wal import SegmentedLog
+
+
+def _row(n):
+    return ["2026-01-01T00:00:00Z", "S-1", "p", f"e{n}", n, 0, "", "{}"]
+
+
+def _record_bytes():
+    return EventRecord(_row(0)).nbytes
+
+
+def _drain(queue):
+    out = []
+    while True:
+        rows, token = queue.peek_batch(100)
+        if not rows:
+            return out
+        out.extend(row[3] for row in rows)
+        queue.commit(token)
+
+
+def test_peek_does_not_remove_until_commit():
+    queue = BoundedEventQueue(max_bytes=10**6)
+    assert queue.put([_row(1), _row(2)]) == QUEUE_ACCEPTED
+    rows, token = queue.peek_batch(1)
+    assert [r[3] for r in rows] == ["e1"] and len(queue) == 2
+    rows_again, _ = queue.peek_batch(1)
+    assert rows_again == rows           # Un fallo de escritura no pierde ni reordena nada
+    queue.commit(token)
+    assert len(queue) == 1 and queue.oldest()[3] == "e2"
+
+
+def test_rejects_when_full_without_spill():
+    queue = BoundedEventQueue(max_bytes=2 * _record_bytes())
+    assert queue.put([_row(1), _row(2)]) == QUEUE_ACCEPTED
+    assert queue.put([_row(3)]) == QUEUE_REJECTED
+    assert len(queue) == 2 and queue.describe()["rejected"] == 1
+    assert queue.backpressure()
+
+
+def test_spill_keeps_fifo_order(tmp_path):
+    spill = os.path.join(str(tmp_path), "spill")
+    queue = BoundedEventQueue(max_bytes=2 * _record_bytes(), spill_dir=spill, spill_max_bytes=10**6)
+    assert queue.put([_row(1), _row(2)]) == QUEUE_ACCEPTED
+    assert queue.put([_row(3)]) == QUEUE_SPILLED
+    # Aunque se libere memoria, mientras haya spill lo nuevo va detrás en disco
+    rows, token = queue.peek_batch(1)
+    queue.commit(token)
+    assert queue.put([_row(4)]) == QUEUE_SPILLED
+    assert _drain(queue) == ["e2", "e3", "e4"]
+    assert len(queue) == 0
+    assert queue.put([_row(5)]) == QUEUE_ACCEPTED      # Spill vacío: vuelve a memoria
+
+
+def test_spill_is_bounded(tmp_path):
+    queue = BoundedEventQueue(max_bytes=0, spill_dir=os.path.join(str(tmp_path), "spill"),
+                              spill_max_bytes=_record_bytes())
+    assert queue.put([_row(1)]) == QUEUE_SPILLED
+    assert queue.put([_row(2)]) == QUEUE_REJECTED
+
+
+def test_spill_survives_restart(tmp_path):
+    spill = os.path.join(str(tmp_path), "spill")
+    queue = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    queue.put([_row(1), _row(2)])
+    rows, token = queue.peek_batch(1)
+    queue.commit(token)
+    queue.close()       # El proceso muere: el sistema operativo suelta el lock del spill
+
+    restarted = BoundedEventQueue(max_bytes=10**6, spill_dir=spill, spill_max_bytes=10**6)
+    assert len(restarted) == 1
+    assert _drain(restarted) == ["e2"]
+    assert restarted.describe()["spill_orphans"] == 0      # Vaciado y borrado
+    assert os.listdir(spill) == []
+
+
+def test_workers_sharing_spill_dir_do_not_mix(tmp_path):
+    spill = os.path.join(str(tmp_path), "spill")
+    first = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    second = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    first.put([_row(1), _row(2)])
+    second.put([_row(3)])
+    assert len(os.listdir(spill)) == 2
+    # Un worker que arranca mientras los otros viven no adopta nada
+    third = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    assert len(third) == 0
+    assert _drain(first) == ["e1", "e2"] and _drain(second) == ["e3"]
+
+
+def test_orphaned_spill_is_adopted_once(tmp_path):
+    spill = os.path.join(str(tmp_path), "spill")
+    dead = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    dead.put([_row(1), _row(2)])
+    dead.close()
+
+    heir = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    other = BoundedEventQueue(max_bytes=0, spill_dir=spill, spill_max_bytes=10**6)
+    assert len(heir) == 2 and len(other) == 0
+    heir.put([_row(3)])
+    # Lo heredado sale antes que el spill propio
+    assert _drain(heir) == ["e1", "e2", "e3"]
+    assert len(os.listdir(spill)) == 1      # Sólo queda el spill propio del heredero
+
+
+def test_spill_in_root_from_older_versions_is_adopted(tmp_path):
+    spill = os.path.join(str(tmp_path), "spill")
+    old = SegmentedLog(spill)
+    old.append([_row(1)])
+    old.close()
+    queue = BoundedEventQueue(max_bytes=10**6, spill_dir=spill, spill_max_bytes=10**6)
+    assert _drain(queue) == ["e1"]
+    assert not any(name.endswith(".wal") for name in os.listdir(spill))
@@ -0,0 +1,114 @@
+import os
+
+from outbox import ResultsOutbox, OUTBOX_QUEUED, OUTBOX_UPDATED, OUTBOX_DUPLICATE
+
+
+def test_put_is_idempotent_per_key(tmp_path):
+    outbox = ResultsOutbox(os.path.join(str(tmp_path), "outbox.db"))
+    assert outbox.put("S-1", ["S-1", "v1"]) == OUTBOX_QUEUED
+    assert outbox.put("S-1", ["S-1", "v2"]) == OUTBOX_UPDATED
+    assert outbox.pending(10) == [("S-1", ["S-1", "v2"], 0)]
+
+    outbox.mark_delivered(["S-1"])
+    assert outbox.put("S-1", ["S-1", "v3"]) == OUTBOX_DUPLICATE
+    assert outbox.pending(10) == []
+
+
+def test_attempts_are_counted_and_survive_reopen(tmp_path):
+    path = os.path.join(str(tmp_path), "outbox.db")
+    outbox = ResultsOutbox(path)
+    outbox.put("S-1", ["S-1"])
+    outbox.put("S-2", ["S-2"])
+    outbox.mark_attempt(["S-1"])
+    outbox.record_error(["S-1"], "timeout")
+
+    reopened = ResultsOutbox(path)
+    assert [(key, attempts) for key, _, attempts in reopened.pending(10)] == [("S-1", 1), ("S-2", 0)]
+    stats = reopened.stats()
+    assert stats["pending"] == 2 and stats["delivered"] == 0
+
+
+def test_pending_is_oldest_first_and_limited(tmp_path):
+    outbox = ResultsOutbox(os.path.join(str(tmp_path), "outbox.db"))
+    for i in range(5):
+        outbox.put(f"S-{i}", [i])
+    assert [key for key, _, _ in outbox.pending(3)] == ["S-0", "S-1", "S-2"]
+
+
+def test_two_outboxes_on_one_file_never_claim_the_same_row(tmp_path):
+    # Dos workers con su propia ResultsOutbox sobre el mismo fichero
+    path = os.path.join(str(tmp_path), "outbox.db")
+    first, second = ResultsOutbox(path), ResultsOutbox(path)
+    for i in range(5):
+        first.put(f"S-{i}", [i])
+    mine = first.claim(3, "w1", lease_sec=60)
+    theirs = second.claim(10, "w2", lease_sec=60)
+    assert [key for key, _, _ in mine] == ["S-0", "S-1", "S-2"]
+    assert [key for key, _, _ in theirs] == ["S-3", "S-4"]
+    assert second.claim(10, "w2", lease_sec=60) == []
+
+
+def test_claims_run_concurrently_without_overlap(tmp_path):
+    import threading
+
+    path = os.path.join(str(tmp_path), "outbox.db")
+    seed = ResultsOutbox(path)
+    for i in range(200):
+        seed.put(f"S-{i:03d}", [i])
+    outboxes = [ResultsOutbox(path) for _ in range(4)]
+    claimed = [[] for _ in outboxes]
+
+    def worker(n):
+        while True:
+            items = outboxes[n].claim(7, f"w{n}", lease_sec=60)
+            if not items:
+                return
+            claimed[n].extend(key for key, _, _ in items)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(len(outboxes))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    keys = [key for keys in claimed for key in keys]
+    assert len(keys) == 200 and len(set(keys)) == 200
+
+
+def test_release_error_and_expired_lease_make_rows_claimable(tmp_path):
+    path = os.path.join(str(tmp_path), "outbox.db")
+    first, second = ResultsOutbox(path), ResultsOutbox(path)
+    for key in ("S-1", "S-2", "S-3"):
+        first.put(key, [key])
+    first.claim(3, "w1", lease_sec=60)
+    first.release(["S-1"])
+    first.mark_attempt(["S-2"])
+    first.record_error(["S-2"], "timeout")
+    # S-3 sigue reservada por w1
+    assert [(key, attempts) for key, _, attempts in second.claim(10, "w2", 60)] == [("S-1", 0), ("S-2", 1)]
+    assert second.last_attempt(["S-1", "S-2"]) > 0 and second.last_attempt(["S-1"]) == 0.0
+
+    second.mark_delivered(["S-1", "S-2"])
+    assert [key for key, _, _ in first.pending(10)] == ["S-3"]
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    path = os.path.join(str(tmp_path), "outbox.db")
+    first, second = ResultsOutbox(path), ResultsOutbox(path)
+    first.put("S-1", ["S-1"])
+    # El worker murió con el lease tomado: al caducar, otro la reclama
+    assert [key for key, _, _ in first.claim(10, "w1", lease_sec=-1)] == ["S-1"]
+    assert [key for key, _, _ in second.claim(10, "w2", lease_sec=60)] == ["S-1"]
+    assert first.claim(10, "w1", lease_sec=60) == []
+
+
+def test_old_outbox_files_are_migrated(tmp_path):
+    import sqlite3
+
+    path = os.path.join(str(tmp_path), "outbox.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE outbox (key TEXT PRIMARY KEY, row TEXT NOT NULL, created_at REAL NOT NULL,"
+                 " attempts INTEGER NOT NULL DEFAULT 0, delivered_at REAL, last_error TEXT)")
+    conn.execute("INSERT INTO outbox (key, row, created_at) VALUES ('S-1', '[1]', 1.0)")
+    conn.commit()
+    conn.close()
+    assert ResultsOutbox(path).claim(10, "w1", 60) == [("S-1", [1], 0)]
@@ -0,0 +1,95 @@
+import pytest
+
+from shards import SHARD_INDEX_HEADERS, Shard, ShardPlanner
+
+
+def _rows(n, subject="S-1", ts="2026-10-17T10:00:00Z"):
+    return [[ts, subject, "p", "e", 0, 0, "", "{}"] for _ in range(n)]
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ShardPlanner("Sheet", mode="weekly")
+
+
+def test_rows_mode_rolls_over_before_writing():
+    planner = ShardPlanner("Sheet", max_rows=10)
+    shard, closed = planner.rollover()
+    assert shard.name == "events_0001" and closed is None
+    shard.record(_rows(8))
+    assert planner.rollover() == (shard, None)
+    shard.record(_rows(5))          # Un lote no se parte: puede pasar de max_rows
+    assert shard.rows == 13
+
+    new, closed = planner.rollover()
+    assert new.name == "events_0002" and closed is shard
+    assert closed.status == "closed" and closed.closed_at
+    assert planner.unindexed == [shard, new]
+
+
+def test_daily_mode_rolls_over_on_new_day():
+    planner = ShardPlanner("Sheet", mode="daily")
+    shard, _ = planner.rollover(today="2026-10-17")
+    assert shard.name == "events_2026_10_17"
+    shard.record(_rows(10**6))      # En modo diario el tamaño no rota
+    assert planner.rollover(today="2026-10-17") == (shard, None)
+    new, closed = planner.rollover(today="2026-10-18")
+    assert new.name == "events_2026_10_18" and closed is shard
+
+
+def test_shards_move_to_new_spreadsheets():
+    planner = ShardPlanner("Sheet", per_spreadsheet=2)
+    assert [planner.spreadsheet_for(seq) for seq in (1, 2, 3, 5)] == \
+        ["Sheet", "Sheet", "Sheet (events 02)", "Sheet (events 03)"]
+
+
+def test_index_row_roundtrip_and_summary():
+    shard = Shard("events_0001", "Sheet", 1)
+    shard.record(_rows(2, "S-2", "2026-10-17T10:00:05Z") + _rows(1, "S-1", "2026-10-17T09:00:00Z"))
+    row = shard.to_index_row()
+    assert len(row) == len(SHARD_INDEX_HEADERS)
+    restored = Shard.from_index_row([str(v) for v in row], 1, 2)
+    assert restored.rows == 3 and restored.subjects == {"S-1", "S-2"}
+    assert (restored.first_ts, restored.last_ts) == ("2026-10-17T09:00:00Z", "2026-10-17T10:00:05Z")
+    assert restored.index_row == 2 and not restored.dirty
+
+
+def test_restore_continues_open_shard():
+    planner = ShardPlanner("Sheet", max_rows=100)
+    closed = Shard("events_0001", "Sheet", 1)
+    closed.close()
+    open_shard = Shard("events_0002", "Sheet", 2)
+    open_shard.record(_rows(40))
+    planner.restore([SHARD_INDEX_HEADERS, closed.to_index_row(), open_shard.to_index_row()])
+    assert planner.restored
+    shard, closed_now = planner.rollover()
+    assert shard.name == "events_0002" and shard.rows == 40 and closed_now is None
+
+    planner.restore([SHARD_INDEX_HEADERS, closed.to_index_row()])
+    shard, _ = planner.rollover()
+    assert shard.name == "events_0002" and shard.rows == 0      # Todo cerrado: se abre el siguiente
+
+
+def test_restore_after_mode_change_rolls_over():
+    planner = ShardPlanner("Sheet", mode="daily")
+    planner.restore([SHARD_INDEX_HEADERS, Shard("events_0001", "Sheet", 1).to_index_row()])
+    shard, closed = planner.rollover(today="2026-10-17")
+    assert shard.name == "events_2026_10_17" and closed.name == "events_0001"
+
+
+def test_subject_ids_are_truncated_for_the_cell_limit():
+    shard = Shard("events_0001", "Sheet", 1)
+    shard.record([["", f"S-{i:06d}", "", "", 0, 0, "", ""] for i in range(10000)])
+    ids = shard.to_index_row()[-1]
+    assert len(ids) <= 45002 and ids.endswith(",…")
+    assert shard.to_index_row()[9] == 10000
+
+
+def test_index_due_and_written():
+    planner = ShardPlanner("Sheet", index_interval=0)
+    shard, _ = planner.rollover()
+    assert planner.index_due()
+    planner.index_written(shard, True)
+    assert shard not in planner.unindexed
+    planner.index_written(shard, False)
+    assert planner.describe()["index_failures"] == 1
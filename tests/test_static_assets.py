@@ -0,0 +1,70 @@
+import threading
+
+import static_assets
+from static_assets import StaticAssets
+
+
+def _public(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "a.js").write_text("var a = 1;\n" * 300)
+    (tmp_path / "js" / "b.js").write_text("var b = 2;\n" * 300)
+    (tmp_path / "js" / "app.js").write_text("start();\n" * 300)
+    (tmp_path / "extra.css").write_text("body { margin: 0 }\n" * 100)
+    (tmp_path / "index.html").write_text(
+        "<html><head>\n"
+        "<!-- bundle: vendor.js -->\n"
+        '<script src="js/a.js"></script>\n<script src="js/b.js"></script>\n'
+        "<!-- /bundle -->\n"
+        '<script src="js/app.js?v=3"></script>\n'
+        '<script src="https://cdn.example.com/x.js"></script>\n'
+        "</head></html>\n")
+    return tmp_path
+
+
+def test_build_precompresses_files_linked_from_index(tmp_path):
+    assets = StaticAssets(str(_public(tmp_path)))
+    manifest = assets.build()
+    assert manifest["vendor.js"].startswith("assets/vendor.")
+    # app.js (fuera del bundle) ya está en memoria y comprimido antes de la primera petición
+    assert assets.stats["preloaded"] == 1
+    app_js = assets.get("js/app.js")
+    assert "gzip" in app_js.variants
+    assert assets.stats["loads"] == 0 and assets.stats["hits"] == 1
+    # Lo que no enlaza el index se carga al pedirlo
+    assert assets.get("extra.css") is not None and assets.stats["loads"] == 1
+
+
+def test_concurrent_first_requests_load_once(tmp_path, monkeypatch):
+    assets = StaticAssets(str(_public(tmp_path)))
+    built, release = [], threading.Event()
+    original = static_assets.Asset
+
+    def slow_asset(*args, **kwargs):
+        built.append(args[0])
+        release.wait(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(static_assets, "Asset", slow_asset)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(assets.get("extra.css"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert built == ["extra.css"]
+    assert len(results) == 8 and all(r is results[0] for r in results)
+    assert assets.stats["loads"] == 1 and assets.stats["hits"] == 7
+
+
+def test_paths_outside_root_and_missing_files(tmp_path):
+    assets = StaticAssets(str(_public(tmp_path)))
+    assert assets.get("../index.html") is None
+    assert assets.get("missing.js") is None
+
+
+def test_files_over_budget_are_served_from_disk(tmp_path):
+    assets = StaticAssets(str(_public(tmp_path)), max_bytes=100)
+    assert assets.get("extra.css") is None
+    assert assets.get("extra.css") is None
+    assert assets.stats["disk"] == 2
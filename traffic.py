@@ -0,0 +1,216 @@
+# =============================================================
+# Shadow AI — Grabación de tráfico real (middleware WSGI, opt-in)
+# =============================================================
+# Guarda en JSONL rotados (traffic-<fecha>-<n>.jsonl, vía RotatingFileSink)
+# una muestra de las peticiones a las rutas de la API: llegada, método, ruta,
+# cabeceras relevantes, cuerpo JSON ya descomprimido y con los campos
+# personales sustituidos por "[redacted]", status y tiempo hasta las cabeceras.
+# replay.py reproduce estos ficheros contra otra instancia.
+#
+# - El muestreo es por participante (crc32 del subject_id): se graba la sesión
+#   completa de una fracción de participantes, con sus ráfagas reales. Las
+#   peticiones sin subject_id se muestrean al azar con la misma tasa.
+# - Los cuerpos que no son JSON, o que pasan de max_body_bytes, se graban sin
+#   cuerpo (no se pueden redactar).
+# - En modo ASGI graba asgi.py con begin()/finish() (también rutas nativas y
+#   sus 413/503) y marca el environ para que el middleware no la duplique.
+# - La escritura va en un hilo aparte con cola acotada: si se llena se
+#   descartan registros y se cuentan, la petición nunca espera al disco.
+
+import io
+import os
+import re
+import json
+import zlib
+import glob
+import queue
+import random
+import logging
+import threading
+import time as _time
+
+from storage import RotatingFileSink
+
+log = logging.getLogger("shadowai.traffic")
+
+TRAFFIC_TABLE = "traffic"
+TRAFFIC_FIELDS = ["ts", "method", "path", "query", "headers", "encoding", "json", "body_bytes",
+                  "status", "duration_ms", "request_id"]
+REDACTED = "[redacted]"
+RECORDED = "shadowai.traffic_recorded"   # Clave del environ: ya grabada (p. ej. por asgi.py)
+
+# Cabeceras que se guardan (nunca cookies, autorización ni IPs)
+_HEADERS = ("CONTENT_TYPE", "HTTP_CONTENT_ENCODING", "HTTP_ACCEPT", "HTTP_ACCEPT_ENCODING", "HTTP_X_REQUEST_ID")
+_SUBJECT_RE = re.compile(rb'"subject_id"\s*:\s*"([^"]{1,128})"')
+
+
+def redact(value, fields):
+    """Copia de `value` con los campos de `fields` (en minúsculas) sustituidos, a cualquier profundidad."""
+    if isinstance(value, dict):
+        return {k: (REDACTED if str(k).lower() in fields and v not in (None, "") else redact(v, fields))
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, fields) for v in value]
+    return value
+
+
+class TrafficRecorder:
+    """Middleware WSGI: app.wsgi_app = TrafficRecorder(app.wsgi_app, ...)."""
+
+    def __init__(self, wsgi_app, directory, sample_rate=0.1, paths=(), redact_fields=("email",),
+                 max_file_bytes=50 * 1024 * 1024, max_files=20, max_body_bytes=512 * 1024, queue_size=5000):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.paths = set(paths)
+        self.redact_fields = {f.lower() for f in redact_fields}
+        self.max_files = max_files
+        self.max_body_bytes = max_body_bytes
+        self._sink = RotatingFileSink(directory, "jsonl", max_file_bytes)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threshold = int(sample_rate * 10000)
+        self.stats = {"seen": 0, "recorded": 0, "dropped": 0, "unparsed_bodies": 0, "files_pruned": 0}
+        threading.Thread(target=self._writer, name="traffic-recorder", daemon=True).start()
+
+    # ── Muestreo ──
+    def _sampled(self, body, encoding):
+        if body and encoding == "gzip":
+            try:    # Los lotes grandes llegan comprimidos; el subject_id va al principio
+                body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, 4096)
+            except zlib.error:
+                body = None
+        match = _SUBJECT_RE.search(body) if body else None
+        if match is not None:
+            return zlib.crc32(match.group(1)) % 10000 < self._threshold
+        return random.random() < self.sample_rate
+
+    def _read_body(self, environ):
+        """Lee el cuerpo y lo repone para la app. None si no hay o es demasiado grande."""
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return None
+        if length <= 0 or length > self.max_body_bytes:
+            return None
+        body = environ["wsgi.input"].read(length)
+        environ["wsgi.input"] = io.BytesIO(body)
+        return body
+
+    def _decode(self, body, encoding):
+        """JSON redactado del cuerpo (descomprimido), o None si no se puede interpretar."""
+        try:
+            if encoding in ("gzip", "deflate"):
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS)
+            elif encoding:
+                return None
+            return redact(json.loads(body), self.redact_fields)
+        except Exception:
+            return None
+
+    def begin(self, environ, body):
+        """Registro a medio hacer si la petición se graba (ruta y muestreo), si no None."""
+        if (environ.get(RECORDED) or environ.get("REQUEST_METHOD") == "OPTIONS"
+                or environ.get("PATH_INFO") not in self.paths):
+            return None
+        self.stats["seen"] += 1
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower() or None
+        if self.sample_rate < 1 and not self._sampled(body, encoding):
+            return None
+        environ[RECORDED] = True
+        return {
+            "ts": round(_time.time(), 4), "method": environ.get("REQUEST_METHOD"), "path": environ.get("PATH_INFO"),
+            "query": environ.get("QUERY_STRING", ""),
+            "headers": {k: environ[k] for k in _HEADERS if environ.get(k)},
+            "encoding": encoding, "json": None, "body_bytes": len(body) if body else 0,
+            "_started": _time.perf_counter(),
+        }
+
+    def finish(self, record, body, status, request_id=None):
+        """Completa el registro al enviar las cabeceras de la respuesta y lo encola."""
+        record["status"] = status
+        record["duration_ms"] = round((_time.perf_counter() - record.pop("_started")) * 1000, 2)
+        record["request_id"] = request_id
+        # El cuerpo se descomprime y redacta en el hilo escritor, fuera de la petición
+        try:
+            self._queue.put_nowait((record, body))
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def __call__(self, environ, start_response):
+        if environ.get(RECORDED) or environ.get("PATH_INFO") not in self.paths:
+            return self.wsgi_app(environ, start_response)
+        body = self._read_body(environ)
+        record = self.begin(environ, body)
+        if record is None:
+            return self.wsgi_app(environ, start_response)
+
+        def recording_start_response(status, headers, exc_info=None):
+            self.finish(record, body, int(status.split(" ", 1)[0]),
+                        next((v for k, v in headers if k.lower() == "x-request-id"), None))
+            return start_response(status, headers, exc_info) if exc_info is not None else start_response(status, headers)
+
+        return self.wsgi_app(environ, recording_start_response)
+
+    # ── Hilo escritor ──
+    def _writer(self):
+        active = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = []
+            for record, body in batch:
+                if body:
+                    record["json"] = self._decode(body, record["encoding"])
+                    if record["json"] is None:
+                        self.stats["unparsed_bodies"] += 1
+                rows.append([record.get(field) for field in TRAFFIC_FIELDS])
+            if self._sink.append_rows(TRAFFIC_TABLE, TRAFFIC_FIELDS, rows) is None:
+                self.stats["recorded"] += len(rows)
+            current = self._sink.describe()["active_files"].get(TRAFFIC_TABLE)
+            if current != active:
+                active = current
+                self._prune(active)
+
+    def _prune(self, active):
+        """Borra los ficheros más antiguos (por mtime: la numeración se reutiliza) por encima de max_files."""
+        if self.max_files <= 0:
+            return
+        files = [path for path in glob.glob(os.path.join(self.directory, f"{TRAFFIC_TABLE}-*.jsonl")) if path != active]
+        files.sort(key=os.path.getmtime)
+        for path in files[:max(0, len(files) - (self.max_files - 1))]:
+            try:
+                os.remove(path)
+                self.stats["files_pruned"] += 1
+            except OSError as e:
+                log.warning(f"⚠️ traffic: no se pudo borrar '{path}': {type(e).__name__}: {e}")
+
+    def describe(self):
+        return dict(self.stats, pending=self._queue.qsize(), sample_rate=self.sample_rate,
+                    directory=self.directory, active_file=self._sink.describe()["active_files"].get(TRAFFIC_TABLE))
+
+
+def load_recordings(paths):
+    """Registros de uno o varios ficheros/directorios JSONL, ordenados por llegada."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, f"{TRAFFIC_TABLE}-*.jsonl"))))
+        else:
+            files.append(path)
+    records = []
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue    # Última línea a medio escribir
+    records.sort(key=lambda r: r.get("ts") or 0)
+    return records
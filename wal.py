@@ -0,0 +1,272 @@
+# =============================================================
+# Shadow AI — Write-ahead log segmentado para la cola de eventos
+# =============================================================
+# Log append-only en disco. Cada registro se guarda como:
+#
+#     [longitud: uint32 BE][crc32: uint32 BE][payload JSON UTF-8]
+#
+# Los registros se numeran con un offset lógico global (0, 1, 2...).
+# Cada segmento se llama events-<offset del primer registro>.wal y se rota
+# al superar segment_max_bytes. El offset confirmado (ya escrito en Sheets)
+# se guarda en committed.offset; los segmentos completamente confirmados
+# se borran. Al arrancar se valida el último segmento y se trunca cualquier
+# registro incompleto o corrupto (escritura cortada por un crash).
+
+import os
+import logging
+import json
+import struct
+import threading
+import zlib
+
+log = logging.getLogger("shadowai.wal")
+
+_HEADER = struct.Struct(">II")
+_SEGMENT_PREFIX = "events-"
+_SEGMENT_SUFFIX = ".wal"
+_COMMIT_FILE = "committed.offset"
+
+
+class WALCorruptionError(Exception):
+    """Registro con checksum inválido o truncado dentro de un segmento."""
+
+
+def _segment_name(base_offset):
+    return f"{_SEGMENT_PREFIX}{base_offset:020d}{_SEGMENT_SUFFIX}"
+
+
+def _fsync_dir(directory):
+    """fsync del directorio para que creaciones/renombrados sean duraderos (no-op en Windows)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _read_record(f):
+    """Lee un registro desde la posición actual. Devuelve None al final del archivo."""
+    header = f.read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise WALCorruptionError("cabecera truncada")
+    length, crc = _HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        raise WALCorruptionError("payload truncado")
+    if zlib.crc32(payload) & 0xFFFFFFFF != crc:
+        raise WALCorruptionError("checksum inválido")
+    return payload
+
+
+class SegmentedLog:
+    """Log segmentado y con checksum; append() hace fsync antes de devolver."""
+
+    def __init__(self, directory, segment_max_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._cursor = None     # (offset, base_segmento, posición) del último read_batch
+        os.makedirs(directory, exist_ok=True)
+
+        self._committed = self._load_committed()
+        self._segments = self._list_segments()     # bases ordenadas
+        if not self._segments:
+            self._segments = [self._committed]
+        self._next_offset = self._recover_active_segment()
+        if self._committed > self._next_offset:
+            # committed.offset por delante del log (segmentos borrados a mano)
+            self._committed = self._next_offset
+        self._active = open(self._segment_path(self._segments[-1]), "ab")
+
+    # ── Helpers de archivos ──
+    def _segment_path(self, base):
+        return os.path.join(self.directory, _segment_name(base))
+
+    def _list_segments(self):
+        bases = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                try:
+                    bases.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(bases)
+
+    def _load_committed(self):
+        try:
+            with open(os.path.join(self.directory, _COMMIT_FILE), "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _recover_active_segment(self):
+        """Valida el último segmento y trunca la cola corrupta. Devuelve el siguiente offset."""
+        base = self._segments[-1]
+        path = self._segment_path(base)
+        count, good_pos = 0, 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        if _read_record(f) is None:
+                            break
+                    except WALCorruptionError as e:
+                        log.warning(f"⚠️ WAL: segmento {_segment_name(base)} corrupto en byte {good_pos} ({e}), truncando")
+                        break
+                    count += 1
+                    good_pos = f.tell()
+            if good_pos < os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(good_pos)
+                    f.flush()
+                    os.fsync(f.fileno())
+        return base + count
+
+    # ── Escritura ──
+    def append(self, records):
+        """Añade registros (objetos JSON-serializables) y hace fsync. Devuelve el offset siguiente."""
+        if not records:
+            return self._next_offset
+        encoded = []
+        for record in records:
+            payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            encoded.append(_HEADER.pack(len(payload), zlib.crc32(payload) & 0xFFFFFFFF) + payload)
+        data = b"".join(encoded)
+
+        with self._lock:
+            if self._active.tell() > 0 and self._active.tell() + len(data) > self.segment_max_bytes:
+                self._rotate()
+            self._active.write(data)
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._next_offset += len(records)
+            return self._next_offset
+
+    def _rotate(self):
+        """Cierra el segmento activo y abre uno nuevo (llamar con _lock adquirido)."""
+        self._active.close()
+        base = self._next_offset
+        self._segments.append(base)
+        self._active = open(self._segment_path(base), "ab")
+        _fsync_dir(self.directory)
+
+    # ── Lectura ──
+    def read_batch(self, start_offset, max_records, remember=True):
+        """Lee hasta max_records registros desde start_offset. Devuelve (registros, offset_final).
+        remember=False no guarda el cursor (lecturas sueltas que no deben mover el del consumidor)."""
+        with self._lock:
+            end_limit = self._next_offset
+            segments = list(self._segments)
+            cursor = self._cursor
+        if start_offset >= end_limit:
+            return [], start_offset
+
+        records = []
+        offset = start_offset
+        # Segmento que contiene start_offset
+        idx = 0
+        for i, base in enumerate(segments):
+            if base <= offset:
+                idx = i
+        while idx < len(segments) and len(records) < max_records and offset < end_limit:
+            base = segments[idx]
+            seg_end = segments[idx + 1] if idx + 1 < len(segments) else end_limit
+            try:
+                f = open(self._segment_path(base), "rb")
+            except FileNotFoundError:
+                idx += 1
+                offset = max(offset, seg_end)
+                continue
+            with f:
+                if cursor and cursor[0] == offset and cursor[1] == base:
+                    f.seek(cursor[2])
+                    current = offset
+                else:
+                    current = base
+                try:
+                    while current < seg_end and len(records) < max_records:
+                        payload = _read_record(f)
+                        if payload is None:
+                            break
+                        if current >= offset:
+                            records.append(json.loads(payload.decode("utf-8")))
+                        current += 1
+                except WALCorruptionError as e:
+                    # Segmento antiguo dañado: se salta el resto para no bloquear el drenado
+                    log.warning(f"⚠️ WAL: registro corrupto en {_segment_name(base)} offset {current} ({e}), saltando segmento")
+                    current = seg_end
+                offset = max(offset, current)
+                if offset >= seg_end:
+                    idx += 1
+                else:
+                    cursor = (offset, base, f.tell())
+                    if remember:
+                        with self._lock:
+                            self._cursor = cursor
+        return records, offset
+
+    # ── Confirmación ──
+    def commit(self, offset):
+        """Persiste el offset confirmado y borra los segmentos que ya no se necesitan."""
+        with self._lock:
+            if offset <= self._committed:
+                return
+            offset = min(offset, self._next_offset)
+            path = os.path.join(self.directory, _COMMIT_FILE)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(str(offset))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            _fsync_dir(self.directory)
+            self._committed = offset
+
+            # Un segmento sobra cuando el siguiente empieza en o antes del offset confirmado
+            while len(self._segments) > 1 and self._segments[1] <= offset:
+                base = self._segments.pop(0)
+                try:
+                    os.remove(self._segment_path(base))
+                except FileNotFoundError:
+                    pass
+
+    @property
+    def committed(self):
+        with self._lock:
+            return self._committed
+
+    def pending(self):
+        """Número de registros escritos pero aún no confirmados."""
+        with self._lock:
+            return self._next_offset - self._committed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "committed_offset": self._committed,
+                "next_offset": self._next_offset,
+                "pending": self._next_offset - self._committed,
+                "segments": len(self._segments),
+            }
+
+    def close(self):
+        with self._lock:
+            self._active.close()
+
+    def remove_files(self):
+        """Cierra el log y borra sus segmentos y committed.offset (p. ej. un spill ya vaciado)."""
+        with self._lock:
+            self._active.close()
+            for name in os.listdir(self.directory):
+                if (name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)) or name == _COMMIT_FILE:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass